@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import permissions
 
 
@@ -5,3 +6,16 @@ class OwnerPermission(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         return request.user == obj.user
 
+
+
+class LocalOrAdminPermission(permissions.BasePermission):
+    '''
+    Доступ для администратора, с локального адреса - только при METRICS_ALLOW_LOCAL = True.
+    За обратным прокси все запросы приходят с локального адреса, поэтому по умолчанию он не учитывается.
+    '''
+    local_addresses = ('127.0.0.1', '::1')
+
+    def has_permission(self, request, view):
+        if getattr(settings, 'METRICS_ALLOW_LOCAL', False) and request.META.get('REMOTE_ADDR') in self.local_addresses:
+            return True
+        return bool(request.user and request.user.is_staff)
@@ -0,0 +1,52 @@
+from django.utils.timezone import now
+from djoser import signals
+from djoser.compat import get_user_email
+from djoser.conf import settings as djoser_settings
+from djoser.views import UserViewSet
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.views import exception_handler
+
+
+def activate_user(request, uid, token):
+    '''
+    Активация пользователя по uid и токену из письма, как в UserViewSet.activation Djoser, без HTTP-запроса
+    '''
+    serializer = djoser_settings.SERIALIZERS.activation(data={'uid': uid, 'token': token},
+                                                       context={'request': request, 'view': UserViewSet()})
+    serializer.is_valid(raise_exception=True)
+    user = serializer.user
+    user.is_active = True
+    user.save(update_fields=['is_active'])
+    signals.user_activated.send(sender=UserViewSet, user=user, request=request)
+    if djoser_settings.SEND_CONFIRMATION_EMAIL:
+        djoser_settings.EMAIL.confirmation(request, {'user': user}).send([get_user_email(user)])
+    return user
+
+
+def confirm_password_reset(request, data):
+    '''
+    Смена пароля по uid и токену из письма, как в UserViewSet.reset_password_confirm Djoser, без HTTP-запроса
+    '''
+    serializer = djoser_settings.SERIALIZERS.password_reset_confirm(
+        data=data, context={'request': request, 'view': UserViewSet()})
+    serializer.is_valid(raise_exception=True)
+    user = serializer.user
+    user.set_password(serializer.data['new_password'])
+    user.last_login = now()
+    user.save(update_fields=['password', 'last_login'])
+    if djoser_settings.PASSWORD_CHANGED_EMAIL_CONFIRMATION:
+        djoser_settings.EMAIL.password_changed_confirmation(request, {'user': user}).send([get_user_email(user)])
+    return user
+
+
+def djoser_response_text(action, *args):
+    '''
+    Тело ответа, которое вернул бы эндпоинт Djoser: пустое при успехе, JSON ошибки при отказе
+    '''
+    try:
+        action(*args)
+    except APIException as error:
+        response = exception_handler(error, {})
+        return JSONRenderer().render(response.data).decode()
+    return ''
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DbackendConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'dbackend'
+
+    def ready(self):
+        from dbackend import basket, cards, cache, offers, shop_orders  # noqa: F401
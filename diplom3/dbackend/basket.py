@@ -0,0 +1,315 @@
+import json
+
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from dbackend.importer import PriceListImporter
+from dbackend.models import Contact, Order, OrderItem, ProductInfo
+from dbackend.notifications import notify_order_placed
+from dbackend.serializers import ContactSerializer
+from dbackend.signals import catalog_updated, stock_updated
+
+CHUNK_SIZE = 1000
+
+TOTALS_FIELDS = ['items_count', 'total_sum', 'shop_totals']
+
+
+class BasketError(ValueError):
+    '''
+    Ошибка изменения корзины: errors - строка или словарь {id позиции: описание}
+    '''
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def parse_items(items):
+    '''
+    Список позиций из запроса: json строка или уже разобранный список
+    '''
+    if not items:
+        raise BasketError('Не указаны все необходимые аргументы')
+    if isinstance(items, str):
+        try:
+            items = json.loads(items)
+        except ValueError:
+            raise BasketError('Неверный формат запроса')
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        raise BasketError('Неверный формат запроса')
+    return items
+
+
+def _positive_int(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    return value if isinstance(value, int) and value > 0 else None
+
+
+def get_basket(user_id):
+    '''
+    Корзина пользователя, заблокированная до конца транзакции: параллельные изменения корзины
+    одного пользователя выполняются по очереди
+    '''
+    basket, _ = Order.objects.select_for_update().get_or_create(user_id=user_id, status='basket')
+    return basket
+
+
+def order_totals(order):
+    return {field: getattr(order, field) for field in TOTALS_FIELDS}
+
+
+def apply_changes(order, changes, save=True):
+    '''
+    Изменение сохраненных итогов заказа на разницу без пересчета по строкам:
+    changes - тройки (магазин, изменение количества, изменение суммы). Заказ должен быть заблокирован.
+    '''
+    shop_totals = dict(order.shop_totals)
+    for shop_id, quantity, amount in changes:
+        order.items_count += quantity
+        order.total_sum += amount
+        subtotal = shop_totals.get(str(shop_id), {'items_count': 0, 'total_sum': 0})
+        subtotal = {'items_count': subtotal['items_count'] + quantity, 'total_sum': subtotal['total_sum'] + amount}
+        if subtotal['items_count']:
+            shop_totals[str(shop_id)] = subtotal
+        else:
+            shop_totals.pop(str(shop_id), None)
+    order.shop_totals = shop_totals
+    if save:
+        order.save(update_fields=TOTALS_FIELDS)
+
+
+def compute_totals(order_ids):
+    '''
+    Итоги заказов по строкам одним запросом: {id заказа: {items_count, total_sum, shop_totals}}.
+    Строки оформленных заказов считаются по ценам на момент оформления, строки корзин - по текущим.
+    '''
+    totals = {pk: {'items_count': 0, 'total_sum': 0, 'shop_totals': {}} for pk in order_ids}
+    for order_id, shop_id, quantity, amount in OrderItem.objects.filter(order_id__in=order_ids).values(
+            'order_id', 'product_info__shop_id').annotate(
+            items=Sum('quantity'), amount=Sum(F('quantity') * Coalesce('price', 'product_info__price'))).order_by(
+            'order_id', 'product_info__shop_id').values_list(
+            'order_id', 'product_info__shop_id', 'items', 'amount'):
+        order = totals[order_id]
+        order['items_count'] += quantity
+        order['total_sum'] += amount
+        order['shop_totals'][str(shop_id)] = {'items_count': quantity, 'total_sum': amount}
+    return totals
+
+
+def refresh_order_totals(order_ids):
+    '''
+    Пересчет итогов заказов по строкам, по пакетам: блокировка заказов, один запрос на чтение и один на запись
+    '''
+    order_ids = sorted(set(order_ids))
+    for start in range(0, len(order_ids), CHUNK_SIZE):
+        with transaction.atomic():
+            # Блокировка в порядке id, как и в изменениях корзины: одна строка заказа за раз
+            chunk = list(Order.objects.select_for_update().filter(
+                id__in=order_ids[start:start + CHUNK_SIZE]).order_by('id').values_list('id', flat=True))
+            totals = compute_totals(chunk)
+            Order.objects.bulk_update([Order(id=pk, **totals[pk]) for pk in chunk], TOTALS_FIELDS)
+
+
+def add_items(user_id, items):
+    '''
+    Добавление позиций в корзину. Количество суммируется с уже лежащим в корзине и проверяется
+    по остатку одним запросом, строки корзины вставляются или обновляются одним запросом.
+    Возвращает (создано строк, обновлено строк, итоги корзины).
+    '''
+    quantities = {}
+    for item in parse_items(items):
+        product_info = _positive_int(item.get('product_info'))
+        quantity = _positive_int(item.get('quantity'))
+        if product_info is None or quantity is None:
+            raise BasketError('Неверный формат запроса')
+        quantities[product_info] = quantities.get(product_info, 0) + quantity
+
+    with transaction.atomic():
+        basket = get_basket(user_id)
+        in_basket = OrderItem.objects.filter(order_id=basket.id, product_info_id=OuterRef('pk')).values('quantity')
+        offers = {pk: (stock, status, current, shop_id, price) for pk, stock, status, current, shop_id, price in
+                  ProductInfo.objects.filter(id__in=quantities).annotate(in_basket=Subquery(in_basket)).values_list(
+                      'id', 'quantity', 'shop__status', 'in_basket', 'shop_id', 'price')}
+
+        errors = {}
+        for pk, quantity in quantities.items():
+            if pk not in offers:
+                errors[pk] = 'Товар не найден'
+                continue
+            stock, status, current = offers[pk][:3]
+            if not status:
+                errors[pk] = 'Магазин не принимает заказы'
+            elif (current or 0) + quantity > stock:
+                errors[pk] = f'Недостаточно товара, доступно {stock}'
+        if errors:
+            raise BasketError(errors)
+
+        OrderItem.objects.bulk_create(
+            [OrderItem(order_id=basket.id, product_info_id=pk, quantity=(offers[pk][2] or 0) + quantity)
+             for pk, quantity in sorted(quantities.items())],
+            update_conflicts=True, unique_fields=['order', 'product_info'], update_fields=['quantity'])
+        apply_changes(basket, [(offers[pk][3], quantity, quantity * offers[pk][4])
+                               for pk, quantity in quantities.items()])
+    updated = sum(1 for pk in quantities if offers[pk][2] is not None)
+    return len(quantities) - updated, updated, order_totals(basket)
+
+
+def update_items(user_id, items):
+    '''
+    Изменение количества в строках корзины: строки и остатки загружаются одним запросом,
+    новое количество записывается одним UPDATE с CASE. Возвращает (обновлено строк, итоги корзины).
+    '''
+    quantities = {}
+    for item in parse_items(items):
+        pk = _positive_int(item.get('id'))
+        quantity = _positive_int(item.get('quantity'))
+        if pk is None or quantity is None:
+            raise BasketError('Неверный формат запроса')
+        quantities[pk] = quantity
+
+    with transaction.atomic():
+        basket = get_basket(user_id)
+        lines = {pk: (current, stock, status, shop_id, price) for pk, current, stock, status, shop_id, price in
+                 OrderItem.objects.filter(order_id=basket.id, id__in=quantities).values_list(
+                     'id', 'quantity', 'product_info__quantity', 'product_info__shop__status',
+                     'product_info__shop_id', 'product_info__price')}
+
+        errors = {}
+        for pk, quantity in quantities.items():
+            if pk not in lines:
+                errors[pk] = 'Позиция не найдена в корзине'
+                continue
+            current, stock, status = lines[pk][:3]
+            if quantity > current and not status:
+                errors[pk] = 'Магазин не принимает заказы'
+            elif quantity > stock:
+                errors[pk] = f'Недостаточно товара, доступно {stock}'
+        if errors:
+            raise BasketError(errors)
+
+        changed = [OrderItem(id=pk, quantity=quantity) for pk, quantity in sorted(quantities.items())
+                   if quantity != lines[pk][0]]
+        OrderItem.objects.bulk_update(changed, ['quantity'])
+        apply_changes(basket, [(lines[item.id][3], item.quantity - lines[item.id][0],
+                                (item.quantity - lines[item.id][0]) * lines[item.id][4]) for item in changed])
+    return len(changed), order_totals(basket)
+
+
+def delete_items(user_id, ids):
+    '''
+    Удаление строк корзины по списку id через запятую. Возвращает (удалено строк, итоги корзины).
+    '''
+    ids = {int(pk) for pk in str(ids or '').split(',') if pk.strip().isdigit()}
+    if not ids:
+        raise BasketError('Не указаны все необходимые аргументы')
+    with transaction.atomic():
+        basket = get_basket(user_id)
+        lines = list(OrderItem.objects.filter(order_id=basket.id, id__in=ids).values_list(
+            'id', 'product_info__shop_id', 'quantity', 'product_info__price'))
+        OrderItem.objects.filter(id__in=[pk for pk, _, _, _ in lines]).delete()
+        apply_changes(basket, [(shop_id, -quantity, -quantity * price) for _, shop_id, quantity, price in lines])
+    return len(lines), order_totals(basket)
+
+
+def _checkout_contact(user_id, contact):
+    '''
+    Контакт заказа: id контакта пользователя или данные нового контакта
+    '''
+    if isinstance(contact, dict):
+        serializer = ContactSerializer(data={**contact, 'user': user_id})
+        if not serializer.is_valid():
+            raise BasketError(serializer.errors)
+        return serializer.save()
+    pk = _positive_int(contact)
+    contact = Contact.objects.filter(id=pk, user_id=user_id).first() if pk else None
+    if contact is None:
+        raise BasketError('Контакт не найден')
+    return contact
+
+
+def checkout(user_id, contact):
+    '''
+    Оформление корзины в заказ со списанием остатков в одной транзакции.
+    Позиции блокируются в порядке id, поэтому одновременные оформления с общими позициями
+    ждут друг друга, а не взаимно блокируются. Остаток уменьшается одним условным UPDATE,
+    который не даст уйти в минус, даже если проверка по заблокированным строкам была бы пропущена.
+    '''
+    with transaction.atomic():
+        basket = Order.objects.select_for_update().filter(user_id=user_id, status='basket').first()
+        lines = dict(OrderItem.objects.filter(order_id=basket.id).values_list(
+            'product_info_id', 'quantity')) if basket else {}
+        if not lines:
+            raise BasketError('Корзина пуста')
+        contact = _checkout_contact(user_id, contact)
+
+        offers = {pk: (stock, status, shop_id, product_id, price) for pk, stock, status, shop_id, product_id, price in
+                  ProductInfo.objects.select_for_update(of=('self',)).filter(id__in=lines).order_by('id').values_list(
+                      'id', 'quantity', 'shop__status', 'shop_id', 'product_id', 'price')}
+        errors = {}
+        for pk, quantity in lines.items():
+            stock, status = offers[pk][:2]
+            if not status:
+                errors[pk] = 'Магазин не принимает заказы'
+            elif quantity > stock:
+                errors[pk] = f'Недостаточно товара, доступно {stock}'
+        if errors:
+            raise BasketError(errors)
+
+        ordered = Case(*[When(id=pk, then=quantity) for pk, quantity in lines.items()])
+        reserved = ProductInfo.objects.filter(id__in=lines, quantity__gte=ordered).update(
+            quantity=F('quantity') - ordered)
+        if reserved != len(lines):
+            raise BasketError('Остатки изменились, повторите оформление')
+        # Цены фиксируются до сохранения заказа: по ним строятся заказы магазинов
+        OrderItem.objects.filter(order_id=basket.id).update(price=Case(
+            *[When(product_info_id=pk, then=offers[pk][4]) for pk in lines]))
+
+        # Итоги заказа - по тем же ценам, а не накопленные в корзине
+        basket.items_count, basket.total_sum, basket.shop_totals = 0, 0, {}
+        apply_changes(basket, [(offers[pk][2], quantity, quantity * offers[pk][4]) for pk, quantity in lines.items()],
+                      save=False)
+
+        basket.status = 'new'
+        basket.contact = contact
+        basket.dt = timezone.now()
+        basket.save(update_fields=['status', 'contact', 'dt', *TOTALS_FIELDS])
+        notify_order_placed(basket, {offer[2] for offer in offers.values()})
+        # Карточки, сводки предложений и кэш обновляются после фиксации, не удерживая блокировки остатков
+        shop_ids = sorted({offer[2] for offer in offers.values()})
+        product_ids = sorted({offer[3] for offer in offers.values()})
+        transaction.on_commit(lambda: stock_updated.send(
+            sender=checkout, shop_ids=shop_ids, product_info_ids=sorted(lines), product_ids=product_ids))
+    return basket
+
+
+def refresh_shop_basket_totals(shop_ids):
+    '''
+    Пересчет итогов корзин, в которых есть позиции указанных магазинов. Корзины ищутся по ключам
+    shop_totals, а не по строкам: так находятся и корзины, чьи строки удалены вместе с позициями магазина.
+    В PostgreSQL оператор ?| использует частичный GIN индекс order_basket_shop_totals_idx.
+    '''
+    refresh_order_totals(Order.objects.filter(status='basket', shop_totals__has_any_keys=[
+        str(shop_id) for shop_id in shop_ids]).values_list('id', flat=True))
+
+
+@receiver(catalog_updated, sender=PriceListImporter)
+def refresh_updated_basket_totals(sender, shop_ids=(), product_ids=(), **kwargs):
+    # Цены меняет только импорт, а удаление позиций при импорте удаляет и строки корзин.
+    # Пересчет после фиксации импорта, чтобы не держать блокировки корзин вместе с блокировками каталога.
+    if shop_ids and product_ids:
+        transaction.on_commit(lambda: refresh_shop_basket_totals(shop_ids))
+
+
+@receiver(post_save, sender=ProductInfo)
+def refresh_product_info_basket_totals(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if not raw and not created and (update_fields is None or 'price' in update_fields):
+        order_ids = list(Order.objects.filter(status='basket', ordered_items__product_info=instance).values_list(
+            'id', flat=True))
+        transaction.on_commit(lambda: refresh_order_totals(order_ids))
@@ -0,0 +1,215 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.response import Response
+
+from dbackend.models import Shop, Category, Product, Parameter, ProductInfo, ProductParameter, CatalogVersion
+from dbackend.signals import catalog_updated, on_commit_batch, stock_updated
+
+# Ответы хранятся в памяти процесса, версии - в таблице CatalogVersion, общей для всех процессов:
+# ключи ответов содержат версию, поэтому после смены версии в любом процессе старые ответы не отдаются
+CACHE_ALIAS = 'catalog'
+
+# Версия списков магазинов, категорий и продуктов
+GLOBAL_VERSION_KEY = 'catalog:version'
+# Общая версия всех списков товаров магазинов, меняется при правке продуктов, категорий и параметров
+SHOPS_VERSION_KEY = 'catalog:version:shops'
+# Версия списка товаров одного магазина
+SHOP_VERSION_KEY = 'catalog:version:shop:{}'
+# Версии остатков: общая для сведений о продуктах и по магазину для списков его товаров.
+# Меняются при оформлении и отмене заказов, индексы поиска от них не зависят
+STOCK_VERSION_KEY = 'catalog:version:stock'
+STOCK_SHOP_VERSION_KEY = 'catalog:version:stock:shop:{}'
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _versions(keys):
+    '''
+    Версии по ключам одним запросом
+    '''
+    versions = dict(CatalogVersion.objects.filter(key__in=keys).values_list('key', 'version'))
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # Ключ создается один раз; одновременно созданный другим процессом не перезаписывается
+        CatalogVersion.objects.bulk_create([CatalogVersion(key=key, version=time.time_ns()) for key in missing],
+                                           ignore_conflicts=True)
+        versions.update(CatalogVersion.objects.filter(key__in=missing).values_list('key', 'version'))
+    return [versions.get(key) for key in keys]
+
+
+def _bump(keys):
+    # Все ключи одним INSERT ... ON CONFLICT. Новое значение от времени вместо инкремента:
+    # два разных значения всегда отличаются от прочитанного ранее, чтение перед записью не нужно
+    version = time.time_ns()
+    CatalogVersion.objects.bulk_create([CatalogVersion(key=key, version=version) for key in sorted(set(keys))],
+                                       update_conflicts=True, unique_fields=['key'], update_fields=['version'])
+
+
+def bump_catalog_version(shop_ids=(), all_shops=False):
+    '''
+    Новая версия каталога после фиксации транзакции
+    '''
+    keys = [GLOBAL_VERSION_KEY] + [SHOP_VERSION_KEY.format(shop_id) for shop_id in shop_ids if shop_id]
+    if all_shops:
+        keys.append(SHOPS_VERSION_KEY)
+    transaction.on_commit(lambda: _bump(keys))
+
+
+def bump_stock_version(shop_ids=()):
+    '''
+    Новая версия остатков после фиксации транзакции, версии каталога не меняются
+    '''
+    keys = [STOCK_VERSION_KEY] + [STOCK_SHOP_VERSION_KEY.format(shop_id) for shop_id in shop_ids if shop_id]
+    transaction.on_commit(lambda: _bump(keys))
+
+
+def catalog_versions(shop_id=None, stock=False):
+    if shop_id is None:
+        return tuple(_versions([GLOBAL_VERSION_KEY, STOCK_VERSION_KEY] if stock else [GLOBAL_VERSION_KEY]))
+    return tuple(_versions([SHOPS_VERSION_KEY, SHOP_VERSION_KEY.format(shop_id),
+                            STOCK_SHOP_VERSION_KEY.format(shop_id)]))
+
+
+class ShopIndexes:
+    '''
+    Индексы по магазинам в памяти процесса, согласованные с версиями каталога из общей таблицы,
+    поэтому изменения, сделанные в других процессах, тоже приводят к пересборке.
+    refresh() пересобирает индекс только тех магазинов, чья версия изменилась,
+    а после смены общей версии магазинов - все. Индекс магазина строит shop_index_class(shop_id).
+    '''
+    shop_index_class = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.shops = {}
+        self.versions = {}
+        self.global_version = None
+        self.shops_version = None
+
+    def refresh(self):
+        global_version = catalog_versions()
+        if global_version == self.global_version:
+            return
+        with self.lock:
+            if global_version == self.global_version:
+                return
+            shop_ids = list(Shop.objects.values_list('id', flat=True))
+            # Версии всех магазинов одним обращением к общему кэшу
+            all_shops, *shop_versions = _versions([SHOPS_VERSION_KEY] + [SHOP_VERSION_KEY.format(shop_id)
+                                                                         for shop_id in shop_ids])
+            shops = dict(self.shops) if all_shops == self.shops_version else {}
+            versions = dict(zip(shop_ids, shop_versions))
+            for shop_id, version in versions.items():
+                if shop_id not in shops or self.versions.get(shop_id) != version:
+                    shops[shop_id] = self.shop_index_class(shop_id)
+            self.shops = {shop_id: shops[shop_id] for shop_id in versions}
+            self.versions = versions
+            self.shops_version = all_shops
+            self.global_version = global_version
+
+
+def cached_catalog_response(shop_kwarg=None, stock=False):
+    '''
+    Кэширование ответа метода get по версии каталога и параметрам запроса.
+    shop_kwarg - имя аргумента url с id магазина, тогда ответ зависит только от версий этого магазина,
+    включая его остатки. stock - ответ без магазина содержит остатки и зависит от их общей версии.
+    Ответ отдается с ETag, при совпадении If-None-Match возвращается 304 без тела.
+    '''
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            shop_id = kwargs.get(shop_kwarg) if shop_kwarg else None
+            # Хост входит в ключ, так как ссылки постраничного вывода абсолютные
+            key_source = repr((view.__class__.__name__, catalog_versions(shop_id, stock), request.get_host(),
+                               sorted(kwargs.items()), sorted(request.query_params.lists())))
+            digest = hashlib.sha1(key_source.encode()).hexdigest()
+            etag = f'"{digest}"'
+            if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+                return Response(status=304, headers={'ETag': etag})
+
+            cache = _cache()
+            key = f'catalog:response:{digest}'
+            data = cache.get(key)
+            if data is None:
+                response = method(view, request, *args, **kwargs)
+                if not isinstance(response, Response) or response.status_code != 200:
+                    return response
+                data = response.data
+                cache.set(key, data)
+            return Response(data, headers={'ETag': etag})
+
+        return wrapper
+
+    return decorator
+
+
+@receiver(catalog_updated)
+def bump_updated_catalog(sender, shop_ids=(), **kwargs):
+    bump_catalog_version(shop_ids)
+
+
+@receiver(stock_updated)
+def bump_updated_stock(sender, shop_ids=(), **kwargs):
+    bump_stock_version(shop_ids)
+
+
+@receiver(post_save, sender=Shop)
+def bump_shop(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_catalog_version([instance.id])
+
+
+@receiver(post_save, sender=ProductInfo)
+def bump_product_info(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_catalog_version([instance.shop_id])
+
+
+@receiver(post_save, sender=ProductParameter)
+def bump_product_parameter(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_catalog_version(ProductInfo.objects.filter(id=instance.product_info_id).values_list(
+            'shop_id', flat=True))
+
+
+def _bump_shops(shop_ids):
+    _bump([GLOBAL_VERSION_KEY] + [SHOP_VERSION_KEY.format(shop_id) for shop_id in shop_ids])
+
+
+def _bump_product_info_shops(product_info_ids):
+    # Позиции, удаленные в той же транзакции, меняют версию своего магазина сами
+    _bump_shops(set(ProductInfo.objects.filter(id__in=product_info_ids).values_list('shop_id', flat=True)))
+
+
+# Удаление приходит сигналом на каждую строку, в том числе каскадное: версии меняются один раз после фиксации
+@receiver(post_delete, sender=Shop)
+def bump_deleted_shop(sender, instance, **kwargs):
+    on_commit_batch(_bump_shops, [instance.id])
+
+
+@receiver(post_delete, sender=ProductInfo)
+def bump_deleted_product_info(sender, instance, **kwargs):
+    on_commit_batch(_bump_shops, [instance.shop_id])
+
+
+@receiver(post_delete, sender=ProductParameter)
+def bump_deleted_product_parameter(sender, instance, **kwargs):
+    on_commit_batch(_bump_product_info_shops, [instance.product_info_id])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Parameter)
+def bump_all_shops(sender, raw=False, **kwargs):
+    if not raw:
+        bump_catalog_version(all_shops=True)
@@ -0,0 +1,110 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from dbackend.models import ProductInfo, ProductParameter, ProductCard, Product, Category, Parameter
+from dbackend.serializers import ProductInfoSerializer
+from dbackend.signals import catalog_updated, on_commit_batch, stock_updated
+
+CHUNK_SIZE = 1000
+
+
+def build_card(product_info, product_parameters):
+    '''
+    Карточка в формате ProductInfoSerializer
+    '''
+    product = product_info.product
+    return {
+        'id': product_info.id,
+        'product': {
+            'name': product.name,
+            'category': product.category.name,
+            'id': product.id,
+        },
+        'shop': product_info.shop_id,
+        'name': product_info.name,
+        'quantity': product_info.quantity,
+        'price': product_info.price,
+        'price_rrc': product_info.price_rrc,
+        'product_parameters': [{'parameter': product_parameter.parameter.name, 'value': product_parameter.value}
+                               for product_parameter in product_parameters],
+    }
+
+
+def card_queryset(queryset):
+    return ProductInfoSerializer.setup_eager_loading(queryset)
+
+
+def rebuild_product_cards(product_info_ids):
+    '''
+    Пересборка карточек для указанных позиций, по два-три запроса на пакет
+    '''
+    product_info_ids = sorted(set(product_info_ids))
+    for start in range(0, len(product_info_ids), CHUNK_SIZE):
+        product_infos = card_queryset(ProductInfo.objects.filter(id__in=product_info_ids[start:start + CHUNK_SIZE]))
+        cards = []
+        for product_info in product_infos:
+            product_parameters = product_info.product_parameters.all()
+            cards.append(ProductCard(product_info_id=product_info.id,
+                                     shop_id=product_info.shop_id,
+                                     product_id=product_info.product_id,
+                                     data=build_card(product_info, product_parameters),
+                                     parameters={product_parameter.parameter.name: product_parameter.value
+                                                 for product_parameter in product_parameters}))
+        ProductCard.objects.bulk_create(cards, update_conflicts=True, unique_fields=['product_info'],
+                                        update_fields=['shop', 'product', 'data', 'parameters'])
+
+
+@receiver(catalog_updated)
+@receiver(stock_updated)
+def rebuild_updated_cards(sender, product_info_ids=(), **kwargs):
+    rebuild_product_cards(product_info_ids)
+
+
+@receiver(post_save, sender=ProductInfo)
+def rebuild_product_info_card(sender, instance, raw=False, **kwargs):
+    if not raw:
+        rebuild_product_cards([instance.id])
+
+
+@receiver(post_save, sender=ProductParameter)
+def rebuild_product_parameter_card(sender, instance, raw=False, **kwargs):
+    if not raw:
+        rebuild_product_cards([instance.product_info_id])
+
+
+@receiver(post_delete, sender=ProductParameter)
+def rebuild_deleted_parameter_card(sender, instance, **kwargs):
+    # После фиксации: вместе с параметрами может удаляться и позиция, тогда карточка не нужна
+    on_commit_batch(rebuild_product_cards, [instance.product_info_id])
+
+
+@receiver(post_save, sender=Product)
+def rebuild_product_cards_for_product(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        rebuild_product_cards(ProductInfo.objects.filter(product_id=instance.id).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Category)
+def rebuild_product_cards_for_category(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        rebuild_product_cards(ProductInfo.objects.filter(product__category_id=instance.id).values_list(
+            'id', flat=True))
+
+
+@receiver(post_save, sender=Parameter)
+def rebuild_product_cards_for_parameter(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        rebuild_product_cards(ProductParameter.objects.filter(parameter_id=instance.id).values_list(
+            'product_info_id', flat=True))
+
+
+@receiver(pre_delete, sender=Parameter)
+def collect_parameter_cards(sender, instance, **kwargs):
+    # Строки параметров удаляются каскадом раньше самого параметра, позиции запоминаются до удаления
+    instance.card_product_info_ids = list(ProductParameter.objects.filter(parameter_id=instance.id).values_list(
+        'product_info_id', flat=True))
+
+
+@receiver(post_delete, sender=Parameter)
+def rebuild_deleted_parameter_cards(sender, instance, **kwargs):
+    on_commit_batch(rebuild_product_cards, getattr(instance, 'card_product_info_ids', ()))
@@ -0,0 +1,117 @@
+import heapq
+from bisect import bisect_left, bisect_right
+
+from dbackend.cache import ShopIndexes
+from dbackend.models import ProductInfo, ProductParameter
+
+EMPTY = frozenset()
+
+
+def normalize_value(value):
+    return ' '.join(str(value).split()).casefold()
+
+
+def parse_number(value):
+    try:
+        return float(str(value).strip().replace(',', '.'))
+    except ValueError:
+        return None
+
+
+class _SortedValues:
+    '''
+    Числовые значения с id позиций, отсортированные по значению, для выборки по диапазону
+    '''
+
+    def __init__(self, pairs):
+        pairs.sort()
+        self.values = [value for value, _ in pairs]
+        self.ids = [pk for _, pk in pairs]
+
+    def range(self, low=None, high=None):
+        start = 0 if low is None else bisect_left(self.values, low)
+        stop = len(self.values) if high is None else bisect_right(self.values, high)
+        return set(self.ids[start:stop])
+
+
+class ShopFacets:
+    '''
+    Инвертированный индекс позиций одного магазина:
+    (параметр, нормализованное значение) -> множество id позиций, числовые значения параметров и цены
+    отсортированы для выборки по диапазону.
+    '''
+
+    def __init__(self, shop_id):
+        self.shop_id = shop_id
+        self.ids = set()
+        self.categories = {}
+        self.values = {}
+        numbers = {}
+        prices = []
+        for pk, price, category_id in ProductInfo.objects.filter(shop_id=shop_id).values_list(
+                'id', 'price', 'product__category_id').iterator():
+            self.ids.add(pk)
+            self.categories.setdefault(category_id, set()).add(pk)
+            prices.append((price, pk))
+        for pk, name, value in ProductParameter.objects.filter(product_info__shop_id=shop_id).values_list(
+                'product_info_id', 'parameter__name', 'value').iterator():
+            self.values.setdefault(name, {}).setdefault(normalize_value(value), set()).add(pk)
+            number = parse_number(value)
+            if number is not None:
+                numbers.setdefault(name, []).append((number, pk))
+        self.prices = _SortedValues(prices)
+        self.numbers = {name: _SortedValues(pairs) for name, pairs in numbers.items()}
+
+    def search(self, category=None, price_min=None, price_max=None, equals=(), ranges=()):
+        sets = [self.ids]
+        if category is not None:
+            sets.append(self.categories.get(category, EMPTY))
+        if price_min is not None or price_max is not None:
+            sets.append(self.prices.range(price_min, price_max))
+        for name, value in equals:
+            sets.append(self.values.get(name, {}).get(normalize_value(value), EMPTY))
+        for name, low, high in ranges:
+            numbers = self.numbers.get(name)
+            sets.append(numbers.range(low, high) if numbers else EMPTY)
+        sets.sort(key=len)
+        result = set(sets[0])
+        for ids in sets[1:]:
+            if not result:
+                break
+            result &= ids
+        return result
+
+    def count_facets(self, ids, facets):
+        for name, values in self.values.items():
+            counts = facets.setdefault(name, {})
+            for value, value_ids in values.items():
+                count = len(value_ids & ids)
+                if count:
+                    counts[value] = counts.get(value, 0) + count
+
+
+class FacetIndex(ShopIndexes):
+    shop_index_class = ShopFacets
+
+    def search(self, shop=None, limit=50, **filters):
+        '''
+        Возвращает (количество, первые limit id по возрастанию, {параметр: {значение: количество}})
+        '''
+        self.refresh()
+        shops = self.shops
+        if shop is not None:
+            shops = {shop: shops[shop]} if shop in shops else {}
+        count = 0
+        first = []
+        facets = {}
+        for shop_facets in shops.values():
+            ids = shop_facets.search(**filters)
+            if not ids:
+                continue
+            count += len(ids)
+            first = heapq.nsmallest(limit, first + heapq.nsmallest(limit, ids))
+            shop_facets.count_facets(ids, facets)
+        return count, first, facets
+
+
+facet_index = FacetIndex()
@@ -0,0 +1,194 @@
+from collections import namedtuple
+from contextlib import contextmanager
+from hashlib import sha256
+from tempfile import SpooledTemporaryFile
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from yaml import AliasEvent, ScalarEvent, SequenceStartEvent, SequenceEndEvent, MappingStartEvent, MappingEndEvent, \
+    ScalarNode, SequenceNode, MappingNode
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+STREAMED_SECTIONS = ('goods',)
+
+# (подключение, чтение) в секундах
+FETCH_TIMEOUT = (5, 60)
+CHUNK_SIZE = 64 * 1024
+# Тело ответа больше этого размера сбрасывается из памяти во временный файл
+SPOOL_SIZE = 8 * 1024 * 1024
+
+FeedFetch = namedtuple('FeedFetch', ('stream', 'etag', 'last_modified', 'content_hash', 'modified'))
+
+
+def _build_session():
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10,
+                          max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                                            allowed_methods=('GET',)))
+    session = Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+session = _build_session()
+
+
+@contextmanager
+def open_source(source):
+    '''
+    Открывает прайс-лист по ссылке или из файла
+    '''
+    if source.startswith(('http://', 'https://')):
+        with open_feed(source) as stream:
+            yield stream
+    else:
+        with open(source, 'rb') as stream:
+            yield stream
+
+
+@contextmanager
+def open_feed(url):
+    '''
+    Открывает прайс-лист по ссылке как поток, тело ответа читается частями по мере разбора
+    '''
+    with session.get(url, stream=True, timeout=FETCH_TIMEOUT) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        yield response.raw
+
+
+@contextmanager
+def fetch_feed(url, etag='', last_modified='', content_hash=''):
+    '''
+    Условная загрузка прайс-листа.
+    Отправляет If-None-Match/If-Modified-Since из прошлой загрузки и считает sha256 тела по мере чтения.
+    modified=False, если сервер ответил 304 или содержимое совпало с прошлым, тогда stream не нужно разбирать.
+    Тело сохраняется в SpooledTemporaryFile, чтобы не держать большой прайс-лист в памяти.
+    '''
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    with session.get(url, headers=headers, stream=True, timeout=FETCH_TIMEOUT) as response:
+        if response.status_code == 304:
+            yield FeedFetch(None, etag, last_modified, content_hash, False)
+            return
+        response.raise_for_status()
+        digest = sha256()
+        with SpooledTemporaryFile(max_size=SPOOL_SIZE) as body:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                digest.update(chunk)
+                body.write(chunk)
+            body.seek(0)
+            new_hash = digest.hexdigest()
+            yield FeedFetch(body, response.headers.get('ETag', ''), response.headers.get('Last-Modified', ''),
+                            new_hash, new_hash != content_hash)
+
+
+def iter_feed(stream):
+    '''
+    Разбор прайс-листа по событиям YAML.
+    Возвращает пары (раздел, содержимое) в порядке следования в файле. Разделы из STREAMED_SECTIONS
+    отдаются генератором, который собирает элементы списка по одному, не держа в памяти весь документ.
+    '''
+    loader = SafeLoader(stream)
+    anchors = {}
+    try:
+        loader.get_event()  # StreamStartEvent
+        loader.get_event()  # DocumentStartEvent
+        if not isinstance(loader.get_event(), MappingStartEvent):
+            raise ValueError('Прайс-лист должен быть словарем с разделами shop, categories, goods')
+        while not loader.check_event(MappingEndEvent):
+            key = _construct(loader, anchors)
+            if key in STREAMED_SECTIONS and loader.check_event(SequenceStartEvent):
+                loader.get_event()
+                items = _iter_sequence(loader, anchors)
+                yield key, items
+                for _ in items:
+                    pass
+            else:
+                yield key, _construct(loader, anchors)
+    finally:
+        loader.dispose()
+
+
+def _iter_sequence(loader, anchors):
+    while not loader.check_event(SequenceEndEvent):
+        yield _construct(loader, anchors)
+    loader.get_event()
+
+
+def _construct(loader, anchors):
+    return loader.construct_document(_compose(loader, anchors))
+
+
+def _compose(loader, anchors):
+    '''
+    Сборка узла из событий парсера, аналог Composer.compose_node, доступный и для C-загрузчика
+    '''
+    event = loader.get_event()
+    if isinstance(event, AliasEvent):
+        return anchors[event.anchor]
+    if isinstance(event, ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(ScalarNode, event.value, event.implicit)
+        node = ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+    elif isinstance(event, SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(SequenceNode, None, event.implicit)
+        node = SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(SequenceEndEvent):
+            node.value.append(_compose(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+    else:
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(MappingNode, None, event.implicit)
+        node = MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(MappingEndEvent):
+            node.value.append((_compose(loader, anchors), _compose(loader, anchors)))
+        node.end_mark = loader.get_event().end_mark
+    if event.anchor is not None:
+        anchors[event.anchor] = node
+    return node
+
+
+def parse_feed_batches(source, queue, batch_size):
+    '''
+    Разбор прайс-листа в отдельном процессе.
+    В очередь передаются сообщения ('section', раздел, содержимое) для небольших разделов,
+    ('start', раздел, None), ('batch', раздел, пакет элементов)..., ('end', раздел, None) для потоковых,
+    в конце ('done', None, None) или ('error', None, текст ошибки).
+    '''
+    try:
+        with open_source(source) as stream:
+            for key, value in iter_feed(stream):
+                if key not in STREAMED_SECTIONS:
+                    queue.put(('section', key, value))
+                    continue
+                queue.put(('start', key, None))
+                batch = []
+                for item in value:
+                    batch.append(item)
+                    if len(batch) >= batch_size:
+                        queue.put(('batch', key, batch))
+                        batch = []
+                if batch:
+                    queue.put(('batch', key, batch))
+                queue.put(('end', key, None))
+    except Exception as error:
+        queue.put(('error', None, f'{type(error).__name__}: {error}'))
+    else:
+        queue.put(('done', None, None))
@@ -0,0 +1,348 @@
+import time
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+from dbackend.models import Shop, Category, ProductInfo, Product, Parameter, ProductParameter, OrderItem
+from dbackend.signals import catalog_updated
+
+BATCH_SIZE = 1000
+
+IMPORT_MODES = ('sync', 'full')
+
+PRODUCT_INFO_FIELDS = ('product_id', 'name', 'price', 'price_rrc', 'quantity')
+
+
+class PriceListImporter:
+    '''
+    Импорт прайс-листа магазина.
+    Категории, продукты и названия параметров разрешаются пакетами через словари в памяти,
+    позиции и их параметры записываются через bulk_create в одной транзакции.
+
+    Режимы:
+    sync - позиции сопоставляются с уже загруженными по id товара у поставщика,
+    в базу пишутся только добавленные, измененные и удаленные позиции;
+    full - позиции магазина удаляются и создаются заново, кроме тех, на которые ссылаются оформленные заказы:
+    они обновляются на месте по id товара у поставщика, как при синхронизации.
+
+    Позиции из оформленных заказов, которых нет в прайс-листе, не удаляются, а остаются с нулевым остатком.
+    Позиции, загруженные до появления id товара у поставщика, при синхронизации сопоставляются
+    по продукту и модели и получают id из прайс-листа, несопоставленные не удаляются.
+
+    on_progress(phase, rows) вызывается при смене раздела и после каждого пакета товаров.
+    Строка магазина блокируется до конца транзакции, поэтому импорты одного магазина выполняются по очереди.
+    '''
+
+    def __init__(self, user_id=None, mode='sync', batch_size=BATCH_SIZE, on_progress=None):
+        if mode not in IMPORT_MODES:
+            raise ValueError(f'Неизвестный режим импорта {mode}')
+        self.user_id = user_id
+        self.mode = mode
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.shop = None
+        self.goods_count = 0
+        self.phases = {}
+        self.changes = dict.fromkeys(('created', 'updated', 'deleted', 'retired', 'unchanged', 'parameters_created',
+                                      'parameters_updated', 'parameters_deleted'), 0)
+        self._products = {}
+        self._parameters = {}
+        self._seen = set()
+        self._legacy = None
+        self._queries = 0
+        self.touched_product_infos = set()
+        self.touched_products = set()
+
+    def run(self, sections):
+        '''
+        sections - пары (название раздела, содержимое) в порядке следования в файле:
+        shop, categories, goods
+        '''
+        started = time.perf_counter()
+        with transaction.atomic(), connection.execute_wrapper(self._count_query):
+            for name, value in sections:
+                self._progress(name)
+                if name == 'shop':
+                    self.import_shop(value)
+                elif name == 'categories':
+                    self.import_categories(value)
+                elif name == 'goods':
+                    self.import_goods(value)
+            if self.shop is not None:
+                with self._phase('projections'):
+                    catalog_updated.send(sender=self.__class__, shop_ids=[self.shop.id],
+                                         product_info_ids=self.touched_product_infos,
+                                         product_ids=self.touched_products)
+        return self.report(time.perf_counter() - started)
+
+    def report(self, elapsed):
+        return {
+            'shop': self.shop.id if self.shop else None,
+            'mode': self.mode,
+            'goods': self.goods_count,
+            'changes': self.changes,
+            'queries': sum(phase['queries'] for phase in self.phases.values()),
+            'time': round(elapsed, 3),
+            'phases': {name: {'queries': phase['queries'], 'time': round(phase['time'], 3)}
+                       for name, phase in self.phases.items()},
+        }
+
+    def _progress(self, phase):
+        if self.on_progress is not None:
+            self.on_progress(phase, self.goods_count)
+
+    def _count_query(self, execute, sql, params, many, context):
+        self._queries += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def _phase(self, name):
+        phase = self.phases.setdefault(name, {'queries': 0, 'time': 0.0})
+        queries = self._queries
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            phase['queries'] += self._queries - queries
+            phase['time'] += time.perf_counter() - started
+
+    def import_shop(self, shops):
+        with self._phase('shop'):
+            for item in shops:
+                if self.user_id is None:
+                    # Владелец не указан: используется ранее загруженный магазин с тем же названием.
+                    # Новый создается без владельца, одновременный импорт того же магазина упрется
+                    # в unique_ownerless_shop_name и получит уже созданную строку
+                    self.shop = Shop.objects.filter(name=item['name']).order_by('id').first()
+                    if self.shop is None:
+                        self.shop, _ = Shop.objects.get_or_create(name=item['name'], user=None, defaults={
+                            'url': item['url'], 'status': item['status']})
+                else:
+                    # Статус приема заказов из прайс-листа задается только при создании,
+                    # дальше им управляет ChangeShopStatus
+                    self.shop, created = Shop.objects.get_or_create(user_id=self.user_id, defaults={
+                        'name': item['name'], 'url': item['url'], 'status': item['status']})
+                    if not created and (self.shop.name, self.shop.url) != (item['name'], item['url']):
+                        self.shop.name, self.shop.url = item['name'], item['url']
+                        self.shop.save(update_fields=['name', 'url'])
+            if self.shop is not None:
+                self.shop = Shop.objects.select_for_update().get(id=self.shop.id)
+
+    def import_categories(self, categories):
+        if self.shop is None:
+            raise ValueError('Раздел shop должен предшествовать категориям')
+        with self._phase('categories'):
+            names = {category['id']: category['name'] for category in categories}
+            existing = Category.objects.in_bulk(list(names))
+            Category.objects.bulk_create([Category(id=pk, name=name) for pk, name in names.items()
+                                          if pk not in existing])
+            through = Category.shops.through
+            through.objects.bulk_create([through(category_id=pk, shop_id=self.shop.id) for pk in names],
+                                        ignore_conflicts=True)
+
+    def import_goods(self, goods):
+        if self.shop is None:
+            raise ValueError('Раздел shop должен предшествовать товарам')
+        kept = True
+        if self.mode == 'full':
+            with self._phase('cleanup'):
+                kept = self._remove_product_infos(list(ProductInfo.objects.filter(shop_id=self.shop.id).values_list(
+                    'id', 'product_id')), retire=False)
+        # Оставшиеся позиции из заказов сопоставляются с прайс-листом, без них позиции только создаются
+        write_batch = self._sync_batch if kept else self._write_batch
+        batch = []
+        for item in goods:
+            if item['id'] in self._seen:
+                continue
+            self._seen.add(item['id'])
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                write_batch(batch)
+                batch = []
+                self._progress('goods')
+        if batch:
+            write_batch(batch)
+            self._progress('goods')
+        if kept:
+            self._progress('cleanup')
+            self._delete_missing()
+
+    def _product_info_values(self, item):
+        return {
+            'product_id': self._products[(item['name'], item['category'])],
+            'name': item['model'],
+            'price': item['price'],
+            'price_rrc': item['price_rrc'],
+            'quantity': item['quantity'],
+        }
+
+    def _parameter_values(self, item):
+        return {self._parameters[name]: str(value) for name, value in (item.get('parameters') or {}).items()}
+
+    def _resolve_batch(self, batch):
+        with self._phase('products'):
+            self._resolve_products(batch)
+        with self._phase('parameters'):
+            self._resolve_parameters(batch)
+
+    def _write_batch(self, batch):
+        self._resolve_batch(batch)
+        self._create_product_infos(batch)
+        self.goods_count += len(batch)
+
+    def _create_product_infos(self, batch):
+        with self._phase('product_infos'):
+            product_infos = ProductInfo.objects.bulk_create([
+                ProductInfo(shop_id=self.shop.id, external_id=item['id'], **self._product_info_values(item))
+                for item in batch])
+        with self._phase('product_parameters'):
+            product_parameters = ProductParameter.objects.bulk_create([
+                ProductParameter(product_info_id=product_info.id, parameter_id=parameter_id, value=value)
+                for product_info, item in zip(product_infos, batch)
+                for parameter_id, value in self._parameter_values(item).items()])
+        self.changes['created'] += len(product_infos)
+        for product_info in product_infos:
+            self.touched_product_infos.add(product_info.id)
+            self.touched_products.add(product_info.product_id)
+        self.changes['parameters_created'] += len(product_parameters)
+
+    def _sync_batch(self, batch):
+        self._resolve_batch(batch)
+        with self._phase('diff'):
+            existing = {product_info.external_id: product_info for product_info in ProductInfo.objects.filter(
+                shop_id=self.shop.id, external_id__in=[item['id'] for item in batch]).only(
+                'id', 'external_id', *PRODUCT_INFO_FIELDS)}
+            adopted = self._adopt_legacy([item for item in batch if item['id'] not in existing])
+            existing.update(adopted)
+            current_parameters = {}
+            for pk, product_info_id, parameter_id, value in ProductParameter.objects.filter(
+                    product_info_id__in=[product_info.id for product_info in existing.values()]).values_list(
+                    'id', 'product_info_id', 'parameter_id', 'value'):
+                current_parameters.setdefault(product_info_id, {})[parameter_id] = (pk, value)
+
+            created_items, updated, parameters_created, parameters_updated, parameters_deleted = [], [], [], [], []
+            for item in batch:
+                product_info = existing.get(item['id'])
+                if product_info is None:
+                    created_items.append(item)
+                    continue
+                changed = item['id'] in adopted
+                old_product_id = product_info.product_id
+                for field, value in self._product_info_values(item).items():
+                    if getattr(product_info, field) != value:
+                        setattr(product_info, field, value)
+                        changed = True
+                current = current_parameters.get(product_info.id, {})
+                wanted = self._parameter_values(item)
+                for parameter_id, value in wanted.items():
+                    if parameter_id not in current:
+                        parameters_created.append(ProductParameter(product_info_id=product_info.id,
+                                                                   parameter_id=parameter_id, value=value))
+                        changed = True
+                    elif current[parameter_id][1] != value:
+                        parameters_updated.append(ProductParameter(id=current[parameter_id][0], value=value))
+                        changed = True
+                for parameter_id, (pk, _) in current.items():
+                    if parameter_id not in wanted:
+                        parameters_deleted.append(pk)
+                        changed = True
+                if changed:
+                    updated.append(product_info)
+                    self.touched_product_infos.add(product_info.id)
+                    self.touched_products.update((old_product_id, product_info.product_id))
+                else:
+                    self.changes['unchanged'] += 1
+
+        with self._phase('product_infos'):
+            ProductInfo.objects.bulk_update(updated, ('external_id', *PRODUCT_INFO_FIELDS))
+        with self._phase('product_parameters'):
+            ProductParameter.objects.bulk_create(parameters_created)
+            ProductParameter.objects.bulk_update(parameters_updated, ['value'])
+            if parameters_deleted:
+                ProductParameter.objects.filter(id__in=parameters_deleted).delete()
+        self._create_product_infos(created_items)
+        self.goods_count += len(batch)
+        self.changes['updated'] += len(updated)
+        self.changes['parameters_created'] += len(parameters_created)
+        self.changes['parameters_updated'] += len(parameters_updated)
+        self.changes['parameters_deleted'] += len(parameters_deleted)
+
+    def _adopt_legacy(self, items):
+        '''
+        Позиции без id у поставщика, сопоставленные с товарами пакета по продукту и модели
+        '''
+        if self._legacy is None:
+            # Загружается один раз за импорт: после первой синхронизации таких позиций не остается
+            self._legacy = {}
+            for product_info in ProductInfo.objects.filter(shop_id=self.shop.id, external_id__isnull=True).only(
+                    'id', 'external_id', *PRODUCT_INFO_FIELDS).order_by('id'):
+                self._legacy.setdefault((product_info.product_id, product_info.name), []).append(product_info)
+        adopted = {}
+        for item in items:
+            candidates = self._legacy.get((self._products[(item['name'], item['category'])], item['model']))
+            if candidates:
+                product_info = candidates.pop(0)
+                product_info.external_id = item['id']
+                adopted[item['id']] = product_info
+        return adopted
+
+    def _delete_missing(self):
+        product_infos = ProductInfo.objects.filter(shop_id=self.shop.id)
+        if self.mode == 'sync':
+            # Несопоставленные позиции без id у поставщика синхронизация не трогает
+            product_infos = product_infos.filter(external_id__isnull=False)
+        with self._phase('cleanup'):
+            self._remove_product_infos([
+                (pk, product_id) for pk, external_id, product_id in product_infos.values_list(
+                    'id', 'external_id', 'product_id').iterator()
+                if external_id is None or external_id not in self._seen])
+
+    def _remove_product_infos(self, product_infos, retire=True):
+        '''
+        Удаление позиций (id, id продукта). Позиции из оформленных заказов не удаляются вместе с историей заказов,
+        а остаются с нулевым остатком, с retire=False - без изменений. Возвращает, остались ли такие позиции.
+        '''
+        kept = False
+        for start in range(0, len(product_infos), self.batch_size):
+            chunk = dict(product_infos[start:start + self.batch_size])
+            ordered = set(OrderItem.objects.filter(product_info_id__in=chunk).exclude(
+                order__status='basket').values_list('product_info_id', flat=True).distinct())
+            deleted = [pk for pk in chunk if pk not in ordered]
+            if deleted:
+                ProductInfo.objects.filter(id__in=deleted).delete()
+            kept = kept or bool(ordered)
+            self.changes['deleted'] += len(deleted)
+            self.touched_products.update(chunk[pk] for pk in deleted)
+            if retire and ordered:
+                self.changes['retired'] += ProductInfo.objects.filter(id__in=ordered).exclude(quantity=0).update(
+                    quantity=0)
+                self.touched_products.update(chunk[pk] for pk in ordered)
+                self.touched_product_infos.update(ordered)
+        return kept
+
+    def _resolve_products(self, batch):
+        keys = {(item['name'], item['category']) for item in batch} - self._products.keys()
+        if not keys:
+            return
+        products = Product.objects.filter(name__in={name for name, _ in keys}).values_list('id', 'name', 'category_id')
+        for pk, name, category_id in products:
+            self._products.setdefault((name, category_id), pk)
+        # Продукт, созданный параллельным импортом, не нарушает уникальность, а возвращается с id
+        created = Product.objects.bulk_create([Product(name=name, category_id=category_id)
+                                               for name, category_id in keys if (name, category_id) not in self._products],
+                                              update_conflicts=True, unique_fields=['name', 'category'],
+                                              update_fields=['name'])
+        for product in created:
+            self._products[(product.name, product.category_id)] = product.id
+
+    def _resolve_parameters(self, batch):
+        names = {name for item in batch for name in (item.get('parameters') or {})} - self._parameters.keys()
+        if not names:
+            return
+        for pk, name in Parameter.objects.filter(name__in=names).values_list('id', 'name'):
+            self._parameters.setdefault(name, pk)
+        created = Parameter.objects.bulk_create([Parameter(name=name) for name in names
+                                                 if name not in self._parameters],
+                                                update_conflicts=True, unique_fields=['name'], update_fields=['name'])
+        for parameter in created:
+            self._parameters[parameter.name] = parameter.id
@@ -0,0 +1,89 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction, connection, DatabaseError
+from django.utils import timezone
+
+from dbackend.feeds import fetch_feed, iter_feed
+from dbackend.importer import PriceListImporter
+from dbackend.models import ImportJob, FeedSource
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = 1.0
+
+_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'IMPORT_WORKERS', 2), thread_name_prefix='import')
+
+# Прогресс пишется из отдельного потока со своим соединением,
+# иначе он не виден до окончания транзакции импорта
+_progress_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='import-progress')
+
+
+def enqueue_import(user_id, url, mode='sync', force=False):
+    '''
+    Создание задачи импорта, задача уходит в пул после фиксации транзакции
+    '''
+    job = ImportJob.objects.create(user_id=user_id, url=url, mode=mode, force=force)
+    transaction.on_commit(lambda: _executor.submit(run_import_job, job.id))
+    return job
+
+
+def run_import_job(job_id):
+    # Задача захватывается одним условным UPDATE: пул и resume_import_jobs не выполнят ее дважды
+    if not ImportJob.objects.filter(id=job_id, status='queued').update(status='running', phase='download',
+                                                                       started_at=timezone.now()):
+        return
+    job = ImportJob.objects.get(id=job_id)
+    # SQLite допускает одного писателя, промежуточный прогресс там не сохраняется
+    progress = _Progress(job.id) if connection.vendor != 'sqlite' else None
+    source, _ = FeedSource.objects.get_or_create(user_id=job.user_id, url=job.url)
+    if job.force:
+        source.etag = source.last_modified = source.content_hash = ''
+    try:
+        with fetch_feed(job.url, source.etag, source.last_modified, source.content_hash) as feed:
+            if feed.modified:
+                stats = PriceListImporter(job.user_id, mode=job.mode, on_progress=progress).run(
+                    iter_feed(feed.stream))
+    except Exception as error:
+        logger.exception('Import job %s failed', job.id)
+        ImportJob.objects.filter(id=job.id).update(status='failed', error=str(error), finished_at=timezone.now())
+    else:
+        now = timezone.now()
+        if feed.modified:
+            FeedSource.objects.filter(id=source.id).update(etag=feed.etag, last_modified=feed.last_modified,
+                                                           content_hash=feed.content_hash, checked_at=now,
+                                                           imported_at=now)
+            ImportJob.objects.filter(id=job.id).update(status='done', phase='done', rows_processed=stats['goods'],
+                                                       stats=stats, finished_at=now)
+        else:
+            # Тело не изменилось, но сервер мог выдать новые ETag и Last-Modified: без них следующая
+            # проверка снова скачает прайс-лист целиком
+            FeedSource.objects.filter(id=source.id).update(etag=feed.etag, last_modified=feed.last_modified,
+                                                           content_hash=feed.content_hash, checked_at=now)
+            ImportJob.objects.filter(id=job.id).update(status='done', phase='unchanged', finished_at=now)
+    finally:
+        connection.close()
+
+
+class _Progress:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.phase = None
+        self.reported = 0.0
+
+    def __call__(self, phase, rows):
+        now = time.monotonic()
+        if phase == self.phase and now - self.reported < PROGRESS_INTERVAL:
+            return
+        self.phase = phase
+        self.reported = now
+        _progress_executor.submit(_save_progress, self.job_id, phase, rows)
+
+
+def _save_progress(job_id, phase, rows):
+    try:
+        ImportJob.objects.filter(id=job_id, status='running').update(phase=phase, rows_processed=rows)
+    except DatabaseError:
+        logger.warning('Could not save progress of import job %s', job_id, exc_info=True)
@@ -0,0 +1,126 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.utils import timezone
+
+from dbackend.models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = getattr(settings, 'OUTBOX_BATCH_SIZE', 100)
+OUTBOX_MAX_ATTEMPTS = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5)
+# Задержка перед повторной отправкой в секундах, удваивается с каждой неудачной попыткой
+OUTBOX_RETRY_DELAY = getattr(settings, 'OUTBOX_RETRY_DELAY', 60)
+
+ERROR_MAX_LENGTH = 1000
+
+
+def outbox_email(message):
+    '''
+    Строка очереди по EmailMessage: текст и вариант text/html, вложения не поддерживаются
+    '''
+    if message.attachments:
+        raise ValueError('Письма с вложениями не поддерживаются очередью')
+    body, html_body = message.body, ''
+    if message.content_subtype == 'html':
+        body, html_body = '', message.body
+    for content, mimetype in getattr(message, 'alternatives', ()):
+        if mimetype == 'text/html':
+            html_body = content
+    return OutboxEmail(subject=message.subject, body=body, html_body=html_body, from_email=message.from_email,
+                       to=list(message.to), cc=list(message.cc), bcc=list(message.bcc),
+                       reply_to=list(message.reply_to), headers=dict(message.extra_headers))
+
+
+def email_message(email, connection=None):
+    message = EmailMultiAlternatives(email.subject, email.body or email.html_body, email.from_email, email.to,
+                                     email.bcc, connection=connection, headers=email.headers, cc=email.cc,
+                                     reply_to=email.reply_to)
+    if email.html_body:
+        if email.body:
+            message.attach_alternative(email.html_body, 'text/html')
+        else:
+            message.content_subtype = 'html'
+    return message
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    '''
+    Почтовый бэкенд, который не отправляет письма, а сохраняет их в OutboxEmail одним запросом
+    в текущей транзакции: при откате запроса письма тоже не уходят
+    '''
+
+    def send_messages(self, email_messages):
+        try:
+            emails = [outbox_email(message) for message in email_messages if message.recipients()]
+        except ValueError:
+            if not self.fail_silently:
+                raise
+            return 0
+        OutboxEmail.objects.bulk_create(emails)
+        return len(emails)
+
+
+def _defer(email, error, now):
+    # Ошибка любого рода оставляет письмо в очереди до исчерпания попыток
+    email.attempts += 1
+    email.error = str(error)[:ERROR_MAX_LENGTH]
+    if email.attempts >= OUTBOX_MAX_ATTEMPTS:
+        email.status = 'failed'
+    else:
+        email.next_attempt_at = now + timedelta(seconds=OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1))
+
+
+def deliver_batch(connection, batch_size=OUTBOX_BATCH_SIZE):
+    '''
+    Отправка пачки писем, срок отправки которых наступил, через одно соединение connection.
+    Строки блокируются до конца транзакции с пропуском уже заблокированных, поэтому несколько
+    обработчиков не отправят одно письмо дважды. Письмо, отправленное перед сбоем процесса до фиксации,
+    будет отправлено повторно. Если соединение не открывается, вся оставшаяся часть пачки откладывается
+    без попыток отправки. Возвращает (отправлено, ошибок, соединение доступно).
+    '''
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(OutboxEmail.objects.select_for_update(skip_locked=True).filter(
+            status='queued', next_attempt_at__lte=now).order_by('id')[:batch_size])
+        if not emails:
+            return 0, 0, True
+        sent = failed = 0
+        available = True
+        try:
+            connection.open()
+        except Exception as open_error:
+            logger.exception('Outbox connection failed')
+            available = False
+            connection_error = open_error
+        for email in emails:
+            if not available:
+                # Сервер недоступен: письмо откладывается, не дожидаясь таймаута на каждом
+                failed += 1
+                _defer(email, connection_error, now)
+                continue
+            try:
+                connection.send_messages([email_message(email)])
+            except Exception as error:
+                logger.warning('Outbox email %s failed: %s', email.id, error)
+                failed += 1
+                _defer(email, error, now)
+                # После ошибки соединение может быть в неизвестном состоянии, открываем заново
+                connection.close()
+                try:
+                    connection.open()
+                except Exception as open_error:
+                    logger.exception('Outbox connection failed')
+                    available = False
+                    connection_error = open_error
+            else:
+                sent += 1
+                email.status = 'sent'
+                email.sent_at = timezone.now()
+                email.error = ''
+        OutboxEmail.objects.bulk_update(emails, ['status', 'attempts', 'next_attempt_at', 'error', 'sent_at'])
+    return sent, failed, available
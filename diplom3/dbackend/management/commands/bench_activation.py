@@ -0,0 +1,63 @@
+import threading
+import time
+from statistics import median
+
+from django.contrib.auth.tokens import default_token_generator
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.test import RequestFactory
+from djoser.utils import encode_uid
+from requests import post
+from rest_framework.request import Request
+
+from dbackend.accounts import activate_user
+from dbackend.models import User
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Время активации пользователя по ссылке из письма: прежний путь через HTTP-запрос ' \
+           'к /auth/users/activation/ своего же сервера и вызов логики Djoser в процессе. ' \
+           'Сервер запускается в отдельном потоке, пользователи создаются в базе и удаляются после замера.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Активаций на каждый путь')
+
+    def handle(self, *args, **options):
+        users = User.objects.bulk_create([User(email=f'bench-activation-{pk}@example.com',
+                                               username=f'bench-activation-{pk}', is_active=False)
+                                          for pk in range(options['users'] * 2)])
+        links = [(user.id, encode_uid(user.pk), default_token_generator.make_token(user)) for user in users]
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+        server.set_app(get_internal_wsgi_application())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f'http://127.0.0.1:{server.server_port}/auth/users/activation/'
+            loopback = self.measure(links[::2], lambda uid, token: post(url, data={'uid': uid, 'token': token}))
+            request = Request(RequestFactory().get('/'))
+            in_process = self.measure(links[1::2], lambda uid, token: activate_user(request, uid, token))
+            if User.objects.filter(id__in=[pk for pk, _, _ in links], is_active=False).exists():
+                raise CommandError('Не все пользователи активированы')
+        finally:
+            server.shutdown()
+            server.server_close()
+            User.objects.filter(id__in=[pk for pk, _, _ in links]).delete()
+
+        for name, latencies in (('Через HTTP', loopback), ('В процессе', in_process)):
+            self.stdout.write(f'{name}: медиана {median(latencies) * 1000:.2f} мс, '
+                              f'95% {latencies[int(len(latencies) * 0.95) - 1] * 1000:.2f} мс, '
+                              f'{len(latencies) / sum(latencies):.0f} активаций/с')
+        self.stdout.write(self.style.SUCCESS(
+            f'Ускорение по медиане: {median(loopback) / median(in_process):.1f}x'))
+
+    def measure(self, links, activate):
+        latencies = []
+        for _, uid, token in links:
+            started = time.perf_counter()
+            activate(uid, token)
+            latencies.append(time.perf_counter() - started)
+        return sorted(latencies)
@@ -0,0 +1,126 @@
+import random
+import threading
+import time
+from statistics import median
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, OperationalError
+from django.db.models import Sum
+
+from dbackend.basket import BasketError, checkout
+from dbackend.importer import PriceListImporter
+from dbackend.models import User, Category, Order, OrderItem, ProductInfo, Contact
+
+CATEGORY_ID = 990002
+
+
+class Command(BaseCommand):
+    help = 'Одновременное оформление корзин с общими позициями в нескольких потоках: пропускная способность ' \
+           'и проверка, что остатки не ушли в минус и списано ровно столько, сколько заказано. ' \
+           'Потокам нужны зафиксированные данные, поэтому они создаются в базе и удаляются после замера.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--buyers', type=int, default=400, help='Корзин, по одному оформлению на корзину')
+        parser.add_argument('--items', type=int, default=5, help='Общих позиций, за которые идет конкуренция')
+        parser.add_argument('--lines', type=int, default=3, help='Позиций в корзине')
+        parser.add_argument('--stock', type=int, default=200, help='Начальный остаток каждой позиции')
+
+    def handle(self, *args, **options):
+        if options['lines'] > options['items']:
+            raise CommandError('--lines не может быть больше --items')
+        if connection.vendor == 'sqlite':
+            self.stderr.write('SQLite не поддерживает блокировку строк и параллельную запись, '
+                              'результат показателен только для PostgreSQL')
+        self.options = options
+        owner, buyers = self.seed()
+        try:
+            initial = dict(ProductInfo.objects.filter(shop__user=owner).values_list('id', 'quantity'))
+            results, elapsed = self.run(buyers)
+            self.report(owner, initial, results, elapsed)
+        finally:
+            self.cleanup(owner, buyers)
+
+    def seed(self):
+        options = self.options
+        owner = User.objects.create(email='bench-checkout-shop@example.com', username='bench-checkout-shop',
+                                    user_type='shop', is_active=True)
+        PriceListImporter(owner.id).run([
+            ('shop', [{'name': 'Магазин для замеров оформления', 'url': 'https://checkout.example.com/',
+                       'status': True}]),
+            ('categories', [{'id': CATEGORY_ID, 'name': 'Замеры оформления'}]),
+            ('goods', [{'id': pk, 'category': CATEGORY_ID, 'model': f'bench/checkout/{pk}', 'name': f'Ходовой товар {pk}',
+                        'price': 100 * pk, 'price_rrc': 100 * pk, 'quantity': options['stock'], 'parameters': {}}
+                       for pk in range(1, options['items'] + 1)]),
+        ])
+        product_info_ids = list(ProductInfo.objects.filter(shop__user=owner).values_list('id', flat=True))
+
+        buyers = User.objects.bulk_create([User(email=f'bench-checkout-{pk}@example.com',
+                                                username=f'bench-checkout-{pk}', is_active=True)
+                                           for pk in range(options['buyers'])])
+        contacts = Contact.objects.bulk_create([Contact(user=buyer, city='Москва', street='Тверская',
+                                                        phone='+7 900 000-00-00') for buyer in buyers])
+        baskets = Order.objects.bulk_create([Order(user=buyer, status='basket') for buyer in buyers])
+        generator = random.Random(0)
+        OrderItem.objects.bulk_create([OrderItem(order=basket, product_info_id=pk, quantity=generator.randint(1, 3))
+                                       for basket in baskets
+                                       for pk in generator.sample(product_info_ids, options['lines'])])
+        return owner, [(buyer.id, contact.id) for buyer, contact in zip(buyers, contacts)]
+
+    def run(self, buyers):
+        queue = list(buyers)
+        lock = threading.Lock()
+        results = []
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        if not queue:
+                            return
+                        user_id, contact_id = queue.pop()
+                    started = time.perf_counter()
+                    try:
+                        checkout(user_id, contact_id)
+                        outcome = 'ok'
+                    except BasketError:
+                        outcome = 'rejected'
+                    except OperationalError:
+                        outcome = 'error'
+                    with lock:
+                        results.append((outcome, time.perf_counter() - started))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, time.perf_counter() - started
+
+    def report(self, owner, initial, results, elapsed):
+        counts = {outcome: sum(1 for result, _ in results if result == outcome) for outcome in
+                  ('ok', 'rejected', 'error')}
+        latencies = sorted(latency for _, latency in results)
+        self.stdout.write(f'Потоков {self.options["threads"]}, оформлений {len(results)} за {elapsed:.2f} с, '
+                          f'{counts["ok"] / elapsed:.0f} заказов/с')
+        self.stdout.write(f'Оформлено {counts["ok"]}, отказов по остатку {counts["rejected"]}, '
+                          f'ошибок базы {counts["error"]}')
+        self.stdout.write(f'Время оформления: медиана {median(latencies) * 1000:.1f} мс, '
+                          f'95% {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} мс')
+
+        final = dict(ProductInfo.objects.filter(id__in=initial).values_list('id', 'quantity'))
+        ordered = dict(OrderItem.objects.filter(product_info_id__in=initial, order__status='new').values(
+            'product_info_id').annotate(total=Sum('quantity')).values_list('product_info_id', 'total'))
+        oversold = [pk for pk in initial if final[pk] < 0 or initial[pk] - final[pk] != ordered.get(pk, 0)]
+        for pk in initial:
+            self.stdout.write(f'Позиция {pk}: остаток {initial[pk]} -> {final[pk]}, заказано {ordered.get(pk, 0)}')
+        if oversold:
+            raise CommandError(f'Остатки не сходятся с заказами по позициям {oversold}')
+        self.stdout.write(self.style.SUCCESS('Перепродаж нет'))
+
+    def cleanup(self, owner, buyers):
+        User.objects.filter(id__in=[owner.id] + [user_id for user_id, _ in buyers]).delete()
+        Category.objects.filter(id=CATEGORY_ID).delete()
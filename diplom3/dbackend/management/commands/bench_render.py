@@ -0,0 +1,101 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from dbackend.basket import refresh_order_totals
+from dbackend.importer import PriceListImporter
+from dbackend.models import User, Order, OrderItem, ProductInfo, ProductCard, Contact
+from dbackend.rendering import UJSONRenderer, orders_data
+from dbackend.serializers import ProductInfoSerializer, OrderSerializer
+
+
+class Command(BaseCommand):
+    help = 'Сравнение вывода через сериализаторы DRF и быстрого вывода через values() и ujson ' \
+           'на созданных в откатываемой транзакции данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Позиций в каждом сценарии')
+        parser.add_argument('--items', type=int, default=5, help='Позиций в оформленном заказе')
+        parser.add_argument('--repeat', type=int, default=3, help='Повторов, берется лучшее время')
+
+    def handle(self, *args, **options):
+        self.options = options
+        failed = []
+        with transaction.atomic():
+            owner, buyer = self.seed()
+            for name, slow, fast in self.scenarios(owner, buyer):
+                slow_time, slow_content = self.measure(slow)
+                fast_time, fast_content = self.measure(fast)
+                same = slow_content == fast_content
+                if not same:
+                    failed.append(name)
+                self.stdout.write(f'{name}: сериализаторы {slow_time * 1000:.0f} мс, быстрый вывод '
+                                  f'{fast_time * 1000:.0f} мс, ускорение {slow_time / fast_time:.1f}x, '
+                                  f'{len(fast_content)} байт, {"совпадает" if same else "ОТЛИЧАЕТСЯ"}')
+            transaction.set_rollback(True)
+        if failed:
+            raise CommandError(f'Вывод отличается: {", ".join(failed)}')
+
+    def seed(self):
+        rows = self.options['rows']
+        owner = User.objects.create(email='bench-shop@example.com', username='bench-shop', user_type='shop')
+        buyer = User.objects.create(email='bench-buyer@example.com', username='bench-buyer')
+        goods = [{'id': pk, 'category': 990001, 'model': f'bench/model/{pk}', 'name': f'Товар "{pk}" 1/2',
+                  'price': 100 + pk, 'price_rrc': 120 + pk, 'quantity': pk % 7,
+                  'parameters': {'Цвет': 'черный', 'Вес': pk % 100}} for pk in range(1, rows + 1)]
+        PriceListImporter(owner.id).run([
+            ('shop', [{'name': 'Магазин для замеров', 'url': 'https://bench.example.com/', 'status': True}]),
+            ('categories', [{'id': 990001, 'name': 'Замеры'}]),
+            ('goods', goods),
+        ])
+        product_info_ids = list(ProductInfo.objects.filter(shop__user=owner).order_by('id').values_list(
+            'id', flat=True))
+
+        contact = Contact.objects.create(user=buyer, city='Москва', street='Тверская', phone='+7 900 000-00-00')
+        basket = Order.objects.create(user=buyer, status='basket')
+        items_per_order = self.options['items']
+        orders = Order.objects.bulk_create([Order(user=buyer, status='new', contact=contact)
+                                            for _ in range(rows // items_per_order)])
+        items = [OrderItem(order=basket, product_info_id=pk, quantity=1) for pk in product_info_ids]
+        items += [OrderItem(order=order, product_info_id=product_info_ids[(number * items_per_order + offset) % rows],
+                            quantity=offset + 1)
+                  for number, order in enumerate(orders) for offset in range(items_per_order)]
+        OrderItem.objects.bulk_create(items, batch_size=2000)
+        refresh_order_totals([basket.id] + [order.id for order in orders])
+        return owner, buyer
+
+    def scenarios(self, owner, buyer):
+        renderer = JSONRenderer()
+        fast_renderer = UJSONRenderer()
+        shop_id = owner.shop.id
+
+        def basket():
+            return Order.objects.filter(user=buyer, status='basket')
+
+        def my_orders():
+            return Order.objects.filter(user=buyer).exclude(status='basket')
+
+        yield ('ProductInShop',
+               lambda: renderer.render(ProductInfoSerializer(ProductInfoSerializer.setup_eager_loading(
+                   ProductInfo.objects.filter(shop_id=shop_id).order_by('id')), many=True).data),
+               lambda: fast_renderer.render(list(ProductCard.objects.filter(shop_id=shop_id).order_by(
+                   'product_info_id').values_list('data', flat=True))))
+        yield ('Basket',
+               lambda: renderer.render(OrderSerializer(OrderSerializer.setup_eager_loading(basket()).order_by('id'),
+                                                       many=True).data),
+               lambda: fast_renderer.render(orders_data(basket())))
+        yield ('MyOrders',
+               lambda: renderer.render(OrderSerializer(OrderSerializer.setup_eager_loading(
+                   my_orders()).order_by('id'), many=True).data),
+               lambda: fast_renderer.render(orders_data(my_orders())))
+
+    def measure(self, render):
+        best, content = None, None
+        for _ in range(self.options['repeat']):
+            started = time.perf_counter()
+            content = render()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, content
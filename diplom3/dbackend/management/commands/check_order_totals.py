@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dbackend.basket import CHUNK_SIZE, TOTALS_FIELDS, compute_totals, refresh_order_totals
+from dbackend.models import Order, STATE_CHOICES
+
+
+class Command(BaseCommand):
+    help = 'Сверка сохраненных итогов заказов с итогами по строкам. По умолчанию проверяются корзины; ' \
+           'оформленные заказы сверяются по ценам строк, зафиксированным при оформлении.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', action='append', choices=[state for state, _ in STATE_CHOICES],
+                            help='Статусы проверяемых заказов, по умолчанию basket')
+        parser.add_argument('--repair', action='store_true', help='Пересчитать заказы с расхождениями')
+        parser.add_argument('--show', type=int, default=10, help='Сколько расхождений вывести')
+
+    def handle(self, *args, **options):
+        order_ids = list(Order.objects.filter(status__in=options['status'] or ['basket']).order_by(
+            'id').values_list('id', flat=True))
+        drifted = []
+        for start in range(0, len(order_ids), CHUNK_SIZE):
+            chunk = order_ids[start:start + CHUNK_SIZE]
+            totals = compute_totals(chunk)
+            for pk, *stored in Order.objects.filter(id__in=chunk).values_list('id', *TOTALS_FIELDS):
+                stored = dict(zip(TOTALS_FIELDS, stored))
+                if stored != totals[pk]:
+                    drifted.append(pk)
+                    if len(drifted) <= options['show']:
+                        self.stdout.write(f'Заказ {pk}: сохранено {stored}, по строкам {totals[pk]}')
+        self.stdout.write(f'Проверено заказов: {len(order_ids)}, с расхождениями: {len(drifted)}')
+
+        if not drifted:
+            return
+        if not options['repair']:
+            raise CommandError(f'Итоги {len(drifted)} заказов расходятся со строками, запустите с --repair')
+        refresh_order_totals(drifted)
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано заказов: {len(drifted)}'))
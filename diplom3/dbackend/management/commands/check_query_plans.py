@@ -0,0 +1,175 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from dbackend.importer import PriceListImporter
+from dbackend.models import User, Order, OrderItem, Product, ProductInfo, ProductParameter, ProductCard, \
+    ProductOfferStats, ShopOrder
+from dbackend.shop_orders import refresh_shop_orders
+
+# Таблицы, которые растут вместе с каталогом и заказами: полный просмотр на них недопустим
+HOT_TABLES = {model._meta.db_table for model in (Order, OrderItem, Product, ProductInfo, ProductParameter,
+                                                  ProductCard, ProductOfferStats, ShopOrder)}
+
+CATEGORIES = 20
+COLORS = ('черный', 'белый', 'красный', 'синий', 'золотистый')
+
+
+class Command(BaseCommand):
+    help = 'Проверка планов запросов основных обработчиков на заполненной базе. Данные создаются ' \
+           'в транзакции и откатываются. Команда завершается ошибкой, если на горячей таблице ' \
+           'встречается полный просмотр. Планировщику запрещается выбирать полный просмотр, когда есть ' \
+           'подходящий индекс, поэтому результат не зависит от объема данных.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shops', type=int, default=50)
+        parser.add_argument('--products', type=int, default=5000, help='Различных продуктов')
+        parser.add_argument('--offers', type=int, default=400, help='Позиций в прайс-листе каждого магазина')
+        parser.add_argument('--buyers', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=4, help='Оформленных заказов на покупателя')
+        parser.add_argument('--show-plans', action='store_true', help='Вывести планы всех запросов')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            raise CommandError(f'Проверка планов не поддерживается для {connection.vendor}')
+        self.options = options
+        self.random = random.Random(0)
+        failures = []
+        with transaction.atomic():
+            started = time.perf_counter()
+            seeded = self.seed()
+            self.prefer_indexes()
+            self.stdout.write(f'Данные созданы за {time.perf_counter() - started:.1f} с')
+            for name, call in self.endpoints(seeded):
+                failures += self.check_plans(name, call)
+            transaction.set_rollback(True)
+
+        if failures:
+            for name, table, sql in failures:
+                self.stderr.write(f'{name}: полный просмотр {table}\n    {sql}')
+            raise CommandError(f'Полный просмотр горячих таблиц в {len(failures)} запросах')
+        self.stdout.write(self.style.SUCCESS('Полных просмотров горячих таблиц нет'))
+
+    def seed(self):
+        options = self.options
+        categories = [{'id': 900000 + pk, 'name': f'Категория {pk}'} for pk in range(CATEGORIES)]
+        products = [(f'Товар {pk} модель {self.random.randint(1, 999)}', categories[pk % CATEGORIES]['id'])
+                    for pk in range(options['products'])]
+        owners = User.objects.bulk_create([User(email=f'plan-shop-{pk}@example.com', username=f'plan-shop-{pk}',
+                                                user_type='shop', is_active=True)
+                                           for pk in range(options['shops'])])
+        for owner in owners:
+            PriceListImporter(owner.id).run(self.feed(owner, categories, products))
+
+        buyers = User.objects.bulk_create([User(email=f'plan-buyer-{pk}@example.com', username=f'plan-buyer-{pk}',
+                                                is_active=True) for pk in range(options['buyers'])])
+        prices = dict(ProductInfo.objects.filter(shop__user__in=owners).values_list('id', 'price'))
+        product_info_ids = list(prices)
+        orders = []
+        for buyer in buyers:
+            orders.append(Order(user=buyer, status='basket'))
+            orders += [Order(user=buyer, status=self.random.choice(('new', 'confirmed', 'delivered')))
+                       for _ in range(options['orders'])]
+        orders = Order.objects.bulk_create(orders)
+        # Цены строк оформленных заказов фиксируются при оформлении, у строк корзин их нет
+        OrderItem.objects.bulk_create([OrderItem(order=order, product_info_id=product_info_id, quantity=1,
+                                                 price=None if order.status == 'basket' else prices[product_info_id])
+                                       for order in orders
+                                       for product_info_id in self.random.sample(product_info_ids, 3)])
+        refresh_shop_orders([order.id for order in orders if order.status != 'basket'])
+        return {'owner': owners[0], 'buyer': buyers[0], 'categories': categories, 'products': products,
+                'product_info': ProductInfo.objects.filter(shop__user=owners[0]).first()}
+
+    def feed(self, owner, categories, products, price_shift=0):
+        goods = []
+        for pk in sorted(self.random.sample(range(len(products)), self.options['offers'])):
+            name, category = products[pk]
+            goods.append({'id': pk + 1, 'category': category, 'model': f'model/{pk}', 'name': name,
+                          'price': 1000 + pk + price_shift, 'price_rrc': 1100 + pk, 'quantity': pk % 20,
+                          'parameters': {'Цвет': COLORS[pk % len(COLORS)], 'Память': 2 ** (pk % 8),
+                                         'Диагональ': 5 + pk % 3, 'Вес': 100 + pk % 50}})
+        return [('shop', [{'name': owner.username, 'url': f'https://{owner.username}.example.com/', 'status': True}]),
+                ('categories', categories), ('goods', goods)]
+
+    def prefer_indexes(self):
+        '''
+        На небольших таблицах полный просмотр дешевле индекса, и планировщик выбирает его, даже если индекс есть.
+        PostgreSQL запрещается полный просмотр до конца транзакции, тогда он остается в плане только
+        при отсутствии индекса. SQLite без статистики ANALYZE считает таблицы большими и использует индексы.
+        '''
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def endpoints(self, seeded):
+        owner, buyer, product_info = seeded['owner'], seeded['buyer'], seeded['product_info']
+        shop_id = product_info.shop_id
+        as_owner = APIClient(HTTP_HOST='localhost')
+        as_owner.force_authenticate(owner)
+        as_buyer = APIClient(HTTP_HOST='localhost')
+        as_buyer.force_authenticate(buyer)
+        # Параметр _ нужен, чтобы ответы не брались из кэша каталога
+        yield 'ProductInShop', lambda: as_buyer.get(f'/shop/{shop_id}/', {'_': time.time_ns()})
+        yield 'ShopCatalogExport', lambda: as_buyer.get(f'/shop/{shop_id}/export/', {'mode': 'ndjson'})
+        yield 'AboutProduct', lambda: as_buyer.get(f'/about_product/{product_info.product_id}',
+                                                   {'_': time.time_ns()})
+        yield 'ProductOffers', lambda: as_buyer.get(f'/offers/{product_info.product_id}/', {'_': time.time_ns()})
+        yield 'ProductOffers ids', lambda: as_buyer.get('/offers/', {'ids': f'{product_info.product_id},1,2',
+                                                                    '_': time.time_ns()})
+        yield 'ProductSearch', lambda: as_buyer.get('/search/', {'q': product_info.product.name.split()[1]})
+        yield 'Basket', lambda: as_buyer.get('/basket/')
+        yield 'PartnerOrders', lambda: as_owner.get('/byers_orders/')
+        yield 'PartnerOrders status', lambda: as_owner.get('/byers_orders/', {'status': 'new'})
+        yield 'PriceListImporter', lambda: PriceListImporter(owner.id).run(
+            self.feed(owner, seeded['categories'], seeded['products'], price_shift=1))
+
+    def check_plans(self, name, call):
+        with CaptureQueriesContext(connection) as context:
+            response = call()
+            if hasattr(response, 'streaming_content'):
+                b''.join(response.streaming_content)
+        status_code = getattr(response, 'status_code', 200)
+        if status_code != 200:
+            return [(name, '-', f'ответ {status_code}')]
+        failures = []
+        queries = [query['sql'] for query in context.captured_queries
+                   if query['sql'].lstrip().upper().startswith('SELECT')]
+        for sql in queries:
+            plan = self.explain(sql)
+            if self.options['show_plans']:
+                self.stdout.write(f'{name}: {sql}\n' + '\n'.join(f'    {line}' for line in plan))
+            failures += [(name, table, sql) for table in self.sequential_scans(plan)]
+        self.stdout.write(f'{name}: запросов {len(queries)}, полных просмотров {len(failures)}')
+        return failures
+
+    def explain(self, sql):
+        '''
+        План запроса списком строк: узлы PostgreSQL в виде "<тип узла> <таблица>",
+        для SQLite строки EXPLAIN QUERY PLAN
+        '''
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+                nodes = [cursor.fetchone()[0][0]['Plan']]
+                plan = []
+                while nodes:
+                    node = nodes.pop()
+                    plan.append(f'{node["Node Type"]} {node.get("Relation Name", "")}'.strip())
+                    nodes += node.get('Plans', [])
+                return plan
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def sequential_scans(self, plan):
+        scans = []
+        for line in plan:
+            words = line.split()
+            if line.startswith('Seq Scan ') or (words[0] == 'SCAN' and len(words) > 1):
+                table = words[-1] if line.startswith('Seq Scan ') else words[1]
+                if table in HOT_TABLES:
+                    scans.append(table)
+        return scans
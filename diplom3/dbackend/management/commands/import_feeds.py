@@ -0,0 +1,111 @@
+import multiprocessing
+import os
+import time
+from queue import Empty
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from dbackend.feeds import parse_feed_batches
+from dbackend.importer import PriceListImporter, IMPORT_MODES, BATCH_SIZE
+from dbackend.models import User
+
+
+class Command(BaseCommand):
+    help = 'Параллельный импорт прайс-листов: разбор в пуле процессов, запись в базу несколькими потоками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sources', nargs='+', help='Ссылки или пути к файлам прайс-листов')
+        parser.add_argument('--user', help='Email владельца магазина, только для одного прайс-листа. '
+                                           'По умолчанию владелец берется у ранее загруженного магазина '
+                                           'с тем же названием')
+        parser.add_argument('--mode', choices=IMPORT_MODES, default='sync')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Процессов для разбора')
+        parser.add_argument('--writers', type=int, default=2, help='Потоков записи в базу')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--queue-size', type=int, default=8, help='Пакетов в очереди на один прайс-лист')
+
+    def handle(self, *args, **options):
+        user_id = None
+        if options['user']:
+            # У пользователя один магазин: несколько прайс-листов перезаписывали бы друг друга
+            if len(options['sources']) > 1:
+                raise CommandError('--user можно указать только для одного прайс-листа')
+            try:
+                user_id = User.objects.get(email=options['user']).id
+            except User.DoesNotExist:
+                raise CommandError(f'Пользователь {options["user"]} не найден')
+        self.user_id = user_id
+        self.options = options
+
+        started = time.perf_counter()
+        with multiprocessing.Manager() as manager, \
+                ProcessPoolExecutor(max_workers=options['processes']) as parsers, \
+                ThreadPoolExecutor(max_workers=options['writers']) as writers:
+            # Разбор всех прайс-листов запускается сразу, потоки записи забирают готовые пакеты
+            # по мере освобождения. Очереди ограничены, поэтому разбор опережает запись не больше чем
+            # на --queue-size пакетов на прайс-лист
+            queues = [manager.Queue(options['queue_size']) for _ in options['sources']]
+            parsing = [parsers.submit(parse_feed_batches, source, queue, options['batch_size'])
+                       for source, queue in zip(options['sources'], queues)]
+            results = list(writers.map(self.import_source, options['sources'], queues, parsing))
+        elapsed = time.perf_counter() - started
+
+        total = 0
+        for source, stats, error in results:
+            if error:
+                self.stderr.write(f'{source}: {error}')
+                continue
+            total += stats['goods']
+            self.stdout.write(f'{source}: магазин {stats["shop"]}, позиций {stats["goods"]}, '
+                              f'изменения {stats["changes"]}, запросов {stats["queries"]}, {stats["time"]} с')
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено {total} позиций из {len(results)} прайс-листов за {elapsed:.2f} с, '
+            f'{total / elapsed if elapsed else 0:.0f} позиций/с'))
+
+    def import_source(self, source, queue, parsing):
+        '''
+        Выполняется в потоке записи со своим соединением с базой
+        '''
+        importer = PriceListImporter(self.user_id, mode=self.options['mode'], batch_size=self.options['batch_size'])
+        try:
+            stats = importer.run(self._sections(queue))
+        except CommandError as error:
+            return source, None, str(error)
+        except Exception as error:
+            return source, None, f'{type(error).__name__}: {error}'
+        finally:
+            self._drain(queue, parsing)
+            connection.close()
+        return source, stats, None
+
+    def _sections(self, queue):
+        while True:
+            kind, key, value = queue.get()
+            if kind == 'section':
+                yield key, value
+            elif kind == 'start':
+                yield key, self._items(queue)
+            elif kind == 'error':
+                raise CommandError(value)
+            elif kind == 'done':
+                return
+
+    def _items(self, queue):
+        while True:
+            kind, _, value = queue.get()
+            if kind == 'batch':
+                yield from value
+            elif kind == 'end':
+                return
+            elif kind == 'error':
+                raise CommandError(value)
+
+    def _drain(self, queue, parsing):
+        # Освобождаем процесс разбора, если запись прервалась раньше конца прайс-листа
+        while not parsing.done():
+            try:
+                queue.get(timeout=0.1)
+            except Empty:
+                pass
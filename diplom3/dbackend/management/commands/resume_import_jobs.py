@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from dbackend.jobs import run_import_job
+from dbackend.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = 'Задачи импорта, оставшиеся в статусах queued и running после перезапуска сервера: ' \
+           'по умолчанию выполняются заново, с --fail помечаются ошибкой. Импорт идет в одной транзакции, ' \
+           'поэтому прерванная задача ничего не записала и ее можно повторить. Запускать при старте, ' \
+           'до того как сервер начнет принимать запросы: задачи, которые выполняет работающий сервер, ' \
+           'команда не отличает от прерванных.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail', action='store_true', help='Пометить задачи ошибкой, не выполняя')
+
+    def handle(self, *args, **options):
+        stuck = ImportJob.objects.filter(status__in=('queued', 'running'))
+        if options['fail']:
+            count = stuck.update(status='failed', error='Задача прервана перезапуском сервера',
+                                 finished_at=timezone.now())
+            self.stdout.write(self.style.SUCCESS(f'Помечено ошибкой задач: {count}'))
+            return
+        stuck.filter(status='running').update(status='queued', phase='', rows_processed=0, started_at=None)
+        job_ids = list(ImportJob.objects.filter(status='queued').order_by('id').values_list('id', flat=True))
+        for job_id in job_ids:
+            run_import_job(job_id)
+            job = ImportJob.objects.get(id=job_id)
+            self.stdout.write(f'Задача {job_id}: {job.status} {job.phase} {job.error}'.rstrip())
+        self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {len(job_ids)}'))
@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from dbackend.mail import OUTBOX_BATCH_SIZE, deliver_batch
+
+
+class Command(BaseCommand):
+    help = 'Отправка писем из очереди OutboxEmail пачками через одно соединение с почтовым сервером. ' \
+           'Без --once работает постоянно и проверяет очередь каждые --interval секунд.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Отправить письма, срок которых наступил, и выйти')
+        parser.add_argument('--batch-size', type=int, default=OUTBOX_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=5.0, help='Пауза при пустой очереди, секунд')
+        parser.add_argument('--backend', default=getattr(settings, 'OUTBOX_DELIVERY_BACKEND',
+                                                         'django.core.mail.backends.smtp.EmailBackend'),
+                            help='Почтовый бэкенд для отправки, по умолчанию OUTBOX_DELIVERY_BACKEND')
+
+    def handle(self, *args, **options):
+        connection = get_connection(options['backend'])
+        total_sent = total_failed = 0
+        busy = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                sent, failed, available = deliver_batch(connection, options['batch_size'])
+                if sent or failed:
+                    elapsed = time.perf_counter() - started
+                    busy += elapsed
+                    total_sent += sent
+                    total_failed += failed
+                    self.stdout.write(f'Отправлено {sent}, ошибок {failed}, {sent / elapsed:.0f} писем/с')
+                    if available:
+                        continue
+                    # Сервер недоступен: следующая пачка ждет паузы, а не перебирает очередь
+                    self.stderr.write('Почтовый сервер недоступен, письма отложены')
+                if options['once']:
+                    break
+                # Соединение не держится открытым, пока очередь пуста
+                connection.close()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Всего отправлено {total_sent}, ошибок {total_failed} за {busy:.2f} с, '
+            f'{total_sent / busy if busy else 0:.0f} писем/с'))
@@ -0,0 +1,172 @@
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Сколько одинаковых запросов за один http запрос считается признаком N+1
+REPEATED_QUERY_THRESHOLD = getattr(settings, 'REPEATED_QUERY_THRESHOLD', 5)
+# Сколько самых частых повторяющихся запросов хранится на обработчик
+REPEATED_SHAPES_LIMIT = 10
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+def query_shape(sql):
+    '''
+    Запрос без значений параметров: списки IN разной длины сводятся к одному виду
+    '''
+    return IN_LIST_RE.sub('IN (...)', sql)
+
+
+class QueryRecorder:
+    '''
+    Обертка выполнения запросов (connection.execute_wrapper): количество, время и повторы запросов
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - started
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+
+    def repeated(self):
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= REPEATED_QUERY_THRESHOLD]
+
+
+class Metrics:
+    '''
+    Накопленные в памяти процесса показатели по обработчикам
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, sample):
+        with self.lock:
+            endpoint = self.endpoints.setdefault(sample['endpoint'], {
+                'requests': 0, 'queries': 0, 'queries_max': 0, 'db_time_ms': 0.0, 'db_time_max_ms': 0.0,
+                'renderer_time_ms': 0.0, 'time_ms': 0.0, 'time_max_ms': 0.0, 'size': 0,
+                'n_plus_one': 0, 'over_budget': 0, 'budget': sample['budget'], 'repeated': {},
+            })
+            endpoint['requests'] += 1
+            endpoint['queries'] += sample['queries']
+            endpoint['queries_max'] = max(endpoint['queries_max'], sample['queries'])
+            endpoint['db_time_ms'] += sample['db_time_ms']
+            endpoint['db_time_max_ms'] = max(endpoint['db_time_max_ms'], sample['db_time_ms'])
+            endpoint['renderer_time_ms'] += sample['renderer_time_ms']
+            endpoint['time_ms'] += sample['time_ms']
+            endpoint['time_max_ms'] = max(endpoint['time_max_ms'], sample['time_ms'])
+            endpoint['size'] += sample['size']
+            endpoint['n_plus_one'] += bool(sample['repeated'])
+            endpoint['over_budget'] += sample['over_budget']
+            repeated = endpoint['repeated']
+            for shape, count in sample['repeated']:
+                repeated[shape] = max(repeated.get(shape, 0), count)
+            if len(repeated) > REPEATED_SHAPES_LIMIT:
+                endpoint['repeated'] = dict(Counter(repeated).most_common(REPEATED_SHAPES_LIMIT))
+
+    def snapshot(self):
+        with self.lock:
+            result = {}
+            for name, endpoint in self.endpoints.items():
+                requests = endpoint['requests']
+                result[name] = {
+                    'requests': requests,
+                    'budget': endpoint['budget'],
+                    'queries_avg': round(endpoint['queries'] / requests, 2),
+                    'queries_max': endpoint['queries_max'],
+                    'db_time_avg_ms': round(endpoint['db_time_ms'] / requests, 3),
+                    'db_time_max_ms': round(endpoint['db_time_max_ms'], 3),
+                    'renderer_time_avg_ms': round(endpoint['renderer_time_ms'] / requests, 3),
+                    'time_avg_ms': round(endpoint['time_ms'] / requests, 3),
+                    'time_max_ms': round(endpoint['time_max_ms'], 3),
+                    'size_avg': round(endpoint['size'] / requests),
+                    'n_plus_one': endpoint['n_plus_one'],
+                    'over_budget': endpoint['over_budget'],
+                    'repeated': dict(endpoint['repeated']),
+                }
+            return result
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+
+metrics = Metrics()
+
+
+class QueryMetricsMiddleware:
+    '''
+    Количество и время запросов к базе, время работы рендерера и размер ответа по каждому запросу.
+    renderer_time_ms - от возврата ответа представлением до конца обработки: перевод готовых данных в JSON
+    рендерером DRF. Построение данных сериализаторами выполняется в представлении и входит только в time_ms.
+    Бюджет запросов с учетом запроса аутентификации задается атрибутом query_budget у представления,
+    числом или словарем по методам ({'GET': 3}). С DEBUG или METRICS_QUERY_HEADERS количество запросов
+    отдается в заголовке X-Query-Count, бюджет - в X-Query-Budget.
+    Запросы потоковых ответов, выполняемые после возврата ответа, не учитываются.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        request.view_finished_at = None
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        finished = time.perf_counter()
+
+        match = request.resolver_match
+        view_class = getattr(match.func, 'view_class', None) if match else None
+        budget = getattr(view_class, 'query_budget', None)
+        if isinstance(budget, dict):
+            budget = budget.get(request.method)
+        render_started = request.view_finished_at or finished
+        repeated = recorder.repeated()
+        sample = {
+            'endpoint': f'{request.method} /{match.route}' if match else f'{request.method} <не найден>',
+            'path': request.path,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'db_time_ms': round(recorder.time * 1000, 3),
+            'renderer_time_ms': round((finished - render_started) * 1000, 3),
+            'time_ms': round((finished - started) * 1000, 3),
+            'size': 0 if response.streaming else len(response.content),
+            'budget': budget,
+            'over_budget': budget is not None and recorder.count > budget,
+            'repeated': repeated,
+        }
+        metrics.record(sample)
+
+        # В рабочем режиме заголовки не отдаются: показатели доступны только через /metrics/
+        if settings.DEBUG or getattr(settings, 'METRICS_QUERY_HEADERS', False):
+            response['X-Query-Count'] = str(recorder.count)
+            if budget is not None:
+                response['X-Query-Budget'] = str(budget)
+        if sample['over_budget'] or repeated:
+            logger.warning(json.dumps(sample, ensure_ascii=False))
+        else:
+            logger.info(json.dumps(sample, ensure_ascii=False))
+        return response
+
+    def process_template_response(self, request, response):
+        # Вызывается после представления и до отрисовки ответа DRF
+        request.view_finished_at = time.perf_counter()
+        return response
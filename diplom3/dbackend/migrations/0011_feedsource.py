@@ -0,0 +1,41 @@
+# Generated by Django 5.0 on 2026-10-18 19:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0010_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='force',
+            field=models.BooleanField(default=False, verbose_name='Загрузить даже без изменений'),
+        ),
+        migrations.CreateModel(
+            name='FeedSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=500, verbose_name='Ссылка на прайс-лист')),
+                ('etag', models.CharField(blank=True, max_length=200, verbose_name='ETag')),
+                ('last_modified', models.CharField(blank=True, max_length=50, verbose_name='Last-Modified')),
+                ('content_hash', models.CharField(blank=True, max_length=64, verbose_name='sha256 содержимого')),
+                ('checked_at', models.DateTimeField(blank=True, null=True, verbose_name='Последняя проверка')),
+                ('imported_at', models.DateTimeField(blank=True, null=True, verbose_name='Последний импорт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_sources', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Источник прайс-листа',
+                'verbose_name_plural': 'Список источников прайс-листов',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='feedsource',
+            constraint=models.UniqueConstraint(fields=('user', 'url'), name='unique_user_feed_url'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.0 on 2026-10-18 19:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Prefetch
+
+
+def build_product_cards(apps, schema_editor):
+    ProductInfo = apps.get_model('dbackend', 'ProductInfo')
+    ProductParameter = apps.get_model('dbackend', 'ProductParameter')
+    ProductCard = apps.get_model('dbackend', 'ProductCard')
+    product_infos = ProductInfo.objects.select_related('product__category').prefetch_related(
+        Prefetch('product_parameters', queryset=ProductParameter.objects.select_related('parameter').order_by('id')))
+    cards = []
+    for product_info in product_infos.iterator(chunk_size=1000):
+        product = product_info.product
+        product_parameters = product_info.product_parameters.all()
+        cards.append(ProductCard(
+            product_info_id=product_info.id,
+            shop_id=product_info.shop_id,
+            product_id=product.id,
+            data={
+                'id': product_info.id,
+                'product': {'name': product.name, 'category': product.category.name, 'id': product.id},
+                'shop': product_info.shop_id,
+                'name': product_info.name,
+                'quantity': product_info.quantity,
+                'price': product_info.price,
+                'price_rrc': product_info.price_rrc,
+                'product_parameters': [{'parameter': item.parameter.name, 'value': item.value}
+                                       for item in product_parameters],
+            },
+            parameters={item.parameter.name: item.value for item in product_parameters}))
+        if len(cards) >= 1000:
+            ProductCard.objects.bulk_create(cards)
+            cards = []
+    ProductCard.objects.bulk_create(cards)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0011_feedsource'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCard',
+            fields=[
+                ('product_info', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='dbackend.productinfo', verbose_name='Информация о продукте')),
+                ('data', models.JSONField(verbose_name='Карточка')),
+                ('parameters', models.JSONField(default=dict, verbose_name='Параметры')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_cards', to='dbackend.product', verbose_name='Продукт')),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='product_cards', to='dbackend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Карточка товара',
+                'verbose_name_plural': 'Список карточек товаров',
+                'indexes': [models.Index(fields=['shop', 'product_info'], name='product_card_shop_idx'), models.Index(fields=['product', 'product_info'], name='product_card_product_idx')],
+            },
+        ),
+        migrations.RunPython(build_product_cards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0 on 2026-10-18 21:40
+
+from django.db import migrations
+
+# Индексы для поиска по названию, только для PostgreSQL:
+# триграммные для поиска по схожести и полнотекстовый с русской морфологией
+SEARCH_INDEXES = (
+    ('product_name_trgm_idx', 'dbackend_product', 'USING gin (name gin_trgm_ops)'),
+    ('product_info_name_trgm_idx', 'dbackend_productinfo', 'USING gin (name gin_trgm_ops)'),
+    ('product_name_search_idx', 'dbackend_product',
+     "USING gin (to_tsvector('russian'::regconfig, COALESCE(name, '')))"),
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, definition in SEARCH_INDEXES:
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} {definition}')
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0012_productcard'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.0 on 2026-10-18 19:22
+
+from itertools import groupby
+from statistics import median
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_offer_stats(apps, schema_editor):
+    ProductInfo = apps.get_model('dbackend', 'ProductInfo')
+    ProductOfferStats = apps.get_model('dbackend', 'ProductOfferStats')
+    offers = ProductInfo.objects.order_by('product_id', 'price', 'id').values_list(
+        'product_id', 'id', 'shop_id', 'price', 'quantity', 'shop__status')
+    stats = []
+    for product_id, product_offers in groupby(offers.iterator(chunk_size=1000), key=lambda offer: offer[0]):
+        product_offers = list(product_offers)
+        prices = [offer[3] for offer in product_offers]
+        accepting = [offer for offer in product_offers if offer[5]]
+        best = next((offer for offer in accepting if offer[4] > 0), None)
+        stats.append(ProductOfferStats(product_id=product_id, offers_count=len(prices), min_price=prices[0],
+                                       max_price=prices[-1], median_price=median(prices),
+                                       best_offer_id=best[1] if best else None,
+                                       best_shop_id=best[2] if best else None,
+                                       best_price=best[3] if best else None,
+                                       total_quantity=sum(offer[4] for offer in accepting)))
+        if len(stats) >= 1000:
+            ProductOfferStats.objects.bulk_create(stats)
+            stats = []
+    ProductOfferStats.objects.bulk_create(stats)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0013_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductOfferStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='offer_stats', serialize=False, to='dbackend.product', verbose_name='Продукт')),
+                ('offers_count', models.PositiveIntegerField(verbose_name='Количество предложений')),
+                ('min_price', models.PositiveIntegerField(verbose_name='Минимальная цена')),
+                ('max_price', models.PositiveIntegerField(verbose_name='Максимальная цена')),
+                ('median_price', models.FloatField(verbose_name='Медианная цена')),
+                ('best_price', models.PositiveIntegerField(blank=True, null=True, verbose_name='Лучшая цена')),
+                ('total_quantity', models.PositiveBigIntegerField(default=0, verbose_name='Доступное количество')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('best_offer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='dbackend.productinfo', verbose_name='Лучшее предложение')),
+                ('best_shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='dbackend.shop', verbose_name='Магазин с лучшим предложением')),
+            ],
+            options={
+                'verbose_name': 'Сводка предложений',
+                'verbose_name_plural': 'Список сводок предложений',
+            },
+        ),
+        migrations.RunPython(build_offer_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.0 on 2026-10-18 19:23
+
+from importlib import import_module
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+# Слияние дубликатов перед добавлением ограничений уникальности в 0016.
+# Отдельная миграция: в PostgreSQL ограничение нельзя добавить в той же транзакции,
+# где изменялись строки таблицы со ссылками на нее.
+
+
+def merge_baskets(apps, schema_editor):
+    Order = apps.get_model('dbackend', 'Order')
+    OrderItem = apps.get_model('dbackend', 'OrderItem')
+    duplicates = Order.objects.filter(status='basket').values('user_id').annotate(
+        count=Count('id'), keep=Min('id')).filter(count__gt=1)
+    for row in duplicates:
+        baskets = Order.objects.filter(user_id=row['user_id'], status='basket').exclude(id=row['keep'])
+        OrderItem.objects.filter(order__in=baskets).update(order_id=row['keep'])
+        baskets.delete()
+
+
+def merge_products(apps, schema_editor):
+    Product = apps.get_model('dbackend', 'Product')
+    ProductInfo = apps.get_model('dbackend', 'ProductInfo')
+    ProductCard = apps.get_model('dbackend', 'ProductCard')
+    ProductOfferStats = apps.get_model('dbackend', 'ProductOfferStats')
+    duplicates = Product.objects.values('name', 'category_id').annotate(count=Count('id'), keep=Min('id')).filter(
+        count__gt=1)
+    merged = False
+    for row in duplicates:
+        products = Product.objects.filter(name=row['name'], category_id=row['category_id']).exclude(id=row['keep'])
+        ProductInfo.objects.filter(product__in=products).update(product_id=row['keep'])
+        cards = list(ProductCard.objects.filter(product__in=products))
+        for card in cards:
+            card.product_id = row['keep']
+            card.data['product']['id'] = row['keep']
+        ProductCard.objects.bulk_update(cards, ['product', 'data'])
+        products.delete()
+        merged = True
+    if merged:
+        # Сводки предложений пересчитываются целиком так же, как при их создании
+        ProductOfferStats.objects.all().delete()
+        import_module('dbackend.migrations.0014_productofferstats').build_offer_stats(apps, schema_editor)
+
+
+def merge_parameters(apps, schema_editor):
+    Parameter = apps.get_model('dbackend', 'Parameter')
+    ProductParameter = apps.get_model('dbackend', 'ProductParameter')
+    duplicates = Parameter.objects.values('name').annotate(count=Count('id'), keep=Min('id')).filter(count__gt=1)
+    for row in duplicates:
+        parameters = Parameter.objects.filter(name=row['name']).exclude(id=row['keep'])
+        product_info_ids = set(ProductParameter.objects.filter(parameter_id=row['keep']).values_list(
+            'product_info_id', flat=True))
+        moved, deleted = [], []
+        for pk, product_info_id in ProductParameter.objects.filter(parameter__in=parameters).order_by(
+                'id').values_list('id', 'product_info_id'):
+            if product_info_id in product_info_ids:
+                deleted.append(pk)
+            else:
+                product_info_ids.add(product_info_id)
+                moved.append(pk)
+        ProductParameter.objects.filter(id__in=deleted).delete()
+        ProductParameter.objects.filter(id__in=moved).update(parameter_id=row['keep'])
+        parameters.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0014_productofferstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_baskets, migrations.RunPython.noop),
+        migrations.RunPython(merge_products, migrations.RunPython.noop),
+        migrations.RunPython(merge_parameters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0 on 2026-10-18 19:33
+
+from django.db import migrations
+from django.db.models import Count, Min, Sum
+
+# Слияние повторяющихся позиций заказа перед добавлением ограничения уникальности в 0018:
+# количество суммируется в строке с меньшим id.
+
+
+def merge_order_items(apps, schema_editor):
+    OrderItem = apps.get_model('dbackend', 'OrderItem')
+    duplicates = OrderItem.objects.values('order_id', 'product_info_id').annotate(
+        count=Count('id'), keep=Min('id'), total=Sum('quantity')).filter(count__gt=1)
+    for row in duplicates:
+        OrderItem.objects.filter(id=row['keep']).update(quantity=row['total'])
+        OrderItem.objects.filter(order_id=row['order_id'], product_info_id=row['product_info_id']).exclude(
+            id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0016_catalog_order_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_order_items, migrations.RunPython.noop),
+    ]
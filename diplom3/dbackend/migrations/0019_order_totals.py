@@ -0,0 +1,52 @@
+# Generated by Django 5.0 on 2026-10-18 19:35
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+CHUNK_SIZE = 1000
+
+
+def build_order_totals(apps, schema_editor):
+    # Итоги по текущим ценам, как их раньше считала аннотация total_sum
+    Order = apps.get_model('dbackend', 'Order')
+    OrderItem = apps.get_model('dbackend', 'OrderItem')
+    order_ids = list(Order.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(order_ids), CHUNK_SIZE):
+        orders = {pk: Order(id=pk, items_count=0, total_sum=0, shop_totals={})
+                  for pk in order_ids[start:start + CHUNK_SIZE]}
+        for order_id, shop_id, quantity, amount in OrderItem.objects.filter(order_id__in=orders).values(
+                'order_id', 'product_info__shop_id').annotate(
+                items=Sum('quantity'), amount=Sum(F('quantity') * F('product_info__price'))).order_by(
+                'order_id', 'product_info__shop_id').values_list(
+                'order_id', 'product_info__shop_id', 'items', 'amount'):
+            order = orders[order_id]
+            order.items_count += quantity
+            order.total_sum += amount
+            order.shop_totals[str(shop_id)] = {'items_count': quantity, 'total_sum': amount}
+        Order.objects.bulk_update(orders.values(), ['items_count', 'total_sum', 'shop_totals'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0018_order_item_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество товаров'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='shop_totals',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Итоги по магазинам'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_sum',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='Сумма'),
+        ),
+        migrations.RunPython(build_order_totals, migrations.RunPython.noop),
+    ]
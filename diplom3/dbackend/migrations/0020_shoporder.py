@@ -0,0 +1,71 @@
+# Generated by Django 5.0 on 2026-10-18 19:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+CHUNK_SIZE = 1000
+CONTACT_FIELDS = ('id', 'city', 'street', 'house', 'structure', 'building', 'apartment', 'phone')
+
+
+def build_shop_orders(apps, schema_editor):
+    # Заказы магазинов для всех оформленных заказов, как их строит dbackend.shop_orders
+    Order = apps.get_model('dbackend', 'Order')
+    OrderItem = apps.get_model('dbackend', 'OrderItem')
+    Contact = apps.get_model('dbackend', 'Contact')
+    ShopOrder = apps.get_model('dbackend', 'ShopOrder')
+    order_ids = list(Order.objects.exclude(status='basket').order_by('id').values_list('id', flat=True))
+    for start in range(0, len(order_ids), CHUNK_SIZE):
+        orders = {pk: (status, dt, contact_id) for pk, status, dt, contact_id in Order.objects.filter(
+            id__in=order_ids[start:start + CHUNK_SIZE]).values_list('id', 'status', 'dt', 'contact_id')}
+        contacts = {contact['id']: contact for contact in Contact.objects.filter(
+            id__in={contact_id for _, _, contact_id in orders.values()}).values(*CONTACT_FIELDS)}
+        shop_orders = {}
+        for pk, order_id, product_info_id, shop_id, product_name, name, quantity, price in \
+                OrderItem.objects.filter(order_id__in=orders).order_by('id').values_list(
+                    'id', 'order_id', 'product_info_id', 'product_info__shop_id', 'product_info__product__name',
+                    'product_info__name', 'quantity', 'product_info__price'):
+            shop_order = shop_orders.get((order_id, shop_id))
+            if shop_order is None:
+                status, dt, contact_id = orders[order_id]
+                shop_order = shop_orders[order_id, shop_id] = ShopOrder(
+                    order_id=order_id, shop_id=shop_id, status=status, dt=dt, items_count=0, total_sum=0, lines=[],
+                    contact=contacts.get(contact_id))
+            shop_order.items_count += quantity
+            shop_order.total_sum += quantity * price
+            shop_order.lines.append({'id': pk, 'product_info': product_info_id, 'product': product_name,
+                                     'name': name, 'quantity': quantity, 'price': price})
+        ShopOrder.objects.bulk_create(shop_orders.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0019_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('basket', 'Статус корзины'), ('new', 'Новый'), ('confirmed', 'Подтвержден'), ('assembled', 'Собран'), ('sent', 'Отправлен'), ('delivered', 'Доставлен'), ('canceled', 'Отменен')], max_length=15, verbose_name='Статус')),
+                ('dt', models.DateTimeField(verbose_name='Дата заказа')),
+                ('items_count', models.PositiveIntegerField(default=0, verbose_name='Количество товаров')),
+                ('total_sum', models.PositiveBigIntegerField(default=0, verbose_name='Сумма')),
+                ('lines', models.JSONField(default=list, verbose_name='Строки заказа')),
+                ('contact', models.JSONField(blank=True, null=True, verbose_name='Контакт')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_orders', to='dbackend.order', verbose_name='Заказ')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_orders', to='dbackend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Заказ магазина',
+                'verbose_name_plural': 'Список заказов магазинов',
+                'indexes': [models.Index(fields=['shop', 'status', 'dt'], name='shop_order_status_dt_idx'), models.Index(fields=['shop', 'dt'], name='shop_order_dt_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoporder',
+            constraint=models.UniqueConstraint(fields=('order', 'shop'), name='unique_shop_order'),
+        ),
+        migrations.RunPython(build_shop_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0 on 2026-10-18 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0022_outboxemail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='importjob',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, verbose_name='Создана'),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Завершена'),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Начата'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0 on 2026-10-18 20:02
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+# Магазины без владельца с одинаковым названием, созданные параллельными импортами, переименовываются
+# перед добавлением ограничения уникальности в 0025. Позиции у них разные, поэтому они не сливаются.
+
+
+def rename_duplicate_shops(apps, schema_editor):
+    Shop = apps.get_model('dbackend', 'Shop')
+    duplicates = Shop.objects.filter(user__isnull=True).values('name').annotate(
+        count=Count('id'), keep=Min('id')).filter(count__gt=1)
+    for row in duplicates:
+        shops = list(Shop.objects.filter(name=row['name'], user__isnull=True).exclude(id=row['keep']))
+        for shop in shops:
+            suffix = f' #{shop.id}'
+            shop.name = shop.name[:100 - len(suffix)] + suffix
+        Shop.objects.bulk_update(shops, ['name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0023_importjob_verbose_names'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_shops, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0 on 2026-10-18 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0024_rename_duplicate_shops'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='shop',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('name',), name='unique_ownerless_shop_name'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0 on 2026-10-18 20:14
+
+from django.core.management import call_command
+from django.db import migrations
+
+# Таблица общего кэша версий каталога (CACHES['catalog_versions']), чтобы не запускать createcachetable
+# отдельно при развертывании. Команда создает таблицы всех кэшей в базе и пропускает существующие.
+
+
+def create_cache_tables(apps, schema_editor):
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0025_shop_unique_ownerless_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_tables, migrations.RunPython.noop),
+    ]
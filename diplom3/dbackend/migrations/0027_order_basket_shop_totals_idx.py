@@ -0,0 +1,30 @@
+# Generated by Django 5.0 on 2026-10-18 20:40
+
+from django.db import migrations
+
+# Частичный GIN индекс по ключам shop_totals корзин для поиска корзин магазина после импорта,
+# только для PostgreSQL: в остальных базах JSON поле не индексируется
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE INDEX IF NOT EXISTS order_basket_shop_totals_idx ON dbackend_order "
+                          "USING gin (shop_totals) WHERE status = 'basket'")
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS order_basket_shop_totals_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0026_catalog_versions_cache'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
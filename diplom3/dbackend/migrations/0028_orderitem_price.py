@@ -0,0 +1,42 @@
+# Generated by Django 5.0 on 2026-10-18 20:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+CHUNK_SIZE = 1000
+
+# Цены строк оформленных заказов берутся из заказов магазинов, собранных при оформлении,
+# а для строк без заказа магазина - текущие цены позиций
+
+
+def fill_order_item_prices(apps, schema_editor):
+    OrderItem = apps.get_model('dbackend', 'OrderItem')
+    ProductInfo = apps.get_model('dbackend', 'ProductInfo')
+    ShopOrder = apps.get_model('dbackend', 'ShopOrder')
+    prices = {}
+    for lines in ShopOrder.objects.values_list('lines', flat=True).iterator(chunk_size=CHUNK_SIZE):
+        prices.update((line['id'], line['price']) for line in lines)
+    item_ids = sorted(prices)
+    for start in range(0, len(item_ids), CHUNK_SIZE):
+        items = list(OrderItem.objects.filter(id__in=item_ids[start:start + CHUNK_SIZE]).only('id'))
+        for item in items:
+            item.price = prices[item.id]
+        OrderItem.objects.bulk_update(items, ['price'])
+    OrderItem.objects.filter(price__isnull=True).exclude(order__status='basket').update(
+        price=Subquery(ProductInfo.objects.filter(id=OuterRef('product_info_id')).values('price')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0027_order_basket_shop_totals_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Цена'),
+        ),
+        migrations.RunPython(fill_order_item_prices, migrations.RunPython.noop),
+    ]
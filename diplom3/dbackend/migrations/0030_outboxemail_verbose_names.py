@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0029_orderstatushistory_shop'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboxemail',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, verbose_name='Создано'),
+        ),
+        migrations.AlterField(
+            model_name='outboxemail',
+            name='sent_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Отправлено'),
+        ),
+    ]
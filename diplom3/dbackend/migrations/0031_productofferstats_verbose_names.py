@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0030_outboxemail_verbose_names'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productofferstats',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Обновлено'),
+        ),
+    ]
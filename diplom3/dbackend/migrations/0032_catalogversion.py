@@ -0,0 +1,28 @@
+# Generated by Django 5.0 on 2026-10-18 20:17
+
+from django.db import migrations, models
+
+# Версии каталога переносятся из кэша в базе (0026) в свою таблицу: смена версий - один запрос.
+# Старые версии не переносятся, ключи создаются заново при первом чтении.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbackend', '0031_productofferstats_verbose_names'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Ключ')),
+                ('version', models.BigIntegerField(verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия каталога',
+                'verbose_name_plural': 'Версии каталога',
+            },
+        ),
+        migrations.RunSQL('DROP TABLE IF EXISTS catalog_versions', migrations.RunSQL.noop),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 
 from .managers import UserManager
 
@@ -19,6 +20,29 @@ STATE_CHOICES = (
     ('canceled', 'Отменен'),
 )
 
+# Допустимые переходы статусов оформленного заказа
+ORDER_TRANSITIONS = {
+    'new': ('confirmed', 'canceled'),
+    'confirmed': ('assembled', 'canceled'),
+    'assembled': ('sent', 'canceled'),
+    'sent': ('delivered',),
+    'delivered': (),
+    'canceled': (),
+}
+
+IMPORT_JOB_STATUS_CHOICES = (
+    ('queued', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('done', 'Завершен'),
+    ('failed', 'Ошибка'),
+)
+
+OUTBOX_STATUS_CHOICES = (
+    ('queued', 'В очереди'),
+    ('sent', 'Отправлено'),
+    ('failed', 'Не отправлено'),
+)
+
 
 class User(AbstractUser):
     email = models.EmailField(unique=True, verbose_name='Адрес почты')
@@ -48,6 +72,11 @@ class Shop(models.Model):
     class Meta:
         verbose_name = 'Магазин'
         verbose_name_plural = "Список магазинов"
+        constraints = [
+            # Магазины без владельца импорт находит по названию
+            models.UniqueConstraint(fields=['name'], condition=models.Q(user__isnull=True),
+                                    name='unique_ownerless_shop_name'),
+        ]
 
     def __str__(self):
         return self.name
@@ -73,6 +102,10 @@ class Product(models.Model):
     class Meta:
         verbose_name = 'Продукт'
         verbose_name_plural = "Список продуктов"
+        constraints = [
+            # Импорт ищет продукт по названию и категории, индекс также обслуживает поиск по названию
+            models.UniqueConstraint(fields=['name', 'category'], name='unique_product_name_category'),
+        ]
 
     def __str__(self):
         return self.name
@@ -87,10 +120,17 @@ class ProductInfo(models.Model):
     quantity = models.PositiveIntegerField(verbose_name='Количество')
     price = models.PositiveIntegerField(verbose_name='Цена')
     price_rrc = models.PositiveIntegerField(verbose_name='Рекомендуемая цена')
+    external_id = models.PositiveBigIntegerField(verbose_name='Идентификатор у поставщика', blank=True, null=True)
 
     class Meta:
         verbose_name = 'Информация о продукте'
         verbose_name_plural = "Список информации о продукте"
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'external_id'], name='unique_shop_external_id'),
+        ]
+        indexes = [
+            models.Index(fields=['shop', 'product'], name='product_info_shop_product_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -102,6 +142,9 @@ class Parameter(models.Model):
     class Meta:
         verbose_name = 'Название параметра'
         verbose_name_plural = 'Список названий параметров'
+        constraints = [
+            models.UniqueConstraint(fields=['name'], name='unique_parameter_name'),
+        ]
 
     def __str__(self):
         return self.name
@@ -150,10 +193,22 @@ class Order(models.Model):
     status = models.CharField(max_length=15, choices=STATE_CHOICES, verbose_name='Статус')
     contact = models.ForeignKey(Contact, verbose_name='Контакт', blank=True, null=True,
                                 on_delete=models.CASCADE)
+    # Итоги хранятся в заказе и меняются вместе со строками, чтобы чтение корзины не требовало агрегации
+    items_count = models.PositiveIntegerField(default=0, verbose_name='Количество товаров')
+    total_sum = models.PositiveBigIntegerField(default=0, verbose_name='Сумма')
+    shop_totals = models.JSONField(default=dict, blank=True, verbose_name='Итоги по магазинам')
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Список заказов'
+        constraints = [
+            # У пользователя одна корзина
+            models.UniqueConstraint(fields=['user'], condition=models.Q(status='basket'), name='unique_user_basket'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+            models.Index(fields=['status', 'dt'], name='order_status_dt_idx'),
+        ]
 
     def __str__(self):
         return str(self.dt)
@@ -168,11 +223,210 @@ class OrderItem(models.Model):
     product_info = models.ForeignKey(ProductInfo, verbose_name='Информация о продукте', related_name='ordered_items',
                                      blank=True,
                                      on_delete=models.CASCADE)
+    # Цена на момент оформления; у строк корзины не заполнена, корзина считается по текущим ценам
+    price = models.PositiveIntegerField(verbose_name='Цена', blank=True, null=True)
 
     class Meta:
         verbose_name = 'Заказанная позиция'
         verbose_name_plural = "Список заказанных позиций"
+        constraints = [
+            # Повторное добавление позиции в заказ увеличивает количество в существующей строке
+            models.UniqueConstraint(fields=['order', 'product_info'], name='unique_order_product_info'),
+        ]
 
     def __str__(self):
         return f'{self.product_info.product.name} количество {self.quantity}'
 
+
+
+class ImportJob(models.Model):
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='import_jobs', on_delete=models.CASCADE)
+    url = models.URLField(max_length=500, verbose_name='Ссылка на прайс-лист')
+    mode = models.CharField(max_length=10, verbose_name='Режим импорта', default='sync')
+    force = models.BooleanField(default=False, verbose_name='Загрузить даже без изменений')
+    status = models.CharField(max_length=10, choices=IMPORT_JOB_STATUS_CHOICES, verbose_name='Статус',
+                              default='queued')
+    phase = models.CharField(max_length=30, verbose_name='Этап', blank=True)
+    rows_processed = models.PositiveIntegerField(verbose_name='Обработано позиций', default=0)
+    stats = models.JSONField(verbose_name='Статистика', blank=True, null=True)
+    error = models.TextField(verbose_name='Ошибка', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создана')
+    started_at = models.DateTimeField(blank=True, null=True, verbose_name='Начата')
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name='Завершена')
+
+    class Meta:
+        verbose_name = 'Задача импорта'
+        verbose_name_plural = 'Список задач импорта'
+
+    def __str__(self):
+        return f'{self.url} {self.status}'
+
+
+class FeedSource(models.Model):
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='feed_sources', on_delete=models.CASCADE)
+    url = models.URLField(max_length=500, verbose_name='Ссылка на прайс-лист')
+    etag = models.CharField(max_length=200, verbose_name='ETag', blank=True)
+    last_modified = models.CharField(max_length=50, verbose_name='Last-Modified', blank=True)
+    content_hash = models.CharField(max_length=64, verbose_name='sha256 содержимого', blank=True)
+    checked_at = models.DateTimeField(blank=True, null=True, verbose_name='Последняя проверка')
+    imported_at = models.DateTimeField(blank=True, null=True, verbose_name='Последний импорт')
+
+    class Meta:
+        verbose_name = 'Источник прайс-листа'
+        verbose_name_plural = 'Список источников прайс-листов'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'url'], name='unique_user_feed_url'),
+        ]
+
+    def __str__(self):
+        return self.url
+
+
+class ProductCard(models.Model):
+    '''
+    Готовая карточка товара в магазине: data совпадает с выводом ProductInfoSerializer,
+    parameters - словарь {название параметра: значение}
+    '''
+    product_info = models.OneToOneField(ProductInfo, verbose_name='Информация о продукте', primary_key=True,
+                                        on_delete=models.CASCADE, related_name='card')
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='product_cards', blank=True, null=True,
+                             on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, verbose_name='Продукт', related_name='product_cards',
+                                on_delete=models.CASCADE)
+    data = models.JSONField(verbose_name='Карточка')
+    parameters = models.JSONField(verbose_name='Параметры', default=dict)
+
+    class Meta:
+        verbose_name = 'Карточка товара'
+        verbose_name_plural = 'Список карточек товаров'
+        indexes = [
+            models.Index(fields=['shop', 'product_info'], name='product_card_shop_idx'),
+            models.Index(fields=['product', 'product_info'], name='product_card_product_idx'),
+        ]
+
+    def __str__(self):
+        return self.data.get('name', '')
+
+
+class ProductOfferStats(models.Model):
+    '''
+    Сводка предложений продукта по всем магазинам. Лучшее предложение и общее количество
+    считаются только по магазинам, принимающим заказы, лучшее - самое дешевое из имеющихся в наличии.
+    '''
+    product = models.OneToOneField(Product, verbose_name='Продукт', primary_key=True, on_delete=models.CASCADE,
+                                   related_name='offer_stats')
+    offers_count = models.PositiveIntegerField(verbose_name='Количество предложений')
+    min_price = models.PositiveIntegerField(verbose_name='Минимальная цена')
+    max_price = models.PositiveIntegerField(verbose_name='Максимальная цена')
+    median_price = models.FloatField(verbose_name='Медианная цена')
+    best_offer = models.ForeignKey(ProductInfo, verbose_name='Лучшее предложение', related_name='+', blank=True,
+                                   null=True, on_delete=models.SET_NULL)
+    best_shop = models.ForeignKey(Shop, verbose_name='Магазин с лучшим предложением', related_name='+', blank=True,
+                                  null=True, on_delete=models.SET_NULL)
+    best_price = models.PositiveIntegerField(verbose_name='Лучшая цена', blank=True, null=True)
+    total_quantity = models.PositiveBigIntegerField(verbose_name='Доступное количество', default=0)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
+
+    class Meta:
+        verbose_name = 'Сводка предложений'
+        verbose_name_plural = 'Список сводок предложений'
+
+    def __str__(self):
+        return f'{self.product_id}: {self.min_price}-{self.max_price}'
+
+
+class ShopOrder(models.Model):
+    '''
+    Часть оформленного заказа, относящаяся к одному магазину: строки с ценами и итоги.
+    Список заказов магазина читается только из этой таблицы.
+    '''
+    order = models.ForeignKey(Order, verbose_name='Заказ', related_name='shop_orders', on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='shop_orders', on_delete=models.CASCADE)
+    status = models.CharField(max_length=15, choices=STATE_CHOICES, verbose_name='Статус')
+    dt = models.DateTimeField(verbose_name='Дата заказа')
+    items_count = models.PositiveIntegerField(default=0, verbose_name='Количество товаров')
+    total_sum = models.PositiveBigIntegerField(default=0, verbose_name='Сумма')
+    lines = models.JSONField(default=list, verbose_name='Строки заказа')
+    contact = models.JSONField(blank=True, null=True, verbose_name='Контакт')
+
+    class Meta:
+        verbose_name = 'Заказ магазина'
+        verbose_name_plural = 'Список заказов магазинов'
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'shop'], name='unique_shop_order'),
+        ]
+        indexes = [
+            models.Index(fields=['shop', 'status', 'dt'], name='shop_order_status_dt_idx'),
+            models.Index(fields=['shop', 'dt'], name='shop_order_dt_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.order_id}: {self.shop_id}'
+
+
+class OrderStatusHistory(models.Model):
+    order = models.ForeignKey(Order, verbose_name='Заказ', related_name='status_history', on_delete=models.CASCADE)
+    # Магазин, чья часть заказа переведена; не заполнен при смене статуса всего заказа
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='+', blank=True, null=True,
+                             on_delete=models.SET_NULL)
+    status_from = models.CharField(max_length=15, choices=STATE_CHOICES, verbose_name='Прежний статус')
+    status_to = models.CharField(max_length=15, choices=STATE_CHOICES, verbose_name='Новый статус')
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='+', blank=True, null=True,
+                             on_delete=models.SET_NULL)
+    dt = models.DateTimeField(auto_now_add=True, verbose_name='Дата изменения')
+
+    class Meta:
+        verbose_name = 'Изменение статуса заказа'
+        verbose_name_plural = 'История статусов заказов'
+        indexes = [
+            models.Index(fields=['order', 'dt'], name='order_status_history_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.order_id}: {self.status_from} -> {self.status_to}'
+
+
+class OutboxEmail(models.Model):
+    '''
+    Письмо в очереди на отправку: сохраняется в транзакции запроса, отправляется командой send_outbox
+    '''
+    subject = models.TextField(verbose_name='Тема')
+    body = models.TextField(blank=True, verbose_name='Текст')
+    html_body = models.TextField(blank=True, verbose_name='Текст HTML')
+    from_email = models.CharField(max_length=254, verbose_name='Отправитель')
+    to = models.JSONField(default=list, verbose_name='Получатели')
+    cc = models.JSONField(default=list, blank=True, verbose_name='Копия')
+    bcc = models.JSONField(default=list, blank=True, verbose_name='Скрытая копия')
+    reply_to = models.JSONField(default=list, blank=True, verbose_name='Адрес для ответа')
+    headers = models.JSONField(default=dict, blank=True, verbose_name='Заголовки')
+    status = models.CharField(max_length=10, choices=OUTBOX_STATUS_CHOICES, default='queued', verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток отправки')
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name='Следующая попытка')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
+    sent_at = models.DateTimeField(blank=True, null=True, verbose_name='Отправлено')
+
+    class Meta:
+        verbose_name = 'Письмо'
+        verbose_name_plural = 'Очередь писем'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_email_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} ({self.status})'
+
+
+class CatalogVersion(models.Model):
+    '''
+    Версия каталога по ключу, общая для всех процессов: смена версий - один запрос на все ключи
+    '''
+    key = models.CharField(max_length=100, primary_key=True, verbose_name='Ключ')
+    version = models.BigIntegerField(verbose_name='Версия')
+
+    class Meta:
+        verbose_name = 'Версия каталога'
+        verbose_name_plural = 'Версии каталога'
+
+    def __str__(self):
+        return f'{self.key}: {self.version}'
@@ -0,0 +1,31 @@
+from django.core.mail import EmailMessage, get_connection
+
+from dbackend.models import Order, Shop, User, STATE_CHOICES
+
+STATUS_LABELS = dict(STATE_CHOICES)
+
+
+def notify_order_placed(order, shop_ids):
+    '''
+    Письма покупателю и магазинам об оформленном заказе, одним запросом в очередь
+    '''
+    buyer = User.objects.filter(id=order.user_id).values_list('email', flat=True).first()
+    messages = [EmailMessage(f'Заказ №{order.id} оформлен',
+                             f'Заказ №{order.id} принят: товаров {order.items_count}, сумма {order.total_sum}.',
+                             to=[buyer])] if buyer else []
+    for shop_id, email in Shop.objects.filter(id__in=shop_ids, user__isnull=False).values_list('id', 'user__email'):
+        subtotal = order.shop_totals.get(str(shop_id), {'items_count': 0, 'total_sum': 0})
+        messages.append(EmailMessage(f'Новый заказ №{order.id}',
+                                     f'Поступил заказ №{order.id}: товаров {subtotal["items_count"]}, '
+                                     f'сумма {subtotal["total_sum"]}.', to=[email]))
+    get_connection().send_messages(messages)
+
+
+def notify_status_changed(order_ids, status):
+    '''
+    Письма покупателям о новом статусе заказов, одним запросом в очередь
+    '''
+    label = STATUS_LABELS[status]
+    get_connection().send_messages([
+        EmailMessage(f'Заказ №{pk}: {label}', f'Статус заказа №{pk} изменен: {label}.', to=[email])
+        for pk, email in Order.objects.filter(id__in=order_ids).values_list('id', 'user__email')])
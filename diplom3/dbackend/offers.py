@@ -0,0 +1,74 @@
+from itertools import groupby
+from statistics import median
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from dbackend.models import ProductInfo, ProductOfferStats, Shop
+from dbackend.signals import catalog_updated, on_commit_batch, stock_updated
+
+CHUNK_SIZE = 1000
+
+OFFER_STATS_FIELDS = ['offers_count', 'min_price', 'max_price', 'median_price', 'best_offer', 'best_shop',
+                      'best_price', 'total_quantity', 'updated_at']
+
+
+def build_offer_stats(product_id, offers):
+    '''
+    Сводка по предложениям продукта, offers - кортежи (id, магазин, цена, количество, статус магазина),
+    отсортированные по цене и id
+    '''
+    prices = [price for _, _, price, _, _ in offers]
+    accepting = [offer for offer in offers if offer[4]]
+    best = next((offer for offer in accepting if offer[3] > 0), None)
+    return ProductOfferStats(product_id=product_id,
+                             offers_count=len(offers),
+                             min_price=prices[0],
+                             max_price=prices[-1],
+                             median_price=median(prices),
+                             best_offer_id=best[0] if best else None,
+                             best_shop_id=best[1] if best else None,
+                             best_price=best[2] if best else None,
+                             total_quantity=sum(quantity for _, _, _, quantity, _ in accepting))
+
+
+def refresh_offer_stats(product_ids):
+    '''
+    Пересчет сводок для указанных продуктов, по одному запросу на чтение и запись на пакет.
+    Сводки продуктов без предложений удаляются.
+    '''
+    product_ids = sorted({product_id for product_id in product_ids if product_id})
+    for start in range(0, len(product_ids), CHUNK_SIZE):
+        chunk = product_ids[start:start + CHUNK_SIZE]
+        offers = ProductInfo.objects.filter(product_id__in=chunk).order_by('product_id', 'price', 'id').values_list(
+            'product_id', 'id', 'shop_id', 'price', 'quantity', 'shop__status')
+        stats = [build_offer_stats(product_id, [offer[1:] for offer in product_offers])
+                 for product_id, product_offers in groupby(offers, key=lambda offer: offer[0])]
+        ProductOfferStats.objects.bulk_create(stats, update_conflicts=True, unique_fields=['product'],
+                                              update_fields=OFFER_STATS_FIELDS)
+        ProductOfferStats.objects.filter(product_id__in=set(chunk) - {item.product_id for item in stats}).delete()
+
+
+@receiver(catalog_updated)
+@receiver(stock_updated)
+def refresh_updated_offer_stats(sender, product_ids=(), **kwargs):
+    refresh_offer_stats(product_ids)
+
+
+@receiver(post_save, sender=ProductInfo)
+def refresh_product_info_offer_stats(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_offer_stats([instance.product_id])
+
+
+@receiver(post_delete, sender=ProductInfo)
+def refresh_deleted_product_info_offer_stats(sender, instance, **kwargs):
+    on_commit_batch(refresh_offer_stats, [instance.product_id])
+
+
+@receiver(post_save, sender=Shop)
+def refresh_shop_offer_stats(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    # От статуса магазина зависят лучшее предложение и доступное количество
+    if not raw and not created and (update_fields is None or 'status' in update_fields):
+        refresh_offer_stats(ProductInfo.objects.filter(shop_id=instance.id).values_list(
+            'product_id', flat=True).distinct())
@@ -0,0 +1,23 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CatalogCursorPagination(CursorPagination):
+    '''
+    Постраничный вывод по ключу: следующая страница выбирается условием id > последнего id на странице,
+    без OFFSET, поэтому время ответа не зависит от номера страницы.
+    Размер страницы задается PAGE_SIZE в REST_FRAMEWORK и параметром page_size, но не больше max_page_size.
+    '''
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class ProductCardCursorPagination(CatalogCursorPagination):
+    ordering = 'product_info_id'
+
+
+class ShopOrderCursorPagination(CatalogCursorPagination):
+    '''
+    Заказы магазина от новых к старым, по индексу (магазин, статус, дата)
+    '''
+    ordering = '-dt'
@@ -0,0 +1,94 @@
+import ujson
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from dbackend.models import OrderItem, ProductInfo, ProductParameter, Contact
+
+CONTACT_FIELDS = ('id', 'city', 'street', 'house', 'structure', 'building', 'apartment', 'phone')
+
+
+class UJSONRenderer(JSONRenderer):
+    '''
+    JSONRenderer на ujson с тем же результатом для компактного вывода:
+    отступы и типы, которые ujson не умеет выводить, передаются стандартному JSONRenderer
+    '''
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not self.compact or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = ujson.dumps(data, ensure_ascii=self.ensure_ascii, escape_forward_slashes=False,
+                              allow_nan=not self.strict)
+        except (TypeError, OverflowError):
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+
+def datetime_data(value):
+    '''
+    Дата и время в формате serializers.DateTimeField
+    '''
+    if value is None:
+        return None
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def product_infos_data(product_info_ids):
+    '''
+    Позиции в формате ProductInfoSerializer двумя запросами: {id позиции: данные}
+    '''
+    product_infos = {}
+    for pk, product_id, product_name, category_name, shop_id, name, quantity, price, price_rrc in \
+            ProductInfo.objects.filter(id__in=product_info_ids).values_list(
+                'id', 'product_id', 'product__name', 'product__category__name', 'shop_id', 'name', 'quantity',
+                'price', 'price_rrc'):
+        product_infos[pk] = {
+            'id': pk,
+            'product': {'name': product_name, 'category': category_name, 'id': product_id},
+            'shop': shop_id,
+            'name': name,
+            'quantity': quantity,
+            'price': price,
+            'price_rrc': price_rrc,
+            'product_parameters': [],
+        }
+    for product_info_id, parameter, value in ProductParameter.objects.filter(
+            product_info_id__in=product_info_ids).order_by('id').values_list(
+            'product_info_id', 'parameter__name', 'value'):
+        product_infos[product_info_id]['product_parameters'].append({'parameter': parameter, 'value': value})
+    return product_infos
+
+
+def orders_data(orders):
+    '''
+    Заказы в формате OrderSerializer
+    '''
+    rows = list(orders.order_by('id').values_list('id', 'status', 'dt', 'contact_id', 'total_sum', 'items_count',
+                                                  'shop_totals'))
+    items = {}
+    item_rows = list(OrderItem.objects.filter(order_id__in=[row[0] for row in rows]).order_by('id').values_list(
+        'id', 'order_id', 'product_info_id', 'quantity'))
+    product_infos = product_infos_data({row[2] for row in item_rows})
+    for pk, order_id, product_info_id, quantity in item_rows:
+        items.setdefault(order_id, []).append({'id': pk, 'product_info': product_infos[product_info_id],
+                                               'quantity': quantity})
+    contact_ids = {row[3] for row in rows if row[3] is not None}
+    contacts = {contact['id']: contact for contact in Contact.objects.filter(id__in=contact_ids).values(
+        *CONTACT_FIELDS)} if contact_ids else {}
+    return [{
+        'id': pk,
+        'ordered_items': items.get(pk, []),
+        'status': status,
+        'dt': datetime_data(dt),
+        'total_sum': total_sum,
+        'items_count': items_count,
+        'shop_totals': shop_totals,
+        'contact': contacts.get(contact_id),
+    } for pk, status, dt, contact_id, total_sum, items_count, shop_totals in rows]
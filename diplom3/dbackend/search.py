@@ -0,0 +1,153 @@
+import heapq
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Greatest
+
+from dbackend.cache import ShopIndexes
+from dbackend.models import Product, ProductInfo
+
+SEARCH_CONFIG = 'russian'
+# Минимальная доля совпавших триграмм запроса, как pg_trgm.word_similarity_threshold
+SIMILARITY_THRESHOLD = 0.3
+
+WORD_RE = re.compile(r'\w+')
+
+# Окончания для упрощенного стемминга, длинные проверяются раньше
+RUSSIAN_ENDINGS = sorted((
+    'ами', 'ями', 'ов', 'ев', 'ей', 'ом', 'ем', 'ой', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие',
+    'ого', 'его', 'ому', 'ему', 'ых', 'их', 'ым', 'им', 'ую', 'юю', 'ах', 'ях', 'ам', 'ям',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+
+
+def normalize_text(text):
+    return str(text).casefold().replace('ё', 'е')
+
+
+def stem(word):
+    '''
+    Отбрасывание русского окончания, основа не короче трех букв
+    '''
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    return [stem(word) for word in WORD_RE.findall(normalize_text(text))]
+
+
+def word_trigrams(word, prefix=False):
+    '''
+    Триграммы слова с пробелами по краям, как в pg_trgm.
+    Для слова запроса правый край не дополняется, тогда начало слова совпадает со всеми триграммами.
+    '''
+    padded = f'  {word}' if prefix else f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def query_trigrams(query):
+    trigrams = set()
+    for word in tokenize(query):
+        trigrams |= word_trigrams(word, prefix=True)
+    return trigrams
+
+
+class ShopNgrams:
+    '''
+    Триграммный индекс позиций одного магазина по названию продукта и модели: триграмма -> id позиций
+    '''
+
+    def __init__(self, shop_id):
+        self.shop_id = shop_id
+        self.postings = {}
+        self.sizes = {}
+        for pk, product_name, name in ProductInfo.objects.filter(shop_id=shop_id).values_list(
+                'id', 'product__name', 'name').iterator():
+            trigrams = set()
+            for word in tokenize(f'{product_name} {name}'):
+                trigrams |= word_trigrams(word)
+            self.sizes[pk] = len(trigrams)
+            for trigram in trigrams:
+                self.postings.setdefault(trigram, set()).add(pk)
+
+    def search(self, trigrams, limit):
+        '''
+        Первые limit троек (доля совпавших триграмм запроса, число триграмм позиции, id) по убыванию доли
+        '''
+        counts = {}
+        for trigram in trigrams:
+            for pk in self.postings.get(trigram, ()):
+                counts[pk] = counts.get(pk, 0) + 1
+        threshold = SIMILARITY_THRESHOLD * len(trigrams)
+        # При равной доле выше позиции с более коротким названием
+        best = heapq.nsmallest(limit, ((-count, self.sizes[pk], pk) for pk, count in counts.items()
+                                       if count >= threshold))
+        return [(-negative_count / len(trigrams), size, pk) for negative_count, size, pk in best]
+
+
+class NgramIndex(ShopIndexes):
+    '''
+    Поиск по названию в памяти процесса, запасной вариант для баз без полнотекстового поиска
+    '''
+    shop_index_class = ShopNgrams
+
+    def search(self, query, shop=None, limit=50):
+        trigrams = query_trigrams(query)
+        if not trigrams:
+            return []
+        self.refresh()
+        shops = self.shops
+        if shop is not None:
+            shops = {shop: shops[shop]} if shop in shops else {}
+        found = []
+        for shop_ngrams in shops.values():
+            found = heapq.nsmallest(limit, found + shop_ngrams.search(trigrams, limit),
+                                    key=lambda item: (-item[0], item[1], item[2]))
+        return [(pk, rank) for rank, _, pk in found]
+
+
+ngram_index = NgramIndex()
+
+
+def _postgres_search(query, shop=None, limit=50):
+    '''
+    Полнотекстовый поиск с русским стеммингом и поиском по началу слов по названию продукта
+    и поиск по схожести триграмм по названию продукта и модели, оба по GIN индексам
+    '''
+    words = WORD_RE.findall(query)
+    if not words:
+        return []
+    # Слова состоят из букв и цифр, поэтому их можно подставить в запрос без экранирования
+    search_query = SearchQuery(' & '.join(f'{word}:*' for word in words), search_type='raw', config=SEARCH_CONFIG)
+    vector = SearchVector('name', config=SEARCH_CONFIG)
+    product_infos = ProductInfo.objects.all()
+    candidates = Product.objects.all()
+    if shop is not None:
+        product_infos = product_infos.filter(shop_id=shop)
+        # Продукты магазина отбираются до ранжирования, иначе первые limit продуктов других магазинов
+        # вытеснят совпадения в нем
+        candidates = candidates.filter(id__in=product_infos.values('product_id'))
+    products = dict(candidates.annotate(search=vector).filter(
+        Q(search=search_query) | Q(name__trigram_word_similar=query)).annotate(
+        rank=Greatest(SearchRank(vector, search_query), TrigramWordSimilarity(query, 'name'))).order_by(
+        '-rank').values_list('id', 'rank')[:limit])
+
+    ranks = dict(product_infos.filter(name__trigram_word_similar=query).annotate(
+        rank=TrigramWordSimilarity(query, 'name')).order_by('-rank').values_list('id', 'rank')[:limit])
+    for pk, product_id in product_infos.filter(product_id__in=products).values_list('id', 'product_id'):
+        ranks[pk] = max(ranks.get(pk, 0), products[product_id])
+    return heapq.nsmallest(limit, ranks.items(), key=lambda item: (-item[1], item[0]))
+
+
+def search_products(query, shop=None, limit=50):
+    '''
+    Список пар (id позиции, релевантность) по убыванию релевантности
+    '''
+    if connection.vendor == 'postgresql':
+        return _postgres_search(query, shop, limit)
+    return ngram_index.search(query, shop, limit)
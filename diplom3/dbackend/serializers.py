@@ -1,6 +1,58 @@
+from django.db.models import Prefetch
+from django.utils import timezone
 from rest_framework import serializers
 
-from .models import Shop, ProductInfo, Product, ProductParameter, OrderItem, Order, Contact, User, Category
+from .models import Shop, ProductInfo, Product, ProductParameter, OrderItem, Order, Contact, User, Category, ImportJob, \
+    ProductOfferStats
+
+
+class EagerLoadingMixin:
+    '''
+    Сериализатор объявляет связи, которые он читает:
+    select_related_fields - связи к одному объекту, {связь: сериализатор связанного объекта или None},
+    prefetch_related_fields - связи ко многим, {связь: сериализатор элемента},
+    only_fields - читаемые столбцы самой модели, пусто - все столбцы.
+    setup_eager_loading(queryset) подгружает эти связи вместе со связями вложенных сериализаторов,
+    так что число запросов не зависит от числа строк.
+    '''
+    select_related_fields = {}
+    prefetch_related_fields = {}
+    only_fields = ()
+
+    @classmethod
+    def eager_loading(cls, prefix=''):
+        '''
+        Аргументы select_related, prefetch_related и only для пути prefix от корневой модели
+        '''
+        select = []
+        prefetch = []
+        only = [prefix + name for name in cls.only_fields] if cls.only_fields else []
+        for name, serializer in cls.select_related_fields.items():
+            select.append(prefix + name)
+            if only:
+                only.append(prefix + name)
+            if serializer is not None:
+                nested_select, nested_prefetch, nested_only = serializer.eager_loading(f'{prefix}{name}__')
+                select += nested_select
+                prefetch += nested_prefetch
+                only += nested_only if only else []
+        for name, serializer in cls.prefetch_related_fields.items():
+            # Связь с родителем нужна, чтобы разложить подгруженные объекты по родителям
+            parent = cls.Meta.model._meta.get_field(name).remote_field.name
+            queryset = serializer.setup_eager_loading(serializer.Meta.model.objects.order_by('pk'), extra_only=[parent])
+            prefetch.append(Prefetch(prefix + name, queryset=queryset))
+        return select, prefetch, only
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, extra_only=()):
+        select, prefetch, only = cls.eager_loading()
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        if only:
+            queryset = queryset.only(*only, *extra_only)
+        return queryset
 
 
 class ShopSerializer(serializers.ModelSerializer):
@@ -17,17 +69,23 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     category = serializers.StringRelatedField()
 
+    select_related_fields = {'category': None}
+    only_fields = ('name', 'category__name')
+
     class Meta:
         model = Product
         fields = ('name', 'category', 'id')
 
 
-class ProductParameterSerializer(serializers.ModelSerializer):
+class ProductParameterSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     parameter = serializers.StringRelatedField()
 
+    select_related_fields = {'parameter': None}
+    only_fields = ('value', 'parameter__name')
+
     class Meta:
         model = ProductParameter
         fields = ('parameter', 'value',)
@@ -43,10 +101,14 @@ class ContactSerializer(serializers.ModelSerializer):
         }
 
 
-class ProductInfoSerializer(serializers.ModelSerializer):
+class ProductInfoSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_parameters = ProductParameterSerializer(read_only=True, many=True)
 
+    select_related_fields = {'product': ProductSerializer}
+    prefetch_related_fields = {'product_parameters': ProductParameterSerializer}
+    only_fields = ('shop', 'name', 'quantity', 'price', 'price_rrc')
+
     class Meta:
         model = ProductInfo
         fields = ('id', 'product', 'shop', 'name', 'quantity', 'price', 'price_rrc', 'product_parameters',)
@@ -63,17 +125,47 @@ class OrderItemSerializer(serializers.ModelSerializer):
         }
 
 
-class OrderItemCreateSerializer(OrderItemSerializer):
+class OrderItemCreateSerializer(EagerLoadingMixin, OrderItemSerializer):
     product_info = ProductInfoSerializer(read_only=True)
 
+    select_related_fields = {'product_info': ProductInfoSerializer}
+    only_fields = ('quantity',)
+
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     ordered_items = OrderItemCreateSerializer(read_only=True, many=True)
 
-    total_sum = serializers.IntegerField()
     contact = ContactSerializer(read_only=True)
 
+    select_related_fields = {'contact': None}
+    prefetch_related_fields = {'ordered_items': OrderItemCreateSerializer}
+    only_fields = ('status', 'dt', 'total_sum', 'items_count', 'shop_totals')
+
     class Meta:
         model = Order
-        fields = ('id', 'ordered_items', 'status', 'dt', 'total_sum', 'contact',)
-        read_only_fields = ('id',)
+        fields = ('id', 'ordered_items', 'status', 'dt', 'total_sum', 'items_count', 'shop_totals', 'contact',)
+        read_only_fields = ('id', 'total_sum', 'items_count', 'shop_totals',)
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    rows_per_sec = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'url', 'mode', 'force', 'status', 'phase', 'rows_processed', 'rows_per_sec', 'error', 'stats',
+                  'created_at', 'started_at', 'finished_at',)
+        read_only_fields = fields
+
+    def get_rows_per_sec(self, obj):
+        if obj.started_at is None:
+            return 0
+        elapsed = ((obj.finished_at or timezone.now()) - obj.started_at).total_seconds()
+        return round(obj.rows_processed / elapsed, 1) if elapsed > 0 else 0
+
+
+class ProductOfferStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductOfferStats
+        fields = ('product', 'offers_count', 'min_price', 'max_price', 'median_price', 'best_offer', 'best_shop',
+                  'best_price', 'total_quantity',)
+        read_only_fields = fields
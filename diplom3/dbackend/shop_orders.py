@@ -0,0 +1,104 @@
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from dbackend.models import STATE_CHOICES, Contact, Order, OrderItem, ProductInfo, ShopOrder
+from dbackend.rendering import CONTACT_FIELDS, datetime_data
+
+CHUNK_SIZE = 1000
+# Порядок продвижения оформленного заказа
+ORDER_PROGRESS = [status for status, _ in STATE_CHOICES if status not in ('basket', 'canceled')]
+
+
+def order_status(shop_statuses):
+    '''
+    Статус заказа по статусам заказов магазинов: отменен, если отменены все,
+    иначе статус наименее продвинувшейся из неотмененных частей
+    '''
+    active = [status for status in shop_statuses if status != 'canceled']
+    return min(active, key=ORDER_PROGRESS.index) if active else 'canceled'
+
+
+def build_shop_orders(order_ids):
+    '''
+    Заказы магазинов по строкам оформленных заказов: по одному на заказ и магазин, корзины пропускаются.
+    Цены - зафиксированные в строках при оформлении, а не текущие цены позиций.
+    '''
+    orders = {pk: (status, dt, contact_id) for pk, status, dt, contact_id in Order.objects.filter(
+        id__in=order_ids).exclude(status='basket').values_list('id', 'status', 'dt', 'contact_id')}
+    contact_ids = {contact_id for _, _, contact_id in orders.values() if contact_id is not None}
+    contacts = {contact['id']: contact for contact in Contact.objects.filter(id__in=contact_ids).values(
+        *CONTACT_FIELDS)} if contact_ids else {}
+
+    shop_orders = {}
+    for pk, order_id, product_info_id, shop_id, product_name, name, quantity, price in OrderItem.objects.filter(
+            order_id__in=orders).order_by('id').values_list(
+            'id', 'order_id', 'product_info_id', 'product_info__shop_id', 'product_info__product__name',
+            'product_info__name', 'quantity', 'price'):
+        shop_order = shop_orders.get((order_id, shop_id))
+        if shop_order is None:
+            status, dt, contact_id = orders[order_id]
+            shop_order = shop_orders[order_id, shop_id] = ShopOrder(
+                order_id=order_id, shop_id=shop_id, status=status, dt=dt, items_count=0, total_sum=0, lines=[],
+                contact=contacts.get(contact_id))
+        shop_order.items_count += quantity
+        shop_order.total_sum += quantity * price
+        shop_order.lines.append({'id': pk, 'product_info': product_info_id, 'product': product_name, 'name': name,
+                                 'quantity': quantity, 'price': price})
+    return list(shop_orders.values())
+
+
+def refresh_shop_orders(order_ids):
+    '''
+    Пересоздание заказов магазинов для указанных заказов, по пакетам.
+    Статусы, выставленные магазинами, сохраняются, пока статус заказа с ними согласован;
+    иначе статус заказа изменен целиком и переходит во все его части.
+    '''
+    order_ids = sorted(set(order_ids))
+    for start in range(0, len(order_ids), CHUNK_SIZE):
+        chunk = order_ids[start:start + CHUNK_SIZE]
+        with transaction.atomic():
+            statuses = {}
+            for order_id, shop_id, status in ShopOrder.objects.filter(order_id__in=chunk).values_list(
+                    'order_id', 'shop_id', 'status'):
+                statuses.setdefault(order_id, {})[shop_id] = status
+            shop_orders = build_shop_orders(chunk)
+            for shop_order in shop_orders:
+                parts = statuses.get(shop_order.order_id, {})
+                if shop_order.shop_id in parts and order_status(parts.values()) == shop_order.status:
+                    shop_order.status = parts[shop_order.shop_id]
+            ShopOrder.objects.filter(order_id__in=chunk).delete()
+            ShopOrder.objects.bulk_create(shop_orders)
+
+
+def shop_order_data(pk, status, dt, items_count, total_sum, lines, contact):
+    return {
+        'id': pk,
+        'status': status,
+        'dt': datetime_data(dt),
+        'items_count': items_count,
+        'total_sum': total_sum,
+        'ordered_items': lines,
+        'contact': contact,
+    }
+
+
+@receiver(post_save, sender=Order)
+def refresh_order_shop_orders(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance.status == 'basket':
+        return
+    if update_fields is not None and set(update_fields) <= {'status'}:
+        ShopOrder.objects.filter(order_id=instance.id).update(status=instance.status)
+    else:
+        refresh_shop_orders([instance.id])
+
+
+@receiver(post_save, sender=OrderItem)
+def refresh_order_item_shop_orders(sender, instance, raw=False, **kwargs):
+    # Строки корзин изменяются пакетно без сигналов, здесь - правка строк оформленного заказа.
+    # Строка, добавленная в оформленный заказ вручную, получает текущую цену позиции один раз
+    if not raw:
+        OrderItem.objects.filter(id=instance.id, price__isnull=True).exclude(order__status='basket').update(
+            price=Subquery(ProductInfo.objects.filter(id=OuterRef('product_info_id')).values('price')))
+        refresh_shop_orders([instance.order_id])
@@ -0,0 +1,33 @@
+import threading
+
+from django.db import transaction
+from django.dispatch import Signal
+
+# Изменение каталога без сигналов моделей (bulk_create, bulk_update, update).
+# Аргументы: shop_ids, product_info_ids - созданные и измененные позиции, product_ids - затронутые продукты
+catalog_updated = Signal()
+
+# Изменение только остатков: оформление заказа и возврат отмененных товаров.
+# Аргументы те же, что у catalog_updated; цены, названия и параметры не меняются, поэтому
+# индексы поиска и списки каталога не пересобираются
+stock_updated = Signal()
+
+_pending = threading.local()
+
+
+def on_commit_batch(callback, values):
+    '''
+    Вызов callback(значения) после фиксации транзакции, один на все значения, накопленные за транзакцию.
+    Сигналы удаления приходят по одному на строку, а обработка нужна одна на пакет.
+    После отката накопленные значения обрабатываются вместе со следующей транзакцией.
+    '''
+    pending = _pending.__dict__.setdefault(callback, set())
+    pending.update(values)
+
+    def flush():
+        values = set(pending)
+        pending.clear()
+        if values:
+            callback(values)
+
+    transaction.on_commit(flush)
@@ -1,3 +1,519 @@
-from django.test import TestCase
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+from smtplib import SMTPException
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.tokens import default_token_generator
+from django.core import mail
+from django.core.cache import caches
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import get_resolver
+from django.utils import timezone
+from djoser.utils import encode_uid
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from dbackend.basket import BasketError, add_items, checkout
+from dbackend.cache import catalog_versions
+from dbackend.feeds import FeedFetch
+from dbackend.jobs import run_import_job
+from dbackend.importer import PriceListImporter
+from dbackend.mail import OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_DELAY, deliver_batch
+from dbackend.models import User, Contact, FeedSource, ImportJob, Order, OrderItem, OrderStatusHistory, \
+    OutboxEmail, Parameter, ProductCard, ProductInfo, ProductOfferStats, ProductParameter, ShopOrder
+from dbackend.transitions import transition_orders
+
+CATEGORY_ID = 990100
+
+
+def goods(*items):
+    '''
+    Раздел goods прайс-листа: пары (id товара у поставщика, количество)
+    '''
+    return [{'id': pk, 'category': CATEGORY_ID, 'model': f'test/{pk}', 'name': f'Товар {pk}', 'price': 100 * pk,
+             'price_rrc': 110 * pk, 'quantity': quantity, 'parameters': {'Цвет': 'черный'}} for pk, quantity in items]
+
+
+def import_price_list(owner, items, mode='sync', name='Тестовый магазин', status=True):
+    return PriceListImporter(owner.id, mode=mode).run([
+        ('shop', [{'name': name, 'url': f'https://{owner.username}.example.com/', 'status': status}]),
+        ('categories', [{'id': CATEGORY_ID, 'name': 'Тесты'}]),
+        ('goods', items),
+    ])
+
+
+def budgeted_views(resolver=None):
+    '''
+    Классы представлений из urls.py, у которых задан query_budget
+    '''
+    views = set()
+    for pattern in (resolver or get_resolver()).url_patterns:
+        if hasattr(pattern, 'url_patterns'):
+            views |= budgeted_views(pattern)
+            continue
+        view_class = getattr(pattern.callback, 'view_class', None)
+        if getattr(view_class, 'query_budget', None) is not None:
+            views.add(view_class)
+    return views
+
+
+@override_settings(METRICS_QUERY_HEADERS=True)
+class QueryBudgetTests(TransactionTestCase):
+    '''
+    Количество запросов к базе каждого представления с query_budget не превышает бюджет.
+    TransactionTestCase: оформление и смена статусов выполняют часть запросов после фиксации транзакции,
+    они тоже входят в бюджет.
+    '''
+
+    def setUp(self):
+        caches['catalog'].clear()
+        self.checked = set()
+        self.owner = User.objects.create(email='budget-shop@example.com', username='budget-shop',
+                                         user_type='shop', is_active=True)
+        self.buyer = User.objects.create(email='budget-buyer@example.com', username='budget-buyer',
+                                         is_active=True)
+        PriceListImporter(self.owner.id).run([
+            ('shop', [{'name': 'Магазин для бюджетов', 'url': 'https://budget.example.com/', 'status': True}]),
+            ('categories', [{'id': CATEGORY_ID, 'name': 'Бюджеты'}]),
+            ('goods', [{'id': pk, 'category': CATEGORY_ID, 'model': f'budget/{pk}', 'name': f'Товар {pk}',
+                        'price': 100 * pk, 'price_rrc': 110 * pk, 'quantity': 10,
+                        'parameters': {'Цвет': 'черный', 'Память': 2 ** pk}} for pk in range(1, 21)]),
+        ])
+        self.offers = list(ProductInfo.objects.filter(shop__user=self.owner).order_by('id'))
+        # Ключи версий создаются один раз за время жизни базы, в бюджет входит их чтение
+        catalog_versions(stock=True)
+        catalog_versions(self.offers[0].shop_id)
+        self.as_owner = self.client_for(self.owner)
+        self.as_buyer = self.client_for(self.buyer)
+
+    def client_for(self, user):
+        # Настоящий токен, а не force_authenticate: запрос аутентификации входит в бюджет
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+        return client
+
+    def assertWithinBudget(self, response, status=200):
+        self.assertEqual(response.status_code, status, getattr(response, 'content', b'')[:500])
+        if hasattr(response, 'streaming_content'):
+            b''.join(response.streaming_content)
+        view_class = response.resolver_match.func.view_class
+        queries, budget = int(response['X-Query-Count']), int(response['X-Query-Budget'])
+        self.assertLessEqual(queries, budget, f'{response.request["REQUEST_METHOD"]} {view_class.__name__}')
+        self.checked.add(view_class)
+
+    def test_query_budgets(self):
+        shop_id, product_id = self.offers[0].shop_id, self.offers[0].product_id
+        for path in ('/shops/', '/categories/', '/products/', f'/shop/{shop_id}/', f'/about_product/{product_id}',
+                     f'/offers/{product_id}/', f'/offers/?ids={product_id},{self.offers[1].product_id}'):
+            # Первый ответ строится, второй берется из кэша
+            self.assertWithinBudget(self.as_buyer.get(path))
+            self.assertWithinBudget(self.as_buyer.get(path))
+        self.assertWithinBudget(self.as_buyer.get(f'/shop/{shop_id}/export/', {'mode': 'ndjson'}))
+
+        job = ImportJob.objects.create(user=self.owner, url='https://budget.example.com/feed.yaml', status='done')
+        self.assertWithinBudget(self.as_owner.get(f'/update/{job.id}/'))
+
+        items = [{'product_info': offer.id, 'quantity': 2} for offer in self.offers[:10]]
+        self.assertWithinBudget(self.as_buyer.post('/basket/', {'items': items}, format='json'))
+        lines = list(OrderItem.objects.filter(order__user=self.buyer).order_by('id').values_list('id', flat=True))
+        self.assertWithinBudget(self.as_buyer.put('/basket/', {'items': [
+            {'id': pk, 'quantity': 1} for pk in lines[:5]]}, format='json'))
+        self.assertWithinBudget(self.as_buyer.get('/basket/'))
+        self.assertWithinBudget(self.as_buyer.delete('/basket/', {'items': f'{lines[8]},{lines[9]}'}, format='json'))
+        contact = Contact.objects.create(user=self.buyer, city='Москва', street='Тверская', phone='+7 900 000-00-00')
+        response = self.as_buyer.post('/basket/checkout/', {'contact': contact.id}, format='json')
+        self.assertWithinBudget(response)
+        order_id = response.json()['id']
+
+        self.assertWithinBudget(self.as_owner.get('/byers_orders/'))
+        self.assertWithinBudget(self.as_owner.get('/byers_orders/', {'status': 'new'}))
+        self.assertWithinBudget(self.as_owner.post('/byers_orders/status/', {'ids': [order_id], 'status': 'canceled'},
+                                                   format='json'))
+
+        # Ссылки из писем открываются без токена
+        anonymous = APIClient()
+        user = User.objects.create(email='budget-new@example.com', username='budget-new', is_active=False)
+        uid, token = encode_uid(user.pk), default_token_generator.make_token(user)
+        self.assertWithinBudget(anonymous.get(f'/auth/request_activate/{uid}/{token}/'))
+        user.refresh_from_db()
+        token = default_token_generator.make_token(user)
+        self.assertWithinBudget(anonymous.post(f'/auth/password-reset/{uid}/{token}/',
+                                               {'new_password': 'Budget-parol-42'}))
+
+        unchecked = {view.__name__ for view in budgeted_views() - self.checked}
+        self.assertFalse(unchecked, 'Бюджет запросов не проверяется тестом')
+
+
+class QueryPlanTests(TransactionTestCase):
+
+    # Команда обращается к API с HTTP_HOST=localhost, как при ручном запуске с DEBUG
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_no_sequential_scans_on_small_data(self):
+        # Команда откатывает свои данные и завершается ошибкой при полном просмотре горячей таблицы
+        call_command('check_query_plans', shops=2, products=50, offers=10, buyers=5, orders=1, stdout=StringIO())
+
+
+class FullImportTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create(email='full-shop@example.com', username='full-shop', user_type='shop',
+                                         is_active=True)
+        import_price_list(self.owner, goods((1, 5), (2, 5), (3, 5)), mode='full')
+        self.ordered = ProductInfo.objects.get(shop__user=self.owner, external_id=1)
+        buyer = User.objects.create(email='full-buyer@example.com', username='full-buyer', is_active=True)
+        OrderItem.objects.create(order=Order.objects.create(user=buyer, status='new'), product_info=self.ordered,
+                                 quantity=1, price=self.ordered.price)
+
+    def test_ordered_offer_updated_in_place(self):
+        for quantity in (7, 8, 9):
+            report = import_price_list(self.owner, goods((1, quantity), (2, 5), (3, 5)), mode='full')
+        offers = ProductInfo.objects.filter(shop__user=self.owner)
+        self.assertEqual(offers.count(), 3)
+        self.assertEqual(ProductCard.objects.filter(shop__user=self.owner).count(), 3)
+        self.ordered.refresh_from_db()
+        self.assertEqual((self.ordered.external_id, self.ordered.quantity), (1, 9))
+        self.assertEqual(ProductOfferStats.objects.get(product_id=self.ordered.product_id).offers_count, 1)
+        self.assertEqual((report['changes']['updated'], report['changes']['created']), (1, 2))
+
+    def test_ordered_offer_missing_from_feed_retired(self):
+        report = import_price_list(self.owner, goods((2, 5), (3, 5)), mode='full')
+        self.ordered.refresh_from_db()
+        self.assertEqual(self.ordered.quantity, 0)
+        self.assertEqual(report['changes']['retired'], 1)
+        self.assertEqual(ProductInfo.objects.filter(shop__user=self.owner).count(), 3)
+        import_price_list(self.owner, goods((1, 4), (2, 5), (3, 5)), mode='full')
+        self.ordered.refresh_from_db()
+        self.assertEqual(self.ordered.quantity, 4)
+        self.assertEqual(ProductInfo.objects.filter(shop__user=self.owner).count(), 3)
+
+
+class OrderTotalsTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create(email='totals-shop@example.com', username='totals-shop', user_type='shop',
+                                         is_active=True)
+        import_price_list(self.owner, goods((1, 5), (2, 5)))
+        self.buyer = User.objects.create(email='totals-buyer@example.com', username='totals-buyer', is_active=True)
+        self.contact = Contact.objects.create(user=self.buyer, city='Москва', street='Тверская', phone='+7 900')
+        self.offers = list(ProductInfo.objects.filter(shop__user=self.owner).order_by('external_id'))
+
+    def test_checkout_totals_use_locked_prices(self):
+        add_items(self.buyer.id, [{'product_info': offer.id, 'quantity': 2} for offer in self.offers])
+        # Цена изменена без пересчета корзины: итоги корзины устарели
+        ProductInfo.objects.filter(id=self.offers[0].id).update(price=1)
+        order = checkout(self.buyer.id, self.contact.id)
+        order.refresh_from_db()
+        self.assertEqual(order.total_sum, 2 * 1 + 2 * 200)
+        self.assertEqual(order.total_sum, sum(ShopOrder.objects.filter(order=order).values_list(
+            'total_sum', flat=True)))
+
+        ProductInfo.objects.filter(id=self.offers[1].id).update(price=999)
+        call_command('check_order_totals', status=['new'], stdout=StringIO())
+
+
+class CatalogDeletionTests(TestCase):
+    '''
+    Удаление строк каталога через админку обновляет производные данные, как и сохранение
+    '''
+
+    def setUp(self):
+        self.owner = User.objects.create(email='delete-shop@example.com', username='delete-shop', user_type='shop',
+                                         is_active=True)
+        import_price_list(self.owner, goods((1, 5), (2, 5)))
+        self.offer = ProductInfo.objects.get(shop__user=self.owner, external_id=1)
+
+    def card_parameters(self):
+        return ProductCard.objects.get(product_info=self.offer).parameters
+
+    def test_product_parameter_delete_rebuilds_card(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductParameter.objects.get(product_info=self.offer).delete()
+        self.assertEqual(self.card_parameters(), {})
+        self.assertEqual(ProductCard.objects.get(product_info=self.offer).data['product_parameters'], [])
+
+    def test_parameter_delete_rebuilds_cards(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Parameter.objects.get(name='Цвет').delete()
+        self.assertEqual(self.card_parameters(), {})
+
+    def test_product_info_delete_refreshes_offer_stats(self):
+        other = User.objects.create(email='delete-other@example.com', username='delete-other', user_type='shop',
+                                    is_active=True)
+        import_price_list(other, goods((1, 3)), name='Другой магазин')
+        stats = ProductOfferStats.objects.get(product_id=self.offer.product_id)
+        self.assertEqual((stats.offers_count, stats.total_quantity), (2, 8))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.offer.delete()
+        stats.refresh_from_db()
+        self.assertEqual((stats.offers_count, stats.total_quantity), (1, 3))
+
+    def test_delete_changes_catalog_versions(self):
+        shop_id = self.offer.shop_id
+        for delete in (lambda: ProductParameter.objects.filter(product_info=self.offer).delete(),
+                       lambda: self.offer.delete(),
+                       lambda: self.offer.shop.delete()):
+            versions = catalog_versions(), catalog_versions(shop_id)
+            with self.captureOnCommitCallbacks(execute=True):
+                delete()
+            self.assertNotEqual(versions[0], catalog_versions())
+            self.assertNotEqual(versions[1], catalog_versions(shop_id))
+
+
+class ImportJobTests(TransactionTestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create(email='job-shop@example.com', username='job-shop', user_type='shop',
+                                         is_active=True)
+        self.url = 'https://job-shop.example.com/feed.yaml'
+
+    def run_job(self, fetch):
+        @contextmanager
+        def fetch_feed(url, etag='', last_modified='', content_hash=''):
+            yield fetch
+
+        job = ImportJob.objects.create(user=self.owner, url=self.url)
+        with mock.patch('dbackend.jobs.fetch_feed', fetch_feed):
+            run_import_job(job.id)
+        job.refresh_from_db()
+        return job
+
+    def test_unchanged_body_saves_new_validators(self):
+        FeedSource.objects.create(user=self.owner, url=self.url, etag='"v1"', last_modified='Mon', content_hash='abc')
+        job = self.run_job(FeedFetch(None, '"v2"', 'Tue', 'abc', False))
+        self.assertEqual((job.status, job.phase), ('done', 'unchanged'))
+        source = FeedSource.objects.get(user=self.owner, url=self.url)
+        self.assertEqual((source.etag, source.last_modified, source.content_hash), ('"v2"', 'Tue', 'abc'))
+
+    def test_claimed_job_not_run_again(self):
+        job = ImportJob.objects.create(user=self.owner, url=self.url, status='running')
+        with mock.patch('dbackend.jobs.fetch_feed') as fetch_feed:
+            run_import_job(job.id)
+        fetch_feed.assert_not_called()
+        self.assertEqual(ImportJob.objects.get(id=job.id).status, 'running')
+
+
+class MetricsHeadersTests(TestCase):
+
+    def test_query_headers_only_in_debug(self):
+        self.assertNotIn('X-Query-Count', self.client.get('/shops/'))
+        with self.settings(DEBUG=True):
+            self.assertIn('X-Query-Count', self.client.get('/shops/'))
+
+
+class BasketTests(TestCase):
+
+    def setUp(self):
+        owner = User.objects.create(email='basket-shop@example.com', username='basket-shop', user_type='shop',
+                                    is_active=True)
+        closed = User.objects.create(email='basket-closed@example.com', username='basket-closed', user_type='shop',
+                                     is_active=True)
+        import_price_list(owner, goods((1, 5), (2, 5), (3, 5)))
+        import_price_list(closed, goods((4, 5)), name='Закрытый магазин', status=False)
+        self.offers = list(ProductInfo.objects.filter(shop__user=owner).order_by('external_id'))
+        self.closed_offer = ProductInfo.objects.get(shop__user=closed)
+        self.buyer = User.objects.create(email='basket-buyer@example.com', username='basket-buyer', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def lines(self):
+        return dict(OrderItem.objects.filter(order__user=self.buyer, order__status='basket').values_list(
+            'product_info_id', 'quantity'))
+
+    def add(self, *items):
+        return self.client.post('/basket/', {'items': [{'product_info': pk, 'quantity': quantity}
+                                                       for pk, quantity in items]}, format='json')
+
+    def test_all_items_stored(self):
+        first, second, third = (offer.id for offer in self.offers)
+        response = self.add((first, 2), (second, 3), (third, 1))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['Создано объектов'], 3)
+        self.assertEqual(self.lines(), {first: 2, second: 3, third: 1})
+
+        response = self.add((first, 1), (third, 4))
+        self.assertEqual(response.json()['Обновлено объектов'], 2)
+        self.assertEqual(self.lines(), {first: 3, second: 3, third: 5})
+        self.assertEqual(Order.objects.get(user=self.buyer, status='basket').items_count, 11)
+
+    def test_over_stock_rejected(self):
+        first, second = self.offers[0].id, self.offers[1].id
+        self.add((first, 4))
+        response = self.add((first, 2), (second, 1))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['Errors'], {str(first): 'Недостаточно товара, доступно 5'})
+        self.assertEqual(self.lines(), {first: 4})
+
+    def test_closed_shop_rejected(self):
+        response = self.add((self.offers[0].id, 1), (self.closed_offer.id, 1))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['Errors'], {str(self.closed_offer.id): 'Магазин не принимает заказы'})
+        self.assertEqual(self.lines(), {})
+
+
+class CheckoutTests(TestCase):
+
+    def setUp(self):
+        owner = User.objects.create(email='checkout-shop@example.com', username='checkout-shop', user_type='shop',
+                                    is_active=True)
+        import_price_list(owner, goods((1, 5), (2, 5)))
+        self.offers = list(ProductInfo.objects.filter(shop__user=owner).order_by('external_id'))
+        self.buyer = User.objects.create(email='checkout-buyer@example.com', username='checkout-buyer',
+                                         is_active=True)
+        self.contact = Contact.objects.create(user=self.buyer, city='Москва', street='Тверская', phone='+7 900')
+
+    def fill_basket(self):
+        add_items(self.buyer.id, [{'product_info': self.offers[0].id, 'quantity': 2},
+                                  {'product_info': self.offers[1].id, 'quantity': 3}])
+        return Order.objects.get(user=self.buyer, status='basket')
+
+    def stock(self):
+        return list(ProductInfo.objects.filter(id__in=[offer.id for offer in self.offers]).order_by(
+            'external_id').values_list('quantity', flat=True))
+
+    def test_checkout_decrements_stock(self):
+        basket = self.fill_basket()
+        order = checkout(self.buyer.id, self.contact.id)
+        self.assertEqual(order.id, basket.id)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'new')
+        self.assertEqual(order.contact_id, self.contact.id)
+        self.assertEqual(self.stock(), [3, 2])
+        self.assertEqual(set(ShopOrder.objects.filter(order=order).values_list('status', flat=True)), {'new'})
+
+    def test_insufficient_stock_rolls_back(self):
+        basket = self.fill_basket()
+        ProductInfo.objects.filter(id=self.offers[1].id).update(quantity=1)
+        with self.assertRaises(BasketError) as raised:
+            checkout(self.buyer.id, self.contact.id)
+        self.assertEqual(raised.exception.errors, {self.offers[1].id: 'Недостаточно товара, доступно 1'})
+        basket.refresh_from_db()
+        self.assertEqual(basket.status, 'basket')
+        self.assertEqual(self.stock(), [5, 1])
+
+    def test_empty_basket_rejected(self):
+        with self.assertRaises(BasketError) as raised:
+            checkout(self.buyer.id, self.contact.id)
+        self.assertEqual(raised.exception.errors, 'Корзина пуста')
+
+    def test_foreign_contact_rejected(self):
+        basket = self.fill_basket()
+        stranger = User.objects.create(email='checkout-other@example.com', username='checkout-other',
+                                       is_active=True)
+        contact = Contact.objects.create(user=stranger, city='Москва', street='Арбат', phone='+7 901')
+        with self.assertRaises(BasketError) as raised:
+            checkout(self.buyer.id, contact.id)
+        self.assertEqual(raised.exception.errors, 'Контакт не найден')
+        basket.refresh_from_db()
+        self.assertEqual(basket.status, 'basket')
+        self.assertEqual(self.stock(), [5, 5])
+
+
+class TransitionTests(TestCase):
+
+    def setUp(self):
+        self.shops = []
+        self.offers = []
+        for name in ('first', 'second'):
+            owner = User.objects.create(email=f'transition-{name}@example.com', username=f'transition-{name}',
+                                        user_type='shop', is_active=True)
+            import_price_list(owner, goods((1, 5)))
+            offer = ProductInfo.objects.get(shop__user=owner)
+            self.shops.append(offer.shop_id)
+            self.offers.append(offer.id)
+        self.buyer = User.objects.create(email='transition-buyer@example.com', username='transition-buyer',
+                                         is_active=True)
+        contact = Contact.objects.create(user=self.buyer, city='Москва', street='Тверская', phone='+7 900')
+        add_items(self.buyer.id, [{'product_info': pk, 'quantity': 2} for pk in self.offers])
+        self.order = checkout(self.buyer.id, contact.id)
+
+    def statuses(self):
+        self.order.refresh_from_db()
+        parts = dict(ShopOrder.objects.filter(order=self.order).values_list('shop_id', 'status'))
+        return self.order.status, [parts[shop_id] for shop_id in self.shops]
+
+    def stock(self):
+        quantities = dict(ProductInfo.objects.filter(id__in=self.offers).values_list('id', 'quantity'))
+        return [quantities[pk] for pk in self.offers]
+
+    def test_disallowed_source_skipped(self):
+        first = self.shops[0]
+        self.assertEqual(transition_orders(first, self.buyer.id, [self.order.id], 'sent'), ([], [self.order.id]))
+        self.assertEqual(self.statuses(), ('new', ['new', 'new']))
+        self.assertFalse(OrderStatusHistory.objects.filter(order=self.order).exists())
+
+    def test_only_shop_part_moves(self):
+        first, second = self.shops
+        self.assertEqual(transition_orders(first, self.buyer.id, [self.order.id], 'confirmed'),
+                         ([self.order.id], []))
+        # Статус заказа - наименее продвинутая из активных частей
+        self.assertEqual(self.statuses(), ('new', ['confirmed', 'new']))
+        transition_orders(second, self.buyer.id, [self.order.id], 'confirmed')
+        self.assertEqual(self.statuses(), ('confirmed', ['confirmed', 'confirmed']))
+        transition_orders(first, self.buyer.id, [self.order.id], 'assembled')
+        self.assertEqual(self.statuses(), ('confirmed', ['assembled', 'confirmed']))
+
+    def test_cancel_restores_shop_stock(self):
+        first, second = self.shops
+        self.assertEqual(self.stock(), [3, 3])
+        transition_orders(first, self.buyer.id, [self.order.id], 'canceled')
+        self.assertEqual(self.stock(), [5, 3])
+        self.assertEqual(self.statuses(), ('new', ['canceled', 'new']))
+
+        transition_orders(second, self.buyer.id, [self.order.id], 'canceled')
+        self.assertEqual(self.stock(), [5, 5])
+        self.assertEqual(self.statuses(), ('canceled', ['canceled', 'canceled']))
+        self.assertEqual(list(OrderStatusHistory.objects.filter(order=self.order).order_by('id').values_list(
+            'shop_id', 'status_from', 'status_to', 'user_id')),
+            [(first, 'new', 'canceled', self.buyer.id), (second, 'new', 'canceled', self.buyer.id)])
+
+
+class OutboxDeliveryTests(TestCase):
+
+    def setUp(self):
+        OutboxEmail.objects.bulk_create([
+            OutboxEmail(subject=f'Письмо {number}', body='Текст', from_email='shop@example.com',
+                        to=[f'buyer{number}@example.com']) for number in range(3)])
+
+    def emails(self):
+        return list(OutboxEmail.objects.order_by('id'))
+
+    def test_batch_sent(self):
+        connection = get_connection('django.core.mail.backends.locmem.EmailBackend')
+        self.assertEqual(deliver_batch(connection, batch_size=2), (2, 0, True))
+        self.assertEqual([email.status for email in self.emails()], ['sent', 'sent', 'queued'])
+        self.assertEqual([message.to for message in mail.outbox], [['buyer0@example.com'], ['buyer1@example.com']])
+        self.assertEqual(deliver_batch(connection), (1, 0, True))
+        self.assertEqual(deliver_batch(connection), (0, 0, True))
+
+    def test_backoff_until_failed(self):
+        connection = mock.Mock()
+        connection.send_messages.side_effect = SMTPException('Отказ сервера')
+        for attempt in range(1, OUTBOX_MAX_ATTEMPTS + 1):
+            before = timezone.now()
+            with self.assertLogs('dbackend.mail', 'WARNING'):
+                self.assertEqual(deliver_batch(connection), (0, 3, True))
+            # Срок следующей попытки еще не наступил
+            self.assertEqual(deliver_batch(connection), (0, 0, True))
+            for email in self.emails():
+                self.assertEqual(email.attempts, attempt)
+                self.assertEqual(email.error, 'Отказ сервера')
+                if attempt < OUTBOX_MAX_ATTEMPTS:
+                    self.assertEqual(email.status, 'queued')
+                    self.assertGreaterEqual(email.next_attempt_at,
+                                            before + timedelta(seconds=OUTBOX_RETRY_DELAY * 2 ** (attempt - 1)))
+            OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual({email.status for email in self.emails()}, {'failed'})
+        self.assertEqual(deliver_batch(connection), (0, 0, True))
+
+    def test_connection_failure_defers_batch(self):
+        connection = mock.Mock()
+        connection.open.side_effect = OSError('Соединение отклонено')
+        with self.assertLogs('dbackend.mail', 'ERROR'):
+            self.assertEqual(deliver_batch(connection), (0, 3, False))
+        connection.send_messages.assert_not_called()
+        for email in self.emails():
+            self.assertEqual((email.status, email.attempts), ('queued', 1))
+            self.assertGreater(email.next_attempt_at, timezone.now())
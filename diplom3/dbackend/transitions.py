@@ -0,0 +1,85 @@
+from django.db import transaction
+from django.db.models import Case, F, Sum, Value, When
+
+from dbackend.models import ORDER_TRANSITIONS, Order, OrderItem, OrderStatusHistory, ProductInfo, ShopOrder
+from dbackend.notifications import notify_status_changed
+from dbackend.shop_orders import order_status
+from dbackend.signals import stock_updated
+
+TRANSITION_MAX_IDS = 1000
+
+
+def status_sources(status):
+    '''
+    Статусы, из которых разрешен переход в status
+    '''
+    return [source for source, targets in ORDER_TRANSITIONS.items() if status in targets]
+
+
+def release_stock(order_ids, shop_id=None):
+    '''
+    Возврат в остатки товаров отмененных заказов, с shop_id - только товаров этого магазина.
+    Позиции блокируются в порядке id, как при оформлении.
+    '''
+    items = OrderItem.objects.filter(order_id__in=order_ids)
+    if shop_id is not None:
+        items = items.filter(product_info__shop_id=shop_id)
+    released = dict(items.values('product_info_id').annotate(total=Sum('quantity')).values_list(
+        'product_info_id', 'total'))
+    if not released:
+        return
+    offers = list(ProductInfo.objects.select_for_update().filter(id__in=released).order_by('id').values_list(
+        'id', 'shop_id', 'product_id'))
+    returned = Case(*[When(id=pk, then=quantity) for pk, quantity in released.items()])
+    ProductInfo.objects.filter(id__in=released).update(quantity=F('quantity') + returned)
+    shop_ids = sorted({shop_id for _, shop_id, _ in offers})
+    product_ids = sorted({product_id for _, _, product_id in offers})
+    transaction.on_commit(lambda: stock_updated.send(
+        sender=release_stock, shop_ids=shop_ids, product_info_ids=sorted(released), product_ids=product_ids))
+
+
+def transition_orders(shop_id, user_id, order_ids, status):
+    '''
+    Перевод заказов магазина shop_id в статус status: меняется только часть заказа этого магазина,
+    статус всего заказа выводится из статусов всех его частей. Заказы, часть которых в недопустимом
+    статусе, пропускаются. Возвращает (id переведенных заказов, id пропущенных).
+    '''
+    sources = status_sources(status)
+    if not sources:
+        raise ValueError(f'В статус {status} нельзя перевести заказ')
+    order_ids = set(order_ids)
+    if not order_ids or len(order_ids) > TRANSITION_MAX_IDS:
+        raise ValueError(f'Укажите от 1 до {TRANSITION_MAX_IDS} id заказов')
+
+    with transaction.atomic():
+        # Блокировка заказов в порядке id: одновременные переходы частей одного заказа выполняются по очереди
+        orders = dict(Order.objects.select_for_update().filter(
+            id__in=ShopOrder.objects.filter(shop_id=shop_id, order_id__in=order_ids).values('order_id')).order_by(
+            'id').values_list('id', 'status'))
+        parts = {}
+        for order_id, part_shop_id, part_status in ShopOrder.objects.filter(order_id__in=orders).values_list(
+                'order_id', 'shop_id', 'status'):
+            parts.setdefault(order_id, {})[part_shop_id] = part_status
+        current = {pk: parts[pk][shop_id] for pk in orders if parts[pk][shop_id] in sources}
+        moved = sorted(current)
+        if moved:
+            ShopOrder.objects.filter(shop_id=shop_id, order_id__in=moved).update(status=status)
+            changed = {}
+            for pk in moved:
+                parts[pk][shop_id] = status
+                derived = order_status(parts[pk].values())
+                if derived != orders[pk]:
+                    changed[pk] = derived
+            if changed:
+                Order.objects.filter(id__in=changed).update(status=Case(
+                    *[When(id=pk, then=Value(derived)) for pk, derived in changed.items()]))
+            OrderStatusHistory.objects.bulk_create([
+                OrderStatusHistory(order_id=pk, shop_id=shop_id, status_from=current[pk], status_to=status,
+                                   user_id=user_id)
+                for pk in moved])
+            if status == 'canceled':
+                release_stock(moved, shop_id)
+            # Покупатель получает письмо, когда меняется статус всего заказа
+            for derived in sorted(set(changed.values())):
+                notify_status_changed([pk for pk in changed if changed[pk] == derived], derived)
+    return moved, sorted(order_ids - current.keys())
@@ -1,25 +1,46 @@
 import json
+from datetime import datetime, time
 
-from django.db import IntegrityError
-from django.db.models import Q, Sum, F
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
-from requests import get, post
 from rest_framework import generics
 from rest_framework.generics import ListAPIView
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from yaml import load, Loader
 from rest_framework.decorators import (
     permission_classes,
 )
 from rest_framework import permissions
 
-from dbackend.Permissions import OwnerPermission
-from dbackend.models import Shop, Category, ProductInfo, Product, Parameter, ProductParameter, Order, OrderItem
-from dbackend.serializers import ShopSerializer, CategorySerializer, ProductSerializer, ProductInfoSerializer, \
-    OrderItemSerializer, OrderSerializer
+from dbackend.Permissions import OwnerPermission, LocalOrAdminPermission
+from dbackend.accounts import activate_user, confirm_password_reset, djoser_response_text
+from dbackend.basket import BasketError, add_items, update_items, delete_items, checkout, order_totals
+from dbackend.cache import cached_catalog_response
+from dbackend.cards import build_card, card_queryset
+from dbackend.facets import facet_index
+from dbackend.importer import IMPORT_MODES
+from dbackend.jobs import enqueue_import
+from dbackend.metrics import metrics
+from dbackend.pagination import ProductCardCursorPagination, ShopOrderCursorPagination
+from dbackend.rendering import UJSONRenderer, orders_data
+from dbackend.search import search_products
+from dbackend.shop_orders import shop_order_data
+from dbackend.transitions import transition_orders
+from dbackend.models import Shop, Category, ProductInfo, Product, Order, ImportJob, \
+    ProductCard, ProductOfferStats, ShopOrder, STATE_CHOICES
+from dbackend.serializers import ShopSerializer, CategorySerializer, ProductSerializer, \
+    OrderSerializer, ImportJobSerializer, ProductOfferStatsSerializer
+
+
+EXPORT_CHUNK_SIZE = 2000
+SEARCH_LIMIT = 50
+SEARCH_MAX_LIMIT = 500
+OFFERS_MAX_IDS = 500
+ORDER_STATUSES = {status for status, _ in STATE_CHOICES} - {'basket'}
 
 
 class BaseUpdate(APIView):
@@ -38,31 +59,23 @@ class BaseUpdate(APIView):
 
         if url == None:
             return JsonResponse({'error': 'No URL'})
-        stream = get(url).content
-        read_data = load(stream, Loader=Loader)
-        for item in read_data.get('shop'):
-            shop, created = Shop.objects.get_or_create(name=item['name'], url=item['url'], status=item['status'],
-                                                       user_id=request.user.id)
-        for category in read_data['categories']:
-            category_object, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-            category_object.shops.add(shop.id)
-            category_object.save()
-        ProductInfo.objects.filter(shop_id=shop.id).delete()
-        for item in read_data['goods']:
-            product, created = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
-
-            product_info = ProductInfo.objects.create(product_id=product.id,
-                                                      name=item['model'],
-                                                      price=item['price'],
-                                                      price_rrc=item['price_rrc'],
-                                                      quantity=item['quantity'],
-                                                      shop_id=shop.id)
-            for name, value in item['parameters'].items():
-                parameter_object, _ = Parameter.objects.get_or_create(name=name)
-                ProductParameter.objects.create(product_info_id=product_info.id,
-                                                parameter_id=parameter_object.id,
-                                                value=value)
-        return JsonResponse({'status': 'created'})
+        mode = request.data.get('mode', 'sync')
+        if mode not in IMPORT_MODES:
+            return JsonResponse({'Status': False, 'Error': f'Режим импорта должен быть одним из {IMPORT_MODES}'})
+        force = str(request.data.get('force', '')).lower() in ('1', 'true')
+        job = enqueue_import(request.user.id, url, mode, force)
+        return JsonResponse({'Status': True, 'job': job.id}, status=202)
+
+
+class ImportJobView(generics.RetrieveAPIView):
+    '''
+    Состояние задачи импорта
+    '''
+    serializer_class = ImportJobSerializer
+    query_budget = 2
+
+    def get_queryset(self):
+        return ImportJob.objects.filter(user_id=self.request.user.id)
 
 
 class ShopsList(ListAPIView):
@@ -72,6 +85,11 @@ class ShopsList(ListAPIView):
     queryset = Shop.objects.all()
     serializer_class = ShopSerializer
     filterset_fields = ['status', ]
+    query_budget = 3
+
+    @cached_catalog_response()
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
 
 class CategoryView(ListAPIView):
@@ -80,14 +98,24 @@ class CategoryView(ListAPIView):
     '''
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    query_budget = 3
+
+    @cached_catalog_response()
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
 
 class ProductView(ListAPIView):
     '''
     Список всех товаров
     '''
-    queryset = Product.objects.all()
+    queryset = ProductSerializer.setup_eager_loading(Product.objects.all())
     serializer_class = ProductSerializer
+    query_budget = 3
+
+    @cached_catalog_response()
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
 
 class ProductInShop(APIView):
@@ -95,15 +123,134 @@ class ProductInShop(APIView):
     Список товаров в конкретном магазине
     '''
 
+    pagination_class = ProductCardCursorPagination
+    renderer_classes = [UJSONRenderer, BrowsableAPIRenderer]
+    query_budget = 3
+
+    @cached_catalog_response(shop_kwarg='pk')
+    def get(self, request, *args, **kwargs):
+        pk = kwargs.get('pk')
+        cards = ProductCard.objects.filter(shop_id=pk).values('product_info_id', 'data')
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(cards, request, view=self)
+        return paginator.get_paginated_response([card['data'] for card in page])
+
+
+class ShopCatalogExport(APIView):
+    '''
+    Выгрузка всех товаров магазина потоком: JSON-массив или NDJSON (?mode=ndjson).
+    Позиции читаются курсором пакетами по EXPORT_CHUNK_SIZE, параметры подгружаются на каждый пакет.
+    '''
+
+    query_budget = 1
+
     def get(self, request, *args, **kwargs):
         pk = kwargs.get('pk')
-        query = Q(shop_id=pk)
+        mode = request.query_params.get('mode', 'json')
+        if mode not in ('json', 'ndjson'):
+            return JsonResponse({'Status': False, 'Error': 'mode должен быть json или ndjson'}, status=400)
+        product_infos = card_queryset(ProductInfo.objects.filter(shop_id=pk).order_by('id'))
+        cards = (build_card(product_info, product_info.product_parameters.all())
+                 for product_info in product_infos.iterator(chunk_size=EXPORT_CHUNK_SIZE))
+        if mode == 'ndjson':
+            response = StreamingHttpResponse(_ndjson_lines(cards), content_type='application/x-ndjson')
+        else:
+            response = StreamingHttpResponse(_json_array(cards), content_type='application/json')
+        response['Content-Disposition'] = f'attachment; filename="shop-{pk}.{mode}"'
+        return response
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield _dumps(row) + '\n'
+
+
+def _json_array(rows):
+    separator = '['
+    for row in rows:
+        yield separator + _dumps(row)
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+class FacetSearch(APIView):
+    '''
+    Поиск товаров по характеристикам.
+    Параметры: category, shop, price_min, price_max, limit,
+    param=<параметр>:<значение> и range=<параметр>:<от>:<до> (границы можно не указывать), оба повторяемые.
+    Возвращает количество, первые limit карточек и количество позиций по каждому значению параметров.
+    '''
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params
         try:
-            queryset = ProductInfo.objects.filter(query)
-            serializer = ProductInfoSerializer(queryset, many=True)
-            return Response(serializer.data)
-        except:
-            return JsonResponse({'error': 'Shop not found'})
+            filters = {
+                'shop': _optional(query.get('shop'), int),
+                'category': _optional(query.get('category'), int),
+                'price_min': _optional(query.get('price_min'), int),
+                'price_max': _optional(query.get('price_max'), int),
+                'limit': min(int(query.get('limit', SEARCH_LIMIT)), SEARCH_MAX_LIMIT),
+                'equals': [tuple(item.split(':', 1)) for item in query.getlist('param')],
+                'ranges': [],
+            }
+            for item in query.getlist('range'):
+                name, low, high = item.rsplit(':', 2)
+                filters['ranges'].append((name, _optional(low, float), _optional(high, float)))
+            if any(len(item) != 2 for item in filters['equals']):
+                raise ValueError
+        except ValueError:
+            return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'}, status=400)
+
+        count, ids, facets = facet_index.search(**filters)
+        cards = ProductCard.objects.filter(product_info_id__in=ids).order_by('product_info_id').values_list(
+            'data', flat=True)
+        return Response({'count': count, 'results': list(cards), 'facets': facets})
+
+
+class ProductSearch(APIView):
+    '''
+    Поиск товаров по названию продукта и модели с учетом морфологии, начала слов и опечаток.
+    Параметры: q, shop, limit. Возвращает карточки по убыванию релевантности.
+    '''
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params
+        try:
+            shop = _optional(query.get('shop'), int)
+            limit = min(int(query.get('limit', SEARCH_LIMIT)), SEARCH_MAX_LIMIT)
+        except ValueError:
+            return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'}, status=400)
+        text = query.get('q', '').strip()
+        if not text:
+            return JsonResponse({'Status': False, 'Errors': 'Не указан текст запроса'}, status=400)
+
+        found = search_products(text, shop=shop, limit=limit)
+        cards = dict(ProductCard.objects.filter(product_info_id__in=[pk for pk, _ in found]).values_list(
+            'product_info_id', 'data'))
+        results = [dict(cards[pk], rank=round(rank, 4)) for pk, rank in found if pk in cards]
+        return Response({'count': len(results), 'results': results})
+
+
+def _optional(value, cast):
+    return cast(value) if value not in (None, '') else None
+
+
+@permission_classes([LocalOrAdminPermission])
+class MetricsView(APIView):
+    '''
+    Показатели запросов к базе по обработчикам, накопленные с запуска процесса.
+    Параметр reset=1 обнуляет их после выдачи.
+    '''
+
+    def get(self, request, *args, **kwargs):
+        data = metrics.snapshot()
+        if request.query_params.get('reset') == '1':
+            metrics.reset()
+        return Response(data)
 
 
 @permission_classes([permissions.AllowAny])
@@ -112,14 +259,10 @@ class UserActivationView(APIView):
     Активация пользователя через почту
     '''
 
+    query_budget = 2
+
     def get(self, request, uid, token):
-        protocol = 'https://' if request.is_secure() else 'http://'
-        web_url = protocol + request.get_host()
-        post_url = web_url + "/auth/users/activation/"
-        post_data = {'uid': uid, 'token': token}
-        result = post(post_url, data=post_data)
-        content = result.text
-        return Response(content)
+        return Response(djoser_response_text(activate_user, request, uid, token))
 
 
 @permission_classes([permissions.AllowAny])
@@ -128,14 +271,14 @@ class UserResetPasswordView(APIView):
     Подтверждение восстановления пароля
     '''
 
+    query_budget = 2
+
     def get(self, request, uid, token):
-        protocol = 'https://' if request.is_secure() else 'http://'
-        web_url = protocol + request.get_host()
-        post_url = web_url + "/auth/users/reset_password_confirm/"
-        post_data = {'uid': uid, 'token': token}
-        result = post(post_url, data=post_data)
-        content = result.text
-        return Response(content)
+        return Response(djoser_response_text(confirm_password_reset, request, {'uid': uid, 'token': token}))
+
+    def post(self, request, uid, token):
+        data = {'new_password': request.data.get('new_password'), 'uid': uid, 'token': token}
+        return Response(djoser_response_text(confirm_password_reset, request, data))
 
 
 @permission_classes([IsAuthenticated, OwnerPermission, ])
@@ -145,102 +288,190 @@ class ChangeShopStatus(generics.UpdateAPIView):
 
 
 class AboutProduct(APIView):
+    query_budget = 3
+
+    @cached_catalog_response(stock=True)
     def get(self, request, *args, **kwargs):
         pk = kwargs.get('pk')
-        queryset = ProductInfo.objects.filter(product_id=pk)
-        if len(queryset) == 0:
+        cards = list(ProductCard.objects.filter(product_id=pk).order_by('product_info_id').values_list(
+            'data', flat=True))
+        if len(cards) == 0:
             return JsonResponse({'error': f'Товар с id={pk} не найден'})
-        serializer = ProductInfoSerializer(queryset, many=True)
-        return Response(serializer.data)
+        return Response(cards)
+
+
+class ProductOffers(APIView):
+    '''
+    Сводка цен и лучшее предложение по продукту (offers/<id>/) или по списку продуктов (offers/?ids=1,2,3)
+    '''
+
+    query_budget = 3
+
+    @cached_catalog_response(stock=True)
+    def get(self, request, *args, **kwargs):
+        pk = kwargs.get('pk')
+        if pk is not None:
+            stats = ProductOfferStats.objects.filter(product_id=pk).first()
+            if stats is None:
+                return JsonResponse({'Status': False, 'Error': f'Предложения для товара с id={pk} не найдены'},
+                                    status=404)
+            return Response(ProductOfferStatsSerializer(stats).data)
+
+        try:
+            ids = {int(item) for item in request.query_params.get('ids', '').split(',') if item.strip()}
+        except ValueError:
+            return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'}, status=400)
+        if not ids or len(ids) > OFFERS_MAX_IDS:
+            return JsonResponse({'Status': False, 'Errors': f'Укажите от 1 до {OFFERS_MAX_IDS} id товаров'},
+                                status=400)
+        stats = ProductOfferStats.objects.filter(product_id__in=ids).order_by('product_id')
+        return Response(ProductOfferStatsSerializer(stats, many=True).data)
 
 
 class Basket(APIView):
+    renderer_classes = [UJSONRenderer, BrowsableAPIRenderer]
+    # Первое добавление создает корзину: вставка в точке сохранения - еще три запроса
+    query_budget = {'GET': 5, 'POST': 10, 'PUT': 7, 'DELETE': 6}
 
     def post(self, request, *args, **kwargs):
-
-        items_string = request.data.get('items')
-        items_dict = json.loads(items_string)
-        basket, _ = Order.objects.get_or_create(user_id=request.user.id, status='basket')
-        objects_created = 0
-        for order_item in items_dict:
-            order_item.update({'order': basket.id})
-            serializer = OrderItemSerializer(data=order_item)
-            if serializer.is_valid():
-                try:
-                    serializer.save()
-                except IntegrityError as error:
-                    return JsonResponse({'Status': False, 'Errors': str(error)})
-                else:
-                    objects_created += 1
-
-            else:
-
-                return JsonResponse({'Status': False, 'Errors': serializer.errors})
-            return JsonResponse({'Status': True, 'Создано объектов': objects_created})
-        return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
+        try:
+            created, updated, totals = add_items(request.user.id, request.data.get('items'))
+        except BasketError as error:
+            return JsonResponse({'Status': False, 'Errors': error.errors}, status=400)
+        return JsonResponse({'Status': True, 'Создано объектов': created, 'Обновлено объектов': updated, **totals})
 
     def delete(self, request, *args, **kwargs):
-
-        items_sting = request.data.get('items')
-        if items_sting:
-            items_list = items_sting.split(',')
-            basket, _ = Order.objects.get_or_create(user_id=request.user.id, status='basket')
-            query = Q()
-            objects_deleted = False
-            for order_item_id in items_list:
-                if order_item_id.isdigit():
-                    query = query | Q(order_id=basket.id, id=order_item_id)
-                    objects_deleted = True
-
-            if objects_deleted:
-                deleted_count = OrderItem.objects.filter(query).delete()[0]
-                return JsonResponse({'Status': True, 'Удалено объектов': deleted_count})
-        return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
+        try:
+            deleted, totals = delete_items(request.user.id, request.data.get('items'))
+        except BasketError as error:
+            return JsonResponse({'Status': False, 'Errors': error.errors}, status=400)
+        return JsonResponse({'Status': True, 'Удалено объектов': deleted, **totals})
 
     def get(self, request, *args, **kwargs):
-        basket = Order.objects.filter(
-            user_id=request.user.id, status='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-
-        serializer = OrderSerializer(basket, many=True)
-        return Response(serializer.data)
+        return Response(orders_data(Order.objects.filter(user_id=request.user.id, status='basket')))
 
     def put(self, request, *args, **kwargs):
-        items_sting = request.data.get('items')
-        if items_sting:
+        try:
+            updated, totals = update_items(request.user.id, request.data.get('items'))
+        except BasketError as error:
+            return JsonResponse({'Status': False, 'Errors': error.errors}, status=400)
+        return JsonResponse({'Status': True, 'Обновлено объектов': updated, **totals})
+
+
+class BasketCheckout(APIView):
+    '''
+    Оформление корзины: contact - id контакта пользователя или данные нового контакта
+    '''
+
+    # Вместе с фиксацией цен, заказами магазинов, письмами и обновлением карточек, сводок предложений
+    # и версий остатков после фиксации
+    query_budget = 29
+
+    def post(self, request, *args, **kwargs):
+        contact = request.data.get('contact')
+        if contact is None:
+            return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'}, status=400)
+        if isinstance(contact, str) and contact.lstrip().startswith('{'):
             try:
-                items_dict = json.loads(items_sting)
+                contact = json.loads(contact)
             except ValueError:
-                return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'})
-            else:
-                basket, _ = Order.objects.get_or_create(user_id=request.user.id, status='basket')
-                objects_updated = 0
-                for order_item in items_dict:
-                    if type(order_item['id']) == int and type(order_item['quantity']) == int:
-                        objects_updated += OrderItem.objects.filter(order_id=basket.id, id=order_item['id']).update(
-                            quantity=order_item['quantity'])
-
-                return JsonResponse({'Status': True, 'Обновлено объектов': objects_updated})
-        return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
+                return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'}, status=400)
+        try:
+            order = checkout(request.user.id, contact)
+        except BasketError as error:
+            return JsonResponse({'Status': False, 'Errors': error.errors}, status=400)
+        return JsonResponse({'Status': True, 'id': order.id, 'status': order.status, **order_totals(order)})
 
 
 @permission_classes([IsAuthenticated, OwnerPermission])
 class GetMyOrder(ListAPIView):
-    queryset = Order
     serializer_class = OrderSerializer
 
+    def get_queryset(self):
+        return OrderSerializer.setup_eager_loading(Order.objects.filter(
+            user_id=self.request.user.id).exclude(status='basket')).order_by('id')
+
 
 class PartnerOrders(APIView):
+    '''
+    Заказы магазина с итогами только по его позициям, постранично от новых к старым.
+    Фильтры: status - статусы через запятую, date_from и date_to - дата или дата и время заказа.
+    '''
+
+    pagination_class = ShopOrderCursorPagination
+    renderer_classes = [UJSONRenderer, BrowsableAPIRenderer]
+    query_budget = 2
+
     def get(self, request, *args, **kwargs):
         if request.user.user_type != 'shop':
             return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
-        order = Order.objects.filter(
-            ordered_items__product_info__shop__user_id=request.user.id).exclude(status='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-
-        serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+        shop_orders = ShopOrder.objects.filter(shop__user_id=request.user.id)
+
+        statuses = [status for status in request.query_params.get('status', '').split(',') if status]
+        if statuses:
+            if not set(statuses) <= ORDER_STATUSES:
+                return JsonResponse({'Status': False, 'Errors': f'Статус должен быть одним из {sorted(ORDER_STATUSES)}'},
+                                    status=400)
+            shop_orders = shop_orders.filter(status__in=statuses)
+        for param, lookup in (('date_from', 'dt__gte'), ('date_to', 'dt__lte')):
+            value = request.query_params.get(param)
+            if value:
+                moment = _parse_moment(value, end_of_day=param == 'date_to')
+                if moment is None:
+                    return JsonResponse({'Status': False, 'Errors': f'Неверный формат {param}'}, status=400)
+                shop_orders = shop_orders.filter(**{lookup: moment})
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(shop_orders.values(
+            'order_id', 'status', 'dt', 'items_count', 'total_sum', 'lines', 'contact'), request, view=self)
+        return paginator.get_paginated_response([
+            shop_order_data(row['order_id'], row['status'], row['dt'], row['items_count'], row['total_sum'],
+                            row['lines'], row['contact']) for row in page])
+
+
+class PartnerOrdersStatus(APIView):
+    '''
+    Перевод заказов магазина в новый статус: ids - список id или строка id через запятую, status - новый статус
+    '''
+
+    # Отмена возвращает остатки и обновляет карточки, сводки предложений и версии остатков после фиксации
+    query_budget = 22
+
+    def post(self, request, *args, **kwargs):
+        if request.user.user_type != 'shop':
+            return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
+        shop = Shop.objects.filter(user_id=request.user.id).first()
+        if shop is None:
+            return JsonResponse({'Status': False, 'Error': 'Магазин не найден'}, status=404)
+        ids, status = request.data.get('ids'), request.data.get('status')
+        if not ids or not status:
+            return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'}, status=400)
+        if isinstance(ids, str):
+            ids = ids.split(',')
+        try:
+            ids = {int(pk) for pk in ids}
+        except (TypeError, ValueError):
+            return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'}, status=400)
+        try:
+            moved, skipped = transition_orders(shop.id, request.user.id, ids, status)
+        except ValueError as error:
+            return JsonResponse({'Status': False, 'Errors': str(error)}, status=400)
+        return JsonResponse({'Status': True, 'Обновлено объектов': len(moved), 'Не изменены': skipped})
+
+
+def _parse_moment(value, end_of_day=False):
+    '''
+    Дата или дата и время из параметра запроса; дата без времени - начало или конец дня
+    '''
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                return None
+            moment = datetime.combine(day, time.max if end_of_day else time.min)
+    except ValueError:
+        return None
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
@@ -35,6 +35,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'dbackend.apps.DbackendConfig',
     'rest_framework',
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'dbackend.metrics.QueryMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -129,7 +131,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'dbackend.User'
 
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Письма сохраняются в очередь OutboxEmail в транзакции запроса и отправляются командой send_outbox
+# через OUTBOX_DELIVERY_BACKEND
+EMAIL_BACKEND = 'dbackend.mail.OutboxEmailBackend'
+OUTBOX_DELIVERY_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Писем в одной пачке, попыток отправки и задержка перед первой повторной попыткой в секундах
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = 60
+# Таймаут соединения с почтовым сервером в секундах: без него недоступный сервер держит обработчик очереди
+EMAIL_TIMEOUT = 10
 # EMAIL_USE_TLS = False
 
 EMAIL_HOST = 'smtp.mail.ru'
@@ -149,6 +160,55 @@ REST_FRAMEWORK = {
 
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'],
+
+    'DEFAULT_PAGINATION_CLASS': 'dbackend.pagination.CatalogCursorPagination',
+    'PAGE_SIZE': 100,
+}
+
+# Кэш ответов каталога: LRU по числу записей в памяти процесса, ключи содержат версию каталога.
+# Версии каталога хранятся в базе (CatalogVersion), общей для всех процессов сервера, импорта и фоновых задач.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+}
+
+# Количество потоков, выполняющих импорт прайс-листов в фоне
+IMPORT_WORKERS = 2
+
+# Сколько одинаковых запросов к базе за один http запрос считается признаком N+1
+REPEATED_QUERY_THRESHOLD = 5
+
+# /metrics/ доступен администраторам. Доступ без входа с 127.0.0.1 включать только без обратного прокси,
+# иначе показатели с текстами SQL увидят все клиенты
+METRICS_ALLOW_LOCAL = False
+# Заголовки X-Query-Count и X-Query-Budget в ответах без DEBUG, например для нагрузочного стенда
+METRICS_QUERY_HEADERS = False
+
+# Показатели каждого запроса пишутся в лог dbackend.metrics строкой JSON
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'dbackend.metrics': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
 }
 
 DJOSER = {
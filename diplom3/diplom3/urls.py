@@ -18,7 +18,9 @@ from django.contrib import admin
 from django.urls import path, include, re_path
 
 from dbackend.views import BaseUpdate, ShopsList, CategoryView, ProductView, ProductInShop, UserActivationView, \
-    UserResetPasswordView, ChangeShopStatus, AboutProduct, Basket, PartnerOrders
+    UserResetPasswordView, ChangeShopStatus, AboutProduct, Basket, PartnerOrders, ImportJobView, \
+    ShopCatalogExport, FacetSearch, ProductSearch, ProductOffers, \
+    MetricsView, BasketCheckout, PartnerOrdersStatus
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -36,16 +38,25 @@ urlpatterns = [
     # сброс пароля (необходимо передавать "new_password").
 
     path('update/', BaseUpdate.as_view()),  # обновить базу
+    path('update/<int:pk>/', ImportJobView.as_view()),  # состояние задачи обновления базы
     path('shops/', ShopsList.as_view()),  # все магазины
     path('shops/?status=True', ShopsList.as_view()),  # все магазины принимающие заказы
     path('categories/', CategoryView.as_view()),  # все категории
     path('products/', ProductView.as_view()),  # все продукты
     path('shop/<int:pk>/', ProductInShop.as_view()),  # все продукты в магазине
+    path('shop/<int:pk>/export/', ShopCatalogExport.as_view()),  # выгрузка всех продуктов магазина потоком
     path('shop_status/<int:pk>', ChangeShopStatus.as_view()),  # все продукты в магазине
     path('about_product/<int:pk>', AboutProduct.as_view()), # Информация о конкретном товаре
+    path('search/facets/', FacetSearch.as_view()),  # Поиск товаров по характеристикам
+    path('search/', ProductSearch.as_view()),  # Поиск товаров по названию
+    path('offers/', ProductOffers.as_view()),  # Сводка предложений по списку товаров
+    path('offers/<int:pk>/', ProductOffers.as_view()),  # Сводка предложений по товару
     path('basket/', Basket.as_view()),  # Корзина
+    path('basket/checkout/', BasketCheckout.as_view()),  # Оформление корзины в заказ
+    path('metrics/', MetricsView.as_view()),  # Показатели запросов к базе, только для администратора
     path('my_orders/', Basket.as_view()),  # Мои заказы
-    path('byers_orders/', PartnerOrders.as_view()) # Получить заказы
+    path('byers_orders/', PartnerOrders.as_view()), # Получить заказы
+    path('byers_orders/status/', PartnerOrdersStatus.as_view()),  # Перевести заказы магазина в новый статус
 
 
 